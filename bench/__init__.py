@@ -0,0 +1,6 @@
+"""Benchmarks of the API
+
+bench.seed fills the database with a synthetic catalogue, bench.run drives
+the endpoints of API.md against a running server and reports the latencies.
+Both run from the root of the repository with PYTHONPATH=src.
+"""
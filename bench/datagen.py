@@ -0,0 +1,213 @@
+"""Generate a large synthetic catalogue with COPY
+
+    PYTHONPATH=src python3 -m bench.datagen --ingredients 1000000 \\
+        --recipes 2000000 --ingredients-per-recipe 8 --zipf 1.1
+
+Like bench.seed the tables are emptied first and the names follow the misc/
+payloads (ingredient_<id>, utensil_<id>, recipe_<id>), but the rows are
+streamed to COPY so millions of them fit in neither the memory nor the time
+of multi-rows INSERT. The shape of the data is controlled by:
+
+* the number of ingredients (utensils) per recipe, a normal distribution of
+the given mean and standard deviation, at least 1
+* the popularity of the ingredients (utensils), Zipfian of exponent --zipf
+(0 for uniform), the lower ids are the most popular ones
+* the size of the directions JSONB, a number of steps (uniform between 1
+and twice --steps) of --step-words words each
+"""
+import argparse
+import bisect
+import csv
+import io
+import itertools
+import json
+import random
+
+import db.connector
+import db.models as models
+import bench.seed
+
+WORDS = ('add', 'bake', 'boil', 'chop', 'fry', 'mix', 'pour', 'salt',
+         'serve', 'slice', 'stir', 'whisk', 'the', 'with', 'until', 'golden')
+
+
+def parse_args(args=None):
+    """Parse the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--ingredients', type=int, default=1000000)
+    parser.add_argument('--utensils', type=int, default=10000)
+    parser.add_argument('--recipes', type=int, default=1000000)
+    parser.add_argument('--ingredients-per-recipe', type=float, default=8)
+    parser.add_argument('--ingredients-per-recipe-sd', type=float, default=3)
+    parser.add_argument('--utensils-per-recipe', type=float, default=3)
+    parser.add_argument('--utensils-per-recipe-sd', type=float, default=1)
+    parser.add_argument('--zipf', type=float, default=1.0,
+                        help='popularity exponent, 0 for uniform')
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--step-words', type=int, default=12)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(args)
+
+
+class CsvStream(object):
+    """File-like object reading rows as CSV, for cursor.copy_expert
+
+    The rows are consumed lazily, only a chunk of CSV is held in memory.
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator='\n')
+        self.pending = ''
+        self.count = 0
+
+    def read(self, size=-1):
+        """Read size characters of CSV at most, all of them if size < 0"""
+        while size < 0 or len(self.pending) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.writer.writerow(row)
+            self.count += 1
+            self.pending += self.buffer.getvalue()
+            self.buffer.seek(0)
+            self.buffer.truncate()
+
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+class Popularity(object):
+    """Draw ids from 1 to count with Zipfian weights (1 / rank ** exponent)"""
+
+    def __init__(self, count, exponent, rng):
+        self.count = count
+        self.rng = rng
+        self.cumulated = None
+        if exponent:
+            self.cumulated = list(itertools.accumulate(
+                1 / rank ** exponent for rank in range(1, count + 1)
+            ))
+
+    def draw(self):
+        """One id"""
+        if self.cumulated is None:
+            return self.rng.randint(1, self.count)
+        value = self.rng.random() * self.cumulated[-1]
+        return bisect.bisect(self.cumulated, value) + 1
+
+    def sample(self, size):
+        """size distinct ids"""
+        size = min(size, self.count)
+        ids = set()
+        while len(ids) < size:
+            ids.add(self.draw())
+        return sorted(ids)
+
+
+def per_recipe(rng, mean, deviation):
+    """Number of elements of a recipe, normal and at least 1"""
+    return max(1, int(round(rng.gauss(mean, deviation))))
+
+
+def directions(rng, steps, words):
+    """Directions JSON of a recipe"""
+    return json.dumps({'steps': [
+        ' '.join(rng.choice(WORDS) for _ in range(words))
+        for _ in range(rng.randint(1, 2 * steps))
+    ]})
+
+
+def recipe_rows(args, rng):
+    """CSV rows of the recipe table"""
+    durations = models.Recipe.duration.choices
+    categories = models.Recipe.category.choices
+    for recipe_id in range(1, args.recipes + 1):
+        yield (recipe_id, 'recipe_%d' % recipe_id,
+               directions(rng, args.steps, args.step_words),
+               rng.randint(1, 5), rng.choice(durations), rng.randint(1, 12),
+               rng.choice(categories))
+
+
+def link_rows(recipes, popularity, mean, deviation, rng, extra=lambda: ()):
+    """CSV rows of a join table: recipe id, element id and extra columns"""
+    for recipe_id in range(1, recipes + 1):
+        count = per_recipe(rng, mean, deviation)
+        for element_id in popularity.sample(count):
+            yield (recipe_id, element_id) + extra()
+
+
+def copy(model, columns, rows):
+    """COPY the rows in the table of model, return their number"""
+    stream = CsvStream(rows)
+    sql = 'COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (
+        bench.seed.table_name(model),
+        ', '.join('"%s"' % column for column in columns)
+    )
+    with db.connector.database.transaction():
+        db.connector.database.get_cursor().copy_expert(sql, stream)
+    return stream.count
+
+
+def restart_sequence(model, last_id):
+    """Move the id sequence after the ids copied"""
+    db.connector.database.execute_sql(
+        "SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)",
+        (bench.seed.table_name(model), max(last_id, 1))
+    )
+
+
+def generate(args):
+    """Empty the tables and fill them as described by args"""
+    rng = random.Random(args.seed)
+    measurements = models.RecipeIngredients.measurement.choices
+    bench.seed.truncate()
+
+    counts = {}
+    counts['ingredients'] = copy(models.Ingredient, ('id', 'name'), (
+        (index, 'ingredient_%d' % index)
+        for index in range(1, args.ingredients + 1)
+    ))
+    counts['utensils'] = copy(models.Utensil, ('id', 'name'), (
+        (index, 'utensil_%d' % index)
+        for index in range(1, args.utensils + 1)
+    ))
+    counts['recipes'] = copy(models.Recipe, (
+        'id', 'name', 'directions', 'difficulty', 'duration', 'people',
+        'category'
+    ), recipe_rows(args, rng))
+    for model, count in ((models.Ingredient, args.ingredients),
+                         (models.Utensil, args.utensils),
+                         (models.Recipe, args.recipes)):
+        restart_sequence(model, count)
+
+    counts['recipe_ingredients'] = copy(
+        models.RecipeIngredients,
+        ('fk_recipe', 'fk_ingredient', 'quantity', 'measurement'),
+        link_rows(args.recipes, Popularity(args.ingredients, args.zipf, rng),
+                  args.ingredients_per_recipe,
+                  args.ingredients_per_recipe_sd, rng,
+                  lambda: (rng.randint(1, 500), rng.choice(measurements)))
+    )
+    counts['recipe_utensils'] = copy(
+        models.RecipeUtensils, ('fk_recipe', 'fk_utensil'),
+        link_rows(args.recipes, Popularity(args.utensils, args.zipf, rng),
+                  args.utensils_per_recipe, args.utensils_per_recipe_sd, rng)
+    )
+    db.connector.database.execute_sql('ANALYZE')
+    return counts
+
+
+def main(args=None):
+    """Generate the catalogue in the database configured in db.connector"""
+    args = parse_args(args)
+    db.connector.database.init(**db.connector.config)
+    for table, count in sorted(generate(args).items()):
+        print('%s: %d rows' % (table, count))
+
+
+if __name__ == '__main__':
+    main()
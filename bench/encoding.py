@@ -0,0 +1,83 @@
+"""Compare the JSON encoders on a page of recipes
+
+    PYTHONPATH=src python3 -m bench.encoding --recipes 1000
+
+Dumps the same payload (recipes with their directions, as GET /recipes/
+returns them) with flask.jsonify, the previous encoding of the responses,
+and with utils.encoding for the stdlib json and every C encoder installed.
+The best time of --repeat runs of --number dumps is reported.
+"""
+import argparse
+import json
+import random
+import timeit
+
+import flask
+
+import bench.datagen
+import utils.encoding
+
+COLUMNS = ('id', 'name', 'directions', 'difficulty', 'duration', 'people',
+           'category')
+
+
+def parse_args(args=None):
+    """Parse the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--recipes', type=int, default=1000)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--step-words', type=int, default=12)
+    parser.add_argument('--number', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(args)
+
+
+def payload(args):
+    """Page of recipes as returned by GET /recipes/"""
+    recipes = []
+    for row in bench.datagen.recipe_rows(args, random.Random(args.seed)):
+        recipe = dict(zip(COLUMNS, row))
+        recipe['directions'] = json.loads(recipe['directions'])
+        recipes.append(recipe)
+    return {'recipes': recipes, 'next': None}
+
+
+def candidates():
+    """Name and dumps function of each encoder to compare"""
+    yield 'flask.jsonify', lambda data: flask.jsonify(data).data
+    for name in ['json'] + [name for name, module, _ in
+                            utils.encoding.ENCODERS if module is not None]:
+        encoder = utils.encoding.select(name)
+        yield 'utils.encoding (%s)' % name, (
+            lambda data, encoder=encoder: dumps(data, encoder)
+        )
+
+
+def dumps(data, encoder):
+    """utils.encoding.jsonify with the given encoder"""
+    utils.encoding.encoder = encoder
+    return utils.encoding.jsonify(data).data
+
+
+def main(args=None):
+    """Time the encoders"""
+    args = parse_args(args)
+    data = payload(args)
+    app = flask.Flask(__name__)
+
+    with app.test_request_context():
+        baseline = None
+        for name, function in candidates():
+            size = len(function(data))
+            best = min(timeit.repeat(lambda: function(data),
+                                     number=args.number, repeat=args.repeat))
+            per_dump = best / args.number * 1000
+            baseline = baseline or per_dump
+            print('%-28s %8.2f ms %10d bytes %6.2fx' % (
+                name, per_dump, size, baseline / per_dump
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+"""Drive the API with a read/write mix and report the latencies
+
+    python3 -m bench.run --url http://localhost:5000 --mix mixed \\
+        --duration 30 --concurrency 16 --output before.json
+
+Every endpoint of API.md is exercised, the full exports streamed with
+stream=1 included, the writes are built from the misc/ payloads with ids
+picked in the catalogue seeded by bench.seed (pass the same sizes). The
+report gives, per scenario and overall, the p50/p95/p99 latencies, the
+requests per second and the queries per request (read from the Server-Timing
+header) as JSON, to diff between releases.
+"""
+import argparse
+import bisect
+import collections
+import copy
+import http.client
+import itertools
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+
+MISC_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'misc')
+
+# Share of writes of each mix
+MIXES = {'read': 0, 'mixed': 0.1, 'write': 0.5}
+
+QUERIES = re.compile(r'desc="(\d+) queries"')
+
+PERCENTILES = (50, 95, 99)
+
+
+def payload(filename):
+    """Load a payload of misc/"""
+    with open(os.path.join(MISC_DIR, filename)) as payload_file:
+        return json.load(payload_file)
+
+
+class Catalogue(object):
+    """Sizes of the seeded catalogue and generator of the requests"""
+
+    def __init__(self, args, rng):
+        self.sizes = {'ingredient': args.ingredients,
+                      'utensil': args.utensils,
+                      'recipe': args.recipes}
+        self.rng = rng
+        self.names = ('bench_%s_%%d' % uuid.uuid4().hex, itertools.count())
+        self.post_recipe = payload('post_recipe_1.json')
+        self.put_recipes = payload('put_recipes_1.json')
+        self.post_utensil = payload('post_utensil_1.json')
+        self.put_elements = {
+            'ingredient': (payload('put_ingredient_1.json'),
+                           payload('put_ingredients_1.json')),
+            'utensil': (payload('put_utensil_1.json'),
+                        payload('put_utensils_1.json')),
+        }
+
+    def ids(self, kind, count=1):
+        """Distinct ids of the catalogue"""
+        return self.rng.sample(range(1, self.sizes[kind] + 1),
+                               min(count, self.sizes[kind]))
+
+    def name(self):
+        """Name which does not exist yet"""
+        pattern, counter = self.names
+        return pattern % next(counter)
+
+    def links(self, kind, elements):
+        """Point the links of a payload to distinct elements of the catalogue
+
+        The elements given by name are existing ones (<kind>_<id>).
+        """
+        elements = copy.deepcopy(elements)
+        for element, element_id in zip(elements,
+                                       self.ids(kind, len(elements))):
+            if 'id' in element:
+                element['id'] = element_id
+            else:
+                element['name'] = '%s_%d' % (kind, element_id)
+        return elements
+
+    def renames(self, kind, elements):
+        """Rows updating distinct elements, renamed to their own name"""
+        return [dict(element, id=element_id,
+                     name='%s_%d' % (kind, element_id))
+                for element, element_id in zip(elements,
+                                               self.ids(kind, len(elements)))]
+
+    def scenarios(self):
+        """Scenarios by kind (read or write): name, weight, request builder
+
+        A builder returns the method, the path and the body of the request.
+        """
+        read = [
+            ('recipes_get', 2, lambda: ('GET', '/recipes/?limit=50', None)),
+            ('recipe_get', 10, lambda: (
+                'GET', '/recipes/%d/' % self.ids('recipe')[0], None)),
+            ('recipe_ingredients_get', 4, lambda: (
+                'GET', '/recipes/%d/ingredients/' % self.ids('recipe')[0],
+                None)),
+            ('recipe_utensils_get', 2, lambda: (
+                'GET', '/recipes/%d/utensils/' % self.ids('recipe')[0], None)),
+            ('ingredients_get', 1, lambda: (
+                'GET', '/ingredients/?limit=50', None)),
+            ('ingredient_get', 3, lambda: (
+                'GET', '/ingredients/%d/' % self.ids('ingredient')[0], None)),
+            ('ingredient_recipes_get', 2, lambda: (
+                'GET', '/ingredients/%d/recipes/' % self.ids('ingredient')[0],
+                None)),
+            ('utensils_get', 1, lambda: ('GET', '/utensils/?limit=50', None)),
+            ('utensil_get', 2, lambda: (
+                'GET', '/utensils/%d/' % self.ids('utensil')[0], None)),
+            ('utensil_recipes_get', 1, lambda: (
+                'GET', '/utensils/%d/recipes/' % self.ids('utensil')[0],
+                None)),
+            ('recipes_stream', 1, lambda: (
+                'GET', '/recipes/?stream=1', None)),
+            ('ingredients_stream', 1, lambda: (
+                'GET', '/ingredients/?stream=1', None)),
+            ('utensils_stream', 1, lambda: (
+                'GET', '/utensils/?stream=1', None)),
+        ]
+        write = [
+            ('recipes_post', 4, self.recipes_post),
+            ('recipes_put', 4, self.recipes_put),
+            ('recipe_put', 2, self.recipe_put),
+            ('ingredients_post', 1, lambda: (
+                'POST', '/ingredients/', {'name': self.name()})),
+            ('ingredients_put', 1, lambda: self.elements_put('ingredient')),
+            ('ingredient_put', 1, lambda: self.element_put('ingredient')),
+            ('utensils_post', 1, lambda: (
+                'POST', '/utensils/',
+                dict(self.post_utensil, name=self.name()))),
+            ('utensils_put', 1, lambda: self.elements_put('utensil')),
+            ('utensil_put', 1, lambda: self.element_put('utensil')),
+        ]
+        return {'read': read, 'write': write}
+
+    def recipes_post(self):
+        """POST /recipes/ from misc/post_recipe_1.json"""
+        recipe = dict(self.post_recipe, name=self.name())
+        recipe['ingredients'] = self.links('ingredient', recipe['ingredients'])
+        recipe['utensils'] = self.links('utensil', recipe['utensils'])
+        return 'POST', '/recipes/', recipe
+
+    def recipes_put(self):
+        """PUT /recipes/ from misc/put_recipes_1.json"""
+        recipes = self.renames('recipe', self.put_recipes['recipes'])
+        for recipe in recipes:
+            if 'ingredients' in recipe:
+                recipe['ingredients'] = self.links('ingredient',
+                                                   recipe['ingredients'])
+            if 'utensils' in recipe:
+                recipe['utensils'] = self.links('utensil', recipe['utensils'])
+        return 'PUT', '/recipes/', {'recipes': recipes}
+
+    def recipe_put(self):
+        """PUT /recipes/<id>/ from the first recipe of put_recipes_1.json"""
+        _, _, data = self.recipes_put()
+        recipe = data['recipes'][0]
+        return 'PUT', '/recipes/%d/' % recipe.pop('id'), recipe
+
+    def elements_put(self, kind):
+        """PUT /<kind>s/ from misc/put_<kind>s_1.json"""
+        rows = self.put_elements[kind][1][kind + 's']
+        return 'PUT', '/%ss/' % kind, {kind + 's': self.renames(kind, rows)}
+
+    def element_put(self, kind):
+        """PUT /<kind>s/<id>/ from misc/put_<kind>_1.json"""
+        element_id = self.ids(kind)[0]
+        return 'PUT', '/%ss/%d/' % (kind, element_id), dict(
+            self.put_elements[kind][0], name='%s_%d' % (kind, element_id)
+        )
+
+
+class Worker(threading.Thread):
+    """Send requests on its own connection until the deadline"""
+
+    def __init__(self, args, seed, deadline):
+        super(Worker, self).__init__()
+        self.url = urllib.parse.urlsplit(args.url)
+        self.rng = random.Random(seed)
+        self.catalogue = Catalogue(args, self.rng)
+        self.scenarios = self.catalogue.scenarios()
+        self.write_share = MIXES[args.mix]
+        self.deadline = deadline
+        self.samples = []
+        self.connection = None
+
+    def pick(self):
+        """Pick the next scenario of the mix"""
+        kind = 'write' if self.rng.random() < self.write_share else 'read'
+        scenarios = self.scenarios[kind]
+        weights = list(itertools.accumulate(
+            weight for _, weight, _ in scenarios
+        ))
+        return scenarios[bisect.bisect(weights,
+                                       self.rng.random() * weights[-1])]
+
+    def send(self, method, path, body):
+        """Send a request, return its status and the number of queries"""
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.url.netloc)
+
+        headers = {'Accept': 'application/json'}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.connection.request(method, self.url.path.rstrip('/') + path,
+                                    body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            return 0, None
+
+        queries = QUERIES.search(response.getheader('Server-Timing', ''))
+        return response.status, queries and int(queries.group(1))
+
+    def run(self):
+        while time.perf_counter() < self.deadline:
+            name, _, build = self.pick()
+            method, path, body = build()
+            begin = time.perf_counter()
+            status, queries = self.send(method, path, body)
+            self.samples.append(
+                (name, status, time.perf_counter() - begin, queries)
+            )
+        if self.connection is not None:
+            self.connection.close()
+
+
+def percentile(values, rank):
+    """Nearest rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(rank / 100 * len(values)) - 1)]
+
+
+def summarise(samples, duration):
+    """Statistics of samples (scenario, status, latency, queries)"""
+    latencies = sorted(latency * 1000 for _, _, latency, _ in samples)
+    queries = [count for _, _, _, count in samples if count is not None]
+    statuses = collections.Counter(str(status) for _, status, _, _ in samples)
+
+    summary = {
+        'requests': len(samples),
+        'requests_per_second': round(len(samples) / duration, 2),
+        'errors': sum(1 for _, status, _, _ in samples
+                      if not 200 <= status < 400),
+        'statuses': dict(statuses),
+        'latency_ms': {'p%d' % rank: percentile(latencies, rank)
+                       for rank in PERCENTILES},
+        'queries_per_request': None,
+    }
+    if latencies:
+        summary['latency_ms']['mean'] = sum(latencies) / len(latencies)
+        summary['latency_ms']['max'] = latencies[-1]
+    if queries:
+        summary['queries_per_request'] = round(sum(queries) / len(queries), 2)
+    summary['latency_ms'] = {key: value if value is None else round(value, 3)
+                             for key, value in summary['latency_ms'].items()}
+    return summary
+
+
+def report(samples, duration, config):
+    """Full report: configuration, overall and per scenario statistics"""
+    scenarios = collections.defaultdict(list)
+    for sample in samples:
+        scenarios[sample[0]].append(sample)
+
+    return {
+        'config': config,
+        'overall': summarise(samples, duration),
+        'scenarios': {name: summarise(scenario_samples, duration)
+                      for name, scenario_samples in sorted(scenarios.items())},
+    }
+
+
+def parse_args(args=None):
+    """Parse the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--mix', choices=sorted(MIXES), default='mixed')
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--ingredients', type=int, default=100000)
+    parser.add_argument('--utensils', type=int, default=1000)
+    parser.add_argument('--recipes', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON report file, stdout otherwise')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    """Run the benchmark and write the report"""
+    args = parse_args(args)
+    begin = time.perf_counter()
+    workers = [Worker(args, args.seed + index, begin + args.duration)
+               for index in range(args.concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    duration = time.perf_counter() - begin
+
+    samples = list(itertools.chain.from_iterable(
+        worker.samples for worker in workers
+    ))
+    result = json.dumps(report(samples, duration, vars(args)), indent=2,
+                        sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(result + '\n')
+    else:
+        print(result)
+
+
+if __name__ == '__main__':
+    main()
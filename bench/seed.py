@@ -0,0 +1,134 @@
+"""Seed a synthetic catalogue for the benchmarks
+
+    PYTHONPATH=src python3 -m bench.seed --ingredients 100000 --recipes 50000
+
+The rulzurkitchen tables are emptied first (their sequences restart, the ids
+go from 1 to the sizes given) then filled by batches of multi-rows INSERT.
+The names follow the misc/ payloads: ingredient_<id>, utensil_<id> and
+recipe_<id>. bench.datagen generates larger catalogues with COPY.
+"""
+import argparse
+import random
+
+import db.connector
+import db.models as models
+
+BATCH = 1000
+
+MODELS = (models.RecipeUtensils, models.RecipeIngredients, models.Recipe,
+          models.Utensil, models.Ingredient)
+
+
+def parse_args(args=None):
+    """Parse the command line"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--ingredients', type=int, default=100000)
+    parser.add_argument('--utensils', type=int, default=1000)
+    parser.add_argument('--recipes', type=int, default=50000)
+    parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+    parser.add_argument('--utensils-per-recipe', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args(args)
+
+
+def batches(rows, size=BATCH):
+    """Split the rows in lists of size rows at most"""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def recipe_rows(count, rng):
+    """Rows of the recipe table"""
+    durations = models.Recipe.duration.choices
+    categories = models.Recipe.category.choices
+    for recipe_id in range(1, count + 1):
+        yield {
+            'name': 'recipe_%d' % recipe_id,
+            'directions': {'steps': ['step %d' % step
+                                     for step in range(rng.randint(1, 10))]},
+            'difficulty': rng.randint(1, 5),
+            'duration': rng.choice(durations),
+            'people': rng.randint(1, 12),
+            'category': rng.choice(categories),
+        }
+
+
+def link_rows(recipes, elements, per_recipe, rng, build):
+    """Rows of a join table, per_recipe distinct elements for each recipe"""
+    per_recipe = min(per_recipe, elements)
+    for recipe_id in range(1, recipes + 1):
+        for element_id in rng.sample(range(1, elements + 1), per_recipe):
+            yield build(recipe_id, element_id)
+
+
+def table_name(model):
+    """Quoted name of the table of a model"""
+    # pylint: disable=protected-access
+    return '"%s"."%s"' % (db.connector.schema, model._meta.db_table)
+
+
+def truncate():
+    """Empty the tables, their sequences restart"""
+    db.connector.database.execute_sql('TRUNCATE %s RESTART IDENTITY' % (
+        ', '.join(table_name(model) for model in MODELS)
+    ))
+
+
+def insert(model, rows):
+    """Insert the rows by batches, return their number"""
+    count = 0
+    for batch in batches(rows):
+        with db.connector.database.transaction():
+            model.insert_many(batch).execute()
+        count += len(batch)
+    return count
+
+
+def seed(args):
+    """Empty the tables and fill them with the catalogue described by args"""
+    rng = random.Random(args.seed)
+    measurements = models.RecipeIngredients.measurement.choices
+
+    truncate()
+
+    counts = {}
+    counts['ingredients'] = insert(models.Ingredient, (
+        {'name': 'ingredient_%d' % index}
+        for index in range(1, args.ingredients + 1)
+    ))
+    counts['utensils'] = insert(models.Utensil, (
+        {'name': 'utensil_%d' % index}
+        for index in range(1, args.utensils + 1)
+    ))
+    counts['recipes'] = insert(models.Recipe, recipe_rows(args.recipes, rng))
+    counts['recipe_ingredients'] = insert(models.RecipeIngredients, link_rows(
+        args.recipes, args.ingredients, args.ingredients_per_recipe, rng,
+        lambda recipe, ingredient: {
+            'recipe': recipe, 'ingredient': ingredient,
+            'quantity': rng.randint(1, 500),
+            'measurement': rng.choice(measurements),
+        }
+    ))
+    counts['recipe_utensils'] = insert(models.RecipeUtensils, link_rows(
+        args.recipes, args.utensils, args.utensils_per_recipe, rng,
+        lambda recipe, utensil: {'recipe': recipe, 'utensil': utensil}
+    ))
+    return counts
+
+
+def main(args=None):
+    """Seed the database configured in db.connector"""
+    args = parse_args(args)
+    db.connector.database.init(**db.connector.config)
+    for table, count in sorted(seed(args).items()):
+        print('%s: %d rows' % (table, count))
+
+
+if __name__ == '__main__':
+    main()
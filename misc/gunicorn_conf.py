@@ -0,0 +1,95 @@
+"""Gunicorn configuration
+
+Run the application with: gunicorn -c misc/gunicorn_conf.py wsgi:app
+
+The application is loaded in the master before forking the workers, each
+worker then builds its own connection pool. Signals sent to the master:
+
+* SIGHUP: reload the configuration and replace the workers gracefully
+* SIGTERM: stop accepting connections, let the running requests finish within
+graceful_timeout, then exit
+* TTIN/TTOU: add/remove a worker
+
+Every setting is overridable from the environment (WEB_* variables).
+
+The image only holds the default application, which has no database nor
+caches: the hooks do nothing until the application directory is mounted.
+"""
+import multiprocessing
+import os
+
+try:
+    import db.connector
+    import utils.cache
+    import utils.invalidation
+    import utils.metrics
+    import utils.response_cache
+except ImportError:
+    # pylint: disable=invalid-name
+    db = utils = None
+
+debug = int(os.environ.get('DEBUG', 0)) != 0
+
+bind = os.environ.get('WEB_BIND', '0.0.0.0:5000')
+backlog = int(os.environ.get('WEB_BACKLOG', 2048))
+
+# threads > 1 switches to the threaded worker, DB_POOL_MAX must be at least
+# the number of threads of a worker
+workers = int(
+    os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1)
+)
+threads = int(os.environ.get('WEB_THREADS', 1))
+
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 2))
+
+# recycle the workers from time to time, the jitter avoids restarting them all
+# at once
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 0))
+
+# the code reloader needs the application to be loaded in the workers
+preload_app = not debug
+reload = debug
+
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(_):
+    """Forget the metrics of the previous runs"""
+    if utils is None:
+        return
+    utils.metrics.registry.clear()
+
+
+def post_fork(_, __):
+    """Give the worker its own connection pool, metrics and caches"""
+    if db is None:
+        return
+    db.connector.database.reset()
+    utils.metrics.registry.reset()
+    utils.cache.reset()
+    utils.response_cache.responses.reset()
+
+
+def post_worker_init(_):
+    """Open the connections of the worker once the application is loaded
+
+    Without preload_app (DEBUG=1) the worker loads wsgi.py after post_fork,
+    the database is only initialised then.
+    """
+    if db is None:
+        return
+    db.connector.database.fill()
+    utils.invalidation.start()
+
+
+def worker_exit(_, __):
+    """Close the connections of the worker, keep its last metrics"""
+    if db is None:
+        return
+    utils.invalidation.stop()
+    db.connector.database.close_all()
+    utils.metrics.registry.flush(force=True)
@@ -12,11 +12,18 @@ import os
 import flask
 import utils.helpers
 
+import api.admin
 import api.recipes
 import api.utensils
 import api.ingredients
 
 import db.connector
+import db.pool
+import utils.encoding
+import utils.metrics
+import utils.profiling
+import utils.slow_queries
+import utils.timing
 
 # pylint: disable=too-few-public-methods
 class Flask(flask.Flask):
@@ -25,15 +32,21 @@ class Flask(flask.Flask):
     def make_response(self, rv):
         data, code, headers = utils.helpers.unpack(rv)
         tpl = getattr(flask.request, 'tpl', None)
-        if tpl is not None:
-            rv = flask.render_template(tpl, **data), code, headers
-        elif isinstance(data, dict):
-            rv = flask.jsonify(data), code, headers
+        with utils.timing.measure('render'):
+            if tpl is not None and isinstance(data, dict):
+                rv = flask.render_template(tpl, **data), code, headers
+            elif isinstance(data, dict):
+                rv = utils.encoding.jsonify(data), code, headers
 
         return super(Flask, self).make_response(rv)
 
+    def dispatch_request(self):
+        with utils.profiling.profile():
+            return super(Flask, self).dispatch_request()
+
 
 app = Flask(__name__)
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
 
 # Register error handlers
 app.register_error_handler(
@@ -43,16 +56,42 @@ app.register_error_handler(
 # Add jinja extensions
 #app.jinja_env.add_extension('jinja2.ext.loopcontrols')
 
+# Measure the database, serialisation and rendering time of the requests
+if utils.timing.record_query not in db.connector.database.query_hooks:
+    db.connector.database.query_hooks.append(utils.timing.record_query)
+app.before_request(utils.timing.start)
+app.after_request(utils.timing.finish)
+
+# Count the requests and the queries for /metrics
+if utils.metrics.record_query not in db.connector.database.query_hooks:
+    db.connector.database.query_hooks.append(utils.metrics.record_query)
+app.before_request(utils.metrics.start)
+app.after_request(utils.metrics.record_status)
+app.teardown_request(utils.metrics.record_request)
+
+# ETag of the GET responses, 304 when the client already has them
+app.after_request(utils.helpers.conditional)
+
+# Send back the id of the profile of the profiled requests
+app.after_request(utils.profiling.add_header)
+
+# Log the slow queries, see /admin/slow_queries/
+if utils.slow_queries.record_query not in db.connector.database.query_hooks:
+    db.connector.database.query_hooks.append(utils.slow_queries.record_query)
+
 @app.before_request
 def _db_connect():
-    """ This hook ensures that a connection is opened to handle any queries
-    generated by the request."""
-    db.connector.database.connect()
+    """ This hook ensures that a connection is checked out of the pool to
+    handle any queries generated by the request."""
+    try:
+        db.connector.database.connect()
+    except db.pool.PoolExhausted:
+        raise utils.helpers.APIException('Service unavailable', 503)
 
 @app.teardown_request
 def _db_close(_):
-    """This hook ensures that the connection is closed when we've finished
-    processing the request.
+    """This hook ensures that the connection is given back to the pool when
+    we've finished processing the request.
     """
     if not db.connector.database.is_closed():
         db.connector.database.close()
@@ -64,7 +103,14 @@ def index():
     """Display the index page"""
     return flask.render_template('index.html')
 
+@app.route('/metrics')
+def metrics():
+    """Expose the metrics of all the workers to Prometheus"""
+    return flask.Response(utils.metrics.registry.exposition(),
+                          mimetype=utils.metrics.MIMETYPE)
+
 app.register_blueprint(api.utensils.blueprint, url_prefix='/utensils')
 app.register_blueprint(api.ingredients.blueprint, url_prefix='/ingredients')
 app.register_blueprint(api.recipes.blueprint, url_prefix='/recipes')
+app.register_blueprint(api.admin.blueprint, url_prefix='/admin')
 
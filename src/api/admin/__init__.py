@@ -0,0 +1,2 @@
+"""Admin blueprint folder"""
+from .endpoint import blueprint
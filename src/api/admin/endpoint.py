@@ -0,0 +1,80 @@
+"""API admin entrypoints
+
+Operational data about the running process, only reachable with the token
+configured in ADMIN_TOKEN (sent in the X-Admin-Token header)
+"""
+import hmac
+import os
+
+import flask
+
+import db.connector
+import utils.cache
+import utils.invalidation
+import utils.helpers
+import utils.profiling
+import utils.response_cache
+import utils.slow_queries
+
+blueprint = flask.Blueprint('admin', __name__)
+
+
+@blueprint.before_request
+def _check_token():
+    """Reject the requests without the right admin token"""
+    token = flask.current_app.config.get('ADMIN_TOKEN')
+    given_token = flask.request.headers.get('X-Admin-Token', '')
+
+    if not token or not hmac.compare_digest(given_token.encode('utf-8'),
+                                            token.encode('utf-8')):
+        raise utils.helpers.APIException('Forbidden', 403)
+
+
+@blueprint.route('/pool/')
+def pool_get():
+    """Provide the connection pool statistics of this process"""
+    return {'pool': db.connector.database.stats()}
+
+
+@blueprint.route('/cache/')
+def cache_get():
+    """Provide the statistics of the caches of this process"""
+    caches = utils.cache.caches + (utils.response_cache.responses,)
+    return {'caches': {cache.name: cache.stats() for cache in caches},
+            'listener': utils.invalidation.stats()}
+
+
+@blueprint.route('/slow_queries/')
+def slow_queries_get():
+    """Provide the last slow queries of this process, the newest first"""
+    return {'slow_queries': list(reversed(utils.slow_queries.recent)),
+            'threshold_ms': utils.slow_queries.THRESHOLD * 1000}
+
+
+@blueprint.route('/profiles/')
+def profiles_get():
+    """List the stored profiles of the requests, the newest first"""
+    return {'profiles': utils.profiling.profiles()}
+
+
+@blueprint.route('/profiles/<profile_id>/')
+def profile_get(profile_id):
+    """Provide a profile, as a text report or as the raw pstats file
+
+    ?sort= sets the pstats sort key of the report (cumulative by default),
+    ?format=pstats sends the file for snakeviz, gprof2dot or pstats.
+    """
+    filename = utils.profiling.path(profile_id)
+    if filename is None or not os.path.exists(filename):
+        raise utils.helpers.APIException('Profile not found', 404)
+
+    if flask.request.args.get('format') == 'pstats':
+        return flask.send_file(filename, mimetype='application/octet-stream',
+                               as_attachment=True)
+
+    sort = flask.request.args.get('sort', 'cumulative')
+    try:
+        report = utils.profiling.report(profile_id, sort=sort)
+    except KeyError:
+        raise utils.helpers.APIException('Unknown sort key', 400)
+    return flask.Response(report, mimetype='text/plain')
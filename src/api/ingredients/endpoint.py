@@ -4,39 +4,79 @@ import flask
 import api.recipes
 import db.models as models
 import db.connector
+import utils.cache
 import utils.helpers
+import utils.response_cache
 import utils.schemas as schemas
+import utils.serializers as serializers
 
 import peewee
 
 blueprint = flask.Blueprint('ingredients', __name__)
 
 def get_ingredient(ingredient_id):
-    """Get a specific ingredient or raise 404 if it does not exists"""
+    """Get a specific ingredient or raise 404 if it does not exists
+
+    The ingredients found are cached, see utils.cache
+    """
+    return utils.cache.ingredients.get(ingredient_id, load_ingredient)
+
+
+def load_ingredient(ingredient_id):
+    """Read an ingredient from the database, 404 if it does not exists"""
     try:
         return models.Ingredient.get(models.Ingredient.id == ingredient_id)
     except peewee.DoesNotExist:
         raise utils.helpers.APIException('Ingredient not found', 404)
 
 
-def update_ingredient(ingredient):
-    """Update an ingredient and return it"""
-    ingredient_id = ingredient.pop('id')
+def update_ingredient(ingredient, version=None):
+    """Update an ingredient and return it
+
+    With a version, the ingredient is only updated if it still has it. A
+    missing ingredient is a 404, a 412 under If-Match.
+    """
+    if version is not None:
+        ingredient['version'] = version
+    rows, not_found = update_ingredients([ingredient])
+    if not_found:
+        raise utils.helpers.not_found('Ingredient not found')
+    return rows[0]
 
+
+def update_ingredients(ingredients):
+    """Update the ingredients in one statement
+
+    Return the updated ingredients and the ids which do not exist, 412 if an
+    ingredient given with a version has another one. The recipes of the
+    ingredients get a new version.
+    """
     try:
-        return (models.Ingredient
-                .update(**ingredient)
-                .where(models.Ingredient.id == ingredient_id)
-                .returning()
-                .dicts())
-    except peewee.DoesNotExist:
-        raise utils.helpers.APIException('Ingredient not found', 404)
+        query = models.Ingredient.update_many(ingredients).dicts()
+        rows = list(query.execute())
+    except peewee.IntegrityError:
+        raise utils.helpers.APIException('Ingredient already exists', 409)
+
+    found = {row['id'] for row in rows}
+    utils.cache.ingredients.invalidate_after_request(found)
+    not_found = sorted({elt['id'] for elt in ingredients} - found)
+    utils.helpers.check_versions(models.Ingredient, ingredients, not_found)
+    api.recipes.touch_recipes(
+        models.RecipeIngredients, models.RecipeIngredients.ingredient, found
+    )
+    return rows, not_found
 
 
 @blueprint.route('/')
 def ingredients_get():
-    """List all ingredients"""
-    return {'ingredients': list(models.Ingredient.select().dicts())}
+    """List the ingredients, one page at a time"""
+    ingredient_id = models.Ingredient.id
+    query = models.Ingredient.select().dicts()
+    if utils.helpers.stream_requested():
+        return utils.helpers.stream(query.order_by(ingredient_id), 'ingredients')
+
+    ingredients, next_cursor = utils.helpers.paginate(query, ingredient_id)
+    return {'ingredients': ingredients, 'next': next_cursor}
 
 
 @blueprint.route('/', methods=['POST'])
@@ -51,7 +91,8 @@ def ingredients_post():
         raise utils.helpers.APIException('Ingredient already exists', 409)
 
     ingredient, _ = schemas.ingredient_schema.dump(ingredient)
-    return {'ingredient': ingredient}, 201
+    return utils.helpers.versioned({'ingredient': ingredient},
+                                   ingredient['version'], 201)
 
 
 @blueprint.route('/', methods=['PUT'])
@@ -60,44 +101,48 @@ def ingredients_put():
     """Update multiple ingredients"""
 
     data = utils.helpers.raise_or_return(schemas.ingredient_schema_list)
-
-    ingredients = []
-    for ingredient in data['ingredients']:
-        try:
-            ingredients.append(update_ingredient(ingredient))
-        except utils.helpers.APIException:
-            pass
-
-    return {'ingredients': ingredients}
+    ingredients, not_found = update_ingredients(data['ingredients'])
+    return {'ingredients': ingredients, 'not_found': not_found}
 
 
 @blueprint.route('/<int:ingredient_id>/')
+@utils.response_cache.cached(
+    lambda data, ingredient_id: [('ingredients', ingredient_id)],
+    version=lambda ingredient_id: get_ingredient(ingredient_id).version
+)
 def ingredient_get(ingredient_id):
     """Provide the ingredient for ingredient_id"""
     ingredient = get_ingredient(ingredient_id)
-    ingredient, _ = schemas.ingredient_schema.dump(ingredient)
-    return {'ingredient': ingredient}
+    return utils.helpers.versioned(
+        {'ingredient': serializers.ingredient_serializer.dump(ingredient)},
+        ingredient.version
+    )
 
 
 @blueprint.route('/<int:ingredient_id>/', methods=['PUT'])
 @db.connector.database.transaction()
 def ingredient_put(ingredient_id):
-    """Update the ingredient for ingredient_id"""
+    """Update the ingredient for ingredient_id, honouring If-Match"""
 
+    version = utils.helpers.if_match()
     schema = schemas.ingredient_schema_put
     ingredient = utils.helpers.raise_or_return(schema)
     ingredient['id'] = ingredient_id
-    return {'ingredient': update_ingredient(ingredient)}
+    ingredient = update_ingredient(ingredient, version)
+    return utils.helpers.versioned({'ingredient': ingredient},
+                                   ingredient['version'])
 
 
 @blueprint.route('/<int:ingredient_id>/recipes/')
 def get(ingredient_id):
     """List all the recipes for ingredient_id"""
     get_ingredient(ingredient_id)
-    where_clause = models.RecipeIngredients.ingredient == ingredient_id
+    where_clause = api.recipes.recipes_with(
+        models.RecipeIngredients, models.RecipeIngredients.ingredient,
+        ingredient_id
+    )
 
-    recipes = list(api.recipes.select_recipes(where_clause))
-    recipes, _ = schemas.recipe_schema_list.dump({'recipes': recipes})
-    return recipes
+    recipes = api.recipes.select_recipes(where_clause)
+    return serializers.recipe_list_serializer.dump({'recipes': recipes})
 
 
@@ -1,2 +1,3 @@
 """Recipe blueprint folder"""
-from .endpoint import blueprint, select_recipes, get_recipe
+from .endpoint import blueprint, select_recipes, recipes_with, get_recipe, \
+    touch_recipes
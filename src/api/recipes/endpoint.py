@@ -1,18 +1,32 @@
 """API recipes entrypoints"""
+import collections
+import functools
+import operator
+
 import flask
 import peewee
 
 import db.connector
 import db.models as models
 
+import utils.cache
 import utils.helpers
-import utils.schemas as schemas
+import utils.response_cache
+import utils.schemas
+import utils.serializers as serializers
 
 blueprint = flask.Blueprint('recipes', __name__, template_folder='templates')
 
 def get_recipe(recipe_id):
-    """Get a specific recipe or raise 404 if it does not exists"""
+    """Get a specific recipe or raise 404 if it does not exists
+
+    The recipes found are cached, see utils.cache
+    """
+    return utils.cache.recipes.get(recipe_id, load_recipe)
+
 
+def load_recipe(recipe_id):
+    """Read a recipe from the database, 404 if it does not exists"""
     try:
         return db.models.Recipe.get(db.models.Recipe.id == recipe_id)
     except peewee.DoesNotExist:
@@ -20,57 +34,172 @@ def get_recipe(recipe_id):
 
 
 def select_recipes(where_clause):
-    """Select recipes according to where_clause"""
-    return (models.Recipe
-            .select(models.Recipe,
-                    models.RecipeIngredients, models.Ingredient,
-                    models.RecipeUtensils, models.Utensil)
-            .join(models.RecipeIngredients)
-            .join(models.Ingredient)
-            .switch(models.Recipe)
-            .join(models.RecipeUtensils)
-            .join(models.Utensil)
-            .where(where_clause)
-            .aggregate_rows()
-            .execute())
-
-
-def lock_table(model):
-    """Lock table to avoid race conditions"""
-    model_entity = utils.helpers.model_entity(model)
-    lock_request = (
-        'LOCK TABLE %s IN SHARE ROW EXCLUSIVE MODE' % model_entity
+    """Select recipes according to where_clause
+
+    The recipes, their ingredients and their utensils are loaded with one
+    query each and stitched together by recipe id, the number of queries does
+    not grow with the number of recipes (3 at most)
+    """
+    recipes = list(models.Recipe
+                   .select()
+                   .where(where_clause)
+                   .order_by(models.Recipe.id))
+    if not recipes:
+        return recipes
+
+    recipes_by_id = {}
+    for recipe in recipes:
+        recipe.ingredients, recipe.utensils = [], []
+        recipes_by_id[recipe.id] = recipe
+    recipe_ids = list(recipes_by_id)
+
+    ingredients = (models.RecipeIngredients
+                   .select(models.RecipeIngredients, models.Ingredient)
+                   .join(models.Ingredient)
+                   .where(models.RecipeIngredients.recipe << recipe_ids))
+
+    utensils = (models.RecipeUtensils
+                .select(models.RecipeUtensils, models.Utensil)
+                .join(models.Utensil)
+                .where(models.RecipeUtensils.recipe << recipe_ids))
+
+    # pylint: disable=protected-access
+    # read the raw foreign key, the descriptor would query the recipe again
+    for ingredient in ingredients:
+        recipe = recipes_by_id[ingredient._data['recipe']]
+        ingredient.recipe = recipe
+        recipe.ingredients.append(ingredient)
+
+    for utensil in utensils:
+        recipe = recipes_by_id[utensil._data['recipe']]
+        utensil.recipe = recipe
+        recipe.utensils.append(utensil)
+
+    return recipes
+
+
+def recipe_tags(recipe):
+    """Rows a dumped recipe is built from, tags of its cached responses"""
+    yield 'recipes', recipe['id']
+    for ingredient in recipe.get('ingredients') or ():
+        yield 'ingredients', ingredient['id']
+    for utensil in recipe.get('utensils') or ():
+        yield 'utensils', utensil['id']
+
+
+def recipes_with(model, field, elt_id):
+    """Where clause matching the recipes linked to elt_id through model"""
+    recipe_ids = model.select(model.recipe).where(field == elt_id)
+    return models.Recipe.id << recipe_ids
+
+
+def touch_recipes(model, field, elt_ids):
+    """Increase the version of the recipes linked to the elements updated
+
+    A recipe is dumped with the names of its elements, its version (its
+    ETag) changes with them. One statement, whatever the number of recipes.
+    """
+    if not elt_ids:
+        return
+    recipe_ids = model.select(model.recipe).where(field << list(elt_ids))
+    touched = (models.Recipe
+               .update(version=models.Recipe.version + 1)
+               .where(models.Recipe.id << recipe_ids)
+               .returning(models.Recipe.id)
+               .execute())
+    utils.cache.recipes.invalidate_after_request(
+        recipe.id for recipe in touched
     )
 
-    #protect the database table against race condition
-    db.connector.database.execute_sql(lock_request)
 
+# pylint: disable=protected-access
+def lock_name(model, name):
+    """Lock a name of a model until the end of the transaction
 
-def get_or_insert(model, elts_insert, elts_get):
-    """Get the elements from a model or create them if they not exist"""
+    The writers of the same name wait for each other, the others go on
+    """
+    db.connector.database.execute_sql(
+        'SELECT pg_advisory_xact_lock(hashtext(%s), hashtext(%s))',
+        (model._meta.db_table, name)
+    )
 
-    if elts_insert:
-        model.insert_many(elts_insert, model.name).execute()
-        elts_insert = [elt['name'] for elt in elts_insert]
-    else:
-        elts_insert = []
-
-    list_elts = lambda x: list(model.select().where(x))
-    if elts_get and elts_insert:
-        return list_elts((model.id << elts_get) | (model.name << elts_insert))
-    elif elts_insert:
-        return list_elts(model.name << elts_insert)
-    elif elts_get:
-        return list_elts(model.id << elts_get)
+
+def lookup(model, ids, names):
+    """Elements of a model matching the ids or the names, in one query"""
+    if ids and names:
+        where_clause = (model.id << ids) | (model.name << names)
+    elif names:
+        where_clause = model.name << names
+    elif ids:
+        where_clause = model.id << ids
     else:
         return []
+    return list(model.select().where(where_clause))
+
+
+def get_or_insert(model, elts_insert, elts_get):
+    """Get the elements from a model or create them if they not exist
+
+    The elements to get and the names are looked up in one query, only the
+    names which are missing are upserted. The conflicting rows are skipped
+    without being locked so the writers only wait for each other on the
+    names they are both creating, the names are sorted so those waits happen
+    in the same order. The names created meanwhile by another writer are
+    read back.
+
+    This takes one round trip when the names exist, two when some are
+    created and three when another writer creates some of them at the same
+    time. An upsert with DO UPDATE would return every row in one statement,
+    but it would lock and rewrite the existing rows, so the writers sharing
+    any name would wait for each other.
+    """
+    names = sorted({elt['name'] for elt in elts_insert or ()})
+    elts = lookup(model, list(elts_get or ()), names)
+
+    found = {elt.name for elt in elts}
+    names = [name for name in names if name not in found]
+    if names:
+        created = model.insert_many(
+            [{'name': name} for name in names], conflict=[model.name]
+        ).execute()
+        elts.extend(created)
+        created = {elt.name for elt in created}
+        names = [name for name in names if name not in created]
+        elts.extend(lookup(model, [], names))
+
+    return elts
+
+
+def malformed(field, message):
+    """Error of a field of the request"""
+    return utils.helpers.APIException('Request malformed', 400,
+                                      {'errors': {field: [message]}})
+
+
+def check_found(field, ids, elts):
+    """Check that all the ids were found in the elements looked up"""
+    if set(ids) - {elt.id for elt in elts}:
+        raise malformed(
+            field, 'There is some entries to update which does not exist.'
+        )
+
+
+def check_unique(field, ids):
+    """Check that a recipe is linked once to each element"""
+    if len(set(ids)) != len(ids):
+        raise malformed(field,
+                        'There is multiple entries for the same entity.')
 
 
 def ingredients_parsing(ingrs):
-    """Parse the ingredients before calling get_or_insert"""
+    """Parse the ingredients before calling get_or_insert
+
+    The ingredients given by id have to exist.
+    """
 
     ingrs_insert, ingrs_get = [], []
-    ingrs_id, ingrs_name = {}, {}
+    ingrs_id = collections.defaultdict(list)
+    ingrs_name = collections.defaultdict(list)
 
     for ingr in ingrs:
         ingr_id = ingr.pop('id', None)
@@ -78,81 +207,160 @@ def ingredients_parsing(ingrs):
 
         if ingr_id:
             ingrs_get.append(ingr_id)
-            ingrs_id[ingr_id] = ingr
+            ingrs_id[ingr_id].append(ingr)
         if ingr_name:
             ingrs_insert.append({'name': ingr_name})
-            ingrs_name[ingr_name] = ingr
+            ingrs_name[ingr_name].append(ingr)
     db_ingrs = get_or_insert(models.Ingredient, ingrs_insert, ingrs_get)
+    check_found('ingredients', ingrs_get, db_ingrs)
 
-    # wraps again the ingredients into recipe_ingredients dict
+    # wraps again the ingredients into recipe_ingredients dict, the same
+    # ingredient can be given many times when several recipes are parsed
     for ingr in db_ingrs:
-        ingr_id = ingr.id
-        ingr_name = ingr.name
-
-        ingr_tmp = ingrs_id.get(ingr_id) or ingrs_name.get(ingr_name)
-        ingr_tmp['ingredient'] = ingr
+        ingrs_tmp = ingrs_id.get(ingr.id, []) + ingrs_name.get(ingr.name, [])
+        for ingr_tmp in ingrs_tmp:
+            ingr_tmp['ingredient'] = ingr
     return ingrs
 
 def utensils_parsing(utensils):
-    """Parse the utensils before calling get_or_insert"""
-    return get_or_insert(
+    """Parse the utensils before calling get_or_insert
+
+    The utensils given by id have to exist.
+    """
+    utensils_get = [u['id'] for u in utensils if u.get('id') is not None]
+    db_utensils = get_or_insert(
         models.Utensil,
         [u for u in utensils if u.get('id') is None],
-        [u['id'] for u in utensils if u.get('id') is not None]
-    )
-
-def update_recipe(recipe):
-    """Update a recipe"""
-    delete_old_entries = lambda model, recipe_id: (
-        model.delete().where(model.recipe == recipe_id).execute()
+        utensils_get
     )
-
-    recipe_id = recipe.pop('id')
-    ingredients = recipe.pop('ingredients', None)
-    utensils = recipe.pop('utensils', None)
-
-    recipe = (models.Recipe
-              .update(**recipe)
-              .where(models.Recipe.id == recipe_id)
-              .returning())
-    if ingredients is not None:
-        delete_old_entries(models.RecipeIngredients, recipe_id)
-        ingredients = ingredients_parsing(ingredients)
-        for ingredient in ingredients:
-            ingredient['recipe'] = recipe
-
-        models.RecipeIngredients.insert_many(ingredients).execute()
-    else:
-        ingredients = list(
-            models.RecipeIngredients
-            .select(models.RecipeIngredients, models.Ingredient)
-            .join(models.Ingredient)
-            .where(models.RecipeIngredients.recipe == recipe_id)
+    check_found('utensils', utensils_get, db_utensils)
+    return db_utensils
+
+def utensil_ids(utensils, db_utensils):
+    """Ids of the utensils of a recipe, given by id or by name"""
+    by_name = {utensil.name: utensil.id for utensil in db_utensils}
+    return [utensil.get('id') or by_name[utensil['name']]
+            for utensil in utensils]
+
+def sync_links(model, field, recipe_ids, rows, columns=()):
+    """Make the links of the recipes match the rows, touching only the delta
+
+    field is the foreign key to the linked element and columns the attributes
+    of the link. The missing or changed rows are upserted in one statement,
+    the links which are not requested anymore are deleted in another one.
+    Return the number of rows touched.
+    """
+    if not recipe_ids:
+        return 0
+
+    key = lambda row: (row['recipe'], row[field.name])
+    stored = {
+        key(link): link for link in
+        model.select().where(model.recipe << recipe_ids).dicts()
+    }
+    wanted = {key(row): row for row in rows}
+
+    changed = [
+        row for row_key, row in sorted(wanted.items())
+        if row_key not in stored or
+        any(stored[row_key][column] != row[column] for column in columns)
+    ]
+    removed = collections.defaultdict(list)
+    for recipe_id, elt_id in sorted(set(stored) - set(wanted)):
+        removed[recipe_id].append(elt_id)
+
+    if changed:
+        model.insert_many(
+            changed, conflict=[model.recipe, field],
+            update=[getattr(model, column) for column in columns]
+        ).execute()
+
+    if removed:
+        where_clause = functools.reduce(operator.or_, [
+            (model.recipe == recipe_id) & (field << elt_ids)
+            for recipe_id, elt_ids in sorted(removed.items())
+        ])
+        model.delete().where(where_clause).execute()
+
+    return len(changed) + sum(len(elt_ids) for elt_ids in removed.values())
+
+
+def update_recipes(recipes, missing=None):
+    """Update many recipes with a fixed number of statements
+
+    The recipe rows are updated in one statement, which also tells which
+    recipes exist, a recipe given with a version is only updated if it still
+    has it (412 otherwise). A recipe which does not exist raises missing, a
+    400 by default. The ingredients and the utensils of the whole batch are
+    resolved at once and only the links which changed are written. The
+    recipes are then read back in the order of the request, along with the
+    number of link rows touched.
+    """
+    recipes = [dict(recipe) for recipe in recipes]
+    ingredients = {recipe['id']: recipe.pop('ingredients')
+                   for recipe in recipes if 'ingredients' in recipe}
+    utensils = {recipe['id']: recipe.pop('utensils')
+                for recipe in recipes if 'utensils' in recipe}
+
+    # the recipes without fields to update are matched as well
+    rows = sorted(recipes, key=lambda recipe: recipe['id'])
+    updated = (models.Recipe.update_many(rows)
+               .returning(models.Recipe.id)
+               .execute())
+    updated = {recipe.id for recipe in updated}
+    utils.cache.recipes.invalidate_after_request(updated)
+    if len(updated) != len(rows):
+        not_found = {recipe['id'] for recipe in rows} - updated
+        utils.helpers.check_versions(models.Recipe, rows, not_found)
+        raise missing or malformed(
+            'recipes', 'One recipe or more do not match the database entries'
         )
 
-    if utensils is not None:
-        delete_old_entries(models.RecipeUtensils, recipe_id)
-        utensils = utensils_parsing(utensils)
+    ingredients_parsing([ingr for ingrs in ingredients.values()
+                         for ingr in ingrs])
+    for ingrs in ingredients.values():
+        check_unique('ingredients', [ingr['ingredient'].id for ingr in ingrs])
+    rows_touched = sync_links(
+        models.RecipeIngredients, models.RecipeIngredients.ingredient,
+        list(ingredients), [
+            {'recipe': recipe_id, 'ingredient': ingr['ingredient'].id,
+             'quantity': ingr['quantity'], 'measurement': ingr['measurement']}
+            for recipe_id, ingrs in ingredients.items() for ingr in ingrs
+        ], columns=('quantity', 'measurement')
+    )
 
-        models.RecipeUtensils.insert_many([
-            {'recipe': recipe, 'utensil': utensil} for utensil in utensils
-        ]).execute()
-    else:
-        utensils = list(models.Utensil
-                        .select()
-                        .join(models.RecipeUtensils)
-                        .where(models.RecipeUtensils.recipe == recipe_id))
+    db_utensils = utensils_parsing([utensil for elts in utensils.values()
+                                    for utensil in elts])
+    utensils = {recipe_id: utensil_ids(elts, db_utensils)
+                for recipe_id, elts in utensils.items()}
+    for ids in utensils.values():
+        check_unique('utensils', ids)
+    rows_touched += sync_links(
+        models.RecipeUtensils, models.RecipeUtensils.utensil,
+        list(utensils), [
+            {'recipe': recipe_id, 'utensil': utensil_id}
+            for recipe_id, ids in utensils.items() for utensil_id in ids
+        ]
+    )
 
-    recipe.ingredients = ingredients
-    recipe.utensils = utensils
-    return recipe
+    ids = [recipe['id'] for recipe in recipes]
+    recipes_by_id = {
+        recipe.id: recipe for recipe in select_recipes(models.Recipe.id << ids)
+    }
+    return [recipes_by_id[recipe_id] for recipe_id in ids], rows_touched
 
 
 @blueprint.route('/')
 @utils.helpers.template({'text/html': 'recipes.html'})
 def recipes_get():
-    """List all recipes"""
-    return {'recipes': list(models.Recipe.select().dicts())}
+    """List the recipes, one page at a time"""
+    query = models.Recipe.select().dicts()
+    if utils.helpers.stream_requested():
+        query = query.order_by(models.Recipe.id)
+        return utils.helpers.stream(query, 'recipes')
+
+    recipes, next_cursor = utils.helpers.paginate(query, models.Recipe.id)
+    return {'recipes': recipes, 'next': next_cursor}
 
 
 @blueprint.route('/', methods=['POST'])
@@ -162,6 +370,8 @@ def recipes_post():
     recipe = utils.helpers.raise_or_return(
         utils.schemas.recipe_schema_post
     )
+    # the name check is only safe while the name is locked
+    lock_name(models.Recipe, recipe.get('name'))
     count = (models.Recipe
              .select()
              .where(models.Recipe.name == recipe.get('name'))
@@ -170,12 +380,11 @@ def recipes_post():
     if count:
         raise utils.helpers.APIException('Recipe already exists.', 409)
 
-    # avoid race condition by locking tables
-    lock_table(models.Utensil)
-    lock_table(models.Ingredient)
-
     ingredients = ingredients_parsing(recipe['ingredients'])
+    check_unique('ingredients',
+                 [ingredient['ingredient'].id for ingredient in ingredients])
     utensils = utensils_parsing(recipe['utensils'])
+    check_unique('utensils', utensil_ids(recipe['utensils'], utensils))
     recipe = models.Recipe.create(**recipe)
     recipe.ingredients = ingredients
     recipe.utensils = utensils
@@ -189,36 +398,54 @@ def recipes_post():
     for ingredient in ingredients:
         ingredient['recipe'] = recipe
     models.RecipeIngredients.insert_many(ingredients).execute()
-    return {
+    return utils.helpers.versioned({
         'recipe': utils.schemas.recipe_schema.dump(recipe).data
-    }, 201
+    }, recipe.version, 201)
 
 
 @blueprint.route('/', methods=['PUT'])
 @db.connector.database.transaction()
 def recipes_put():
     """Update multiple recipes"""
-    # avoid race condition by locking tables
-
-    lock_table(models.Utensil)
-    lock_table(models.Ingredient)
-
     data = utils.helpers.raise_or_return(utils.schemas.recipe_schema_list)
-    recipes = [update_recipe(recipe) for recipe in data['recipes']]
-    return utils.schemas.recipe_schema_list.dump({'recipes': recipes}).data
+    recipes, rows_touched = update_recipes(data['recipes'])
+    recipes = utils.schemas.recipe_schema_list.dump({'recipes': recipes}).data
+    recipes['rows_touched'] = rows_touched
+    return recipes
 
 
 @blueprint.route('/<int:recipe_id>/')
 @utils.helpers.template({'text/html': 'recipe.html'})
+@utils.response_cache.cached(
+    lambda data, recipe_id: recipe_tags(data['recipe']),
+    version=lambda recipe_id: get_recipe(recipe_id).version
+)
 def recipe_get(recipe_id):
     """Provide the recipe for recipe_id"""
-    try:
-        recipe = next(select_recipes(models.Recipe.id == recipe_id))
-    except StopIteration:
+    recipes = select_recipes(models.Recipe.id == recipe_id)
+    if not recipes:
         raise utils.helpers.APIException('Recipe not found', 404)
 
-    recipe, _ = schemas.recipe_schema.dump(recipe)
-    return {'recipe': recipe}
+    recipe = serializers.recipe_serializer.dump(recipes[0])
+    return utils.helpers.versioned({'recipe': recipe}, recipes[0].version)
+
+
+@blueprint.route('/<int:recipe_id>/', methods=['PUT'])
+@db.connector.database.transaction()
+def recipe_put(recipe_id):
+    """Update the recipe for recipe_id, honouring If-Match"""
+    version = utils.helpers.if_match()
+    recipe = utils.helpers.raise_or_return(utils.schemas.recipe_schema_put)
+    recipe['id'] = recipe_id
+    if version is not None:
+        recipe['version'] = version
+
+    (recipe,), _ = update_recipes(
+        [recipe], utils.helpers.not_found('Recipe not found')
+    )
+    return utils.helpers.versioned({
+        'recipe': utils.schemas.recipe_schema.dump(recipe).data
+    }, recipe.version)
 
 @blueprint.route('/<int:recipe_id>/ingredients/')
 def recipe_ingredients_get(recipe_id):
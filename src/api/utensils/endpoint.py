@@ -4,39 +4,78 @@ import flask
 import api.recipes
 import db.models
 import db.connector
+import utils.cache
 import utils.helpers
+import utils.response_cache
 import utils.schemas as schemas
+import utils.serializers as serializers
 
 import peewee
 blueprint = flask.Blueprint('utensils', __name__, template_folder='templates')
 
 def get_utensil(utensil_id):
-    """Get a specific utensil or raise 404 if it does not exists"""
+    """Get a specific utensil or raise 404 if it does not exists
+
+    The utensils found are cached, see utils.cache
+    """
+    return utils.cache.utensils.get(utensil_id, load_utensil)
+
+
+def load_utensil(utensil_id):
+    """Read an utensil from the database, 404 if it does not exists"""
     try:
         return db.models.Utensil.get(db.models.Utensil.id == utensil_id)
     except peewee.DoesNotExist:
         raise utils.helpers.APIException('Utensil not found', 404)
 
 
-def update_utensil(utensil):
-    """Update an utensil and return it"""
-    utensil_id = utensil.pop('id')
+def update_utensil(utensil, version=None):
+    """Update an utensil and return it
+
+    With a version, the utensil is only updated if it still has it. A
+    missing utensil is a 404, a 412 under If-Match.
+    """
+    if version is not None:
+        utensil['version'] = version
+    rows, not_found = update_utensils([utensil])
+    if not_found:
+        raise utils.helpers.not_found('Utensil not found')
+    return rows[0]
 
+
+def update_utensils(utensils):
+    """Update the utensils in one statement
+
+    Return the updated utensils and the ids which do not exist, 412 if an
+    utensil given with a version has another one. The recipes of the
+    utensils get a new version.
+    """
     try:
-        return (db.models.Utensil
-                .update(**utensil)
-                .where(db.models.Utensil.id == utensil_id)
-                .returning()
-                .dicts())
-    except peewee.DoesNotExist:
-        raise utils.helpers.APIException('Utensil not found', 404)
+        rows = list(db.models.Utensil.update_many(utensils).dicts().execute())
+    except peewee.IntegrityError:
+        raise utils.helpers.APIException('Utensil already exists', 409)
+
+    found = {row['id'] for row in rows}
+    utils.cache.utensils.invalidate_after_request(found)
+    not_found = sorted({utensil['id'] for utensil in utensils} - found)
+    utils.helpers.check_versions(db.models.Utensil, utensils, not_found)
+    api.recipes.touch_recipes(
+        db.models.RecipeUtensils, db.models.RecipeUtensils.utensil, found
+    )
+    return rows, not_found
 
 
 @blueprint.route('/')
 @utils.helpers.template({'text/html': 'utensils.html'})
 def utensils_get():
-    """List all utensils"""
-    return {'utensils': list(db.models.Utensil.select().dicts())}
+    """List the utensils, one page at a time"""
+    utensil_id = db.models.Utensil.id
+    query = db.models.Utensil.select().dicts()
+    if utils.helpers.stream_requested():
+        return utils.helpers.stream(query.order_by(utensil_id), 'utensils')
+
+    utensils, next_cursor = utils.helpers.paginate(query, utensil_id)
+    return {'utensils': utensils, 'next': next_cursor}
 
 
 @blueprint.route('/', methods=['POST'])
@@ -51,7 +90,8 @@ def utensils_post():
         raise utils.helpers.APIException('Utensil already exists', 409)
 
     utensil, _ = schemas.utensil_schema.dump(utensil)
-    return {'utensil': utensil}, 201
+    return utils.helpers.versioned({'utensil': utensil}, utensil['version'],
+                                   201)
 
 
 @blueprint.route('/', methods=['PUT'])
@@ -60,32 +100,34 @@ def utensils_put():
     """Update multiple utensils"""
 
     data = utils.helpers.raise_or_return(schemas.utensil_schema_list)
-
-    utensils = []
-    for utensil in data['utensils']:
-        try:
-            utensils.append(update_utensil(utensil))
-        except utils.helpers.APIException:
-            pass
-
-    return {'utensils': utensils}
+    utensils, not_found = update_utensils(data['utensils'])
+    return {'utensils': utensils, 'not_found': not_found}
 
 
 @blueprint.route('/<int:utensil_id>/')
+@utils.response_cache.cached(
+    lambda data, utensil_id: [('utensils', utensil_id)],
+    version=lambda utensil_id: get_utensil(utensil_id).version
+)
 def utensil_get(utensil_id):
     """Provide the utensil for utensil_id"""
-    utensil, _ = schemas.utensil_schema.dump(get_utensil(utensil_id))
-    return {'utensil': utensil}
+    utensil = get_utensil(utensil_id)
+    return utils.helpers.versioned(
+        {'utensil': serializers.utensil_serializer.dump(utensil)},
+        utensil.version
+    )
 
 
 @blueprint.route('/<int:utensil_id>/', methods=['PUT'])
 @db.connector.database.transaction()
 def utensil_put(utensil_id):
-    """Update the utensil for utensil_id"""
+    """Update the utensil for utensil_id, honouring If-Match"""
 
+    version = utils.helpers.if_match()
     utensil = utils.helpers.raise_or_return(schemas.utensil_schema_put)
     utensil['id'] = utensil_id
-    return {'utensil': update_utensil(utensil)}
+    utensil = update_utensil(utensil, version)
+    return utils.helpers.versioned({'utensil': utensil}, utensil['version'])
 
 
 @blueprint.route('/<int:utensil_id>/recipes/')
@@ -93,9 +135,10 @@ def utensil_put(utensil_id):
 def recipe_get(utensil_id):
     """List all the recipes for utensil_id"""
     get_utensil(utensil_id)
-    where_clause = db.models.RecipeUtensils.utensil == utensil_id
+    where_clause = api.recipes.recipes_with(
+        db.models.RecipeUtensils, db.models.RecipeUtensils.utensil, utensil_id
+    )
 
-    recipes = list(api.recipes.select_recipes(where_clause))
-    recipes, _ = schemas.recipe_schema_list.dump({'recipes': recipes})
-    return recipes
+    recipes = api.recipes.select_recipes(where_clause)
+    return serializers.recipe_list_serializer.dump({'recipes': recipes})
 
@@ -13,6 +13,9 @@ import db.connector
 if __name__ == "__main__":
     debug = bool(os.environ.get('DEBUG'))
     db.connector.database.init(**db.connector.config)
+    db.connector.database.fill()
+    logging.getLogger('rulzurapi').setLevel(logging.INFO)
+    logging.getLogger('rulzurapi').addHandler(logging.StreamHandler())
 
     if debug:
         logger = logging.getLogger('peewee')
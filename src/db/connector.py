@@ -4,9 +4,12 @@ Handle the config constants
 Load the password from a file if possible
 Set the database variable for deferred connection
 Set the schema for database models
+Configure the connection pool (per process, size it per worker)
 """
-import playhouse.postgres_ext
+import os
+
 import db.orm
+import db.pool
 
 try:
     with open('password') as f:
@@ -24,8 +27,17 @@ config = {
     'password': password.rstrip('\n'),
 }
 
+# Connection pool settings, overridable from the environment
+pool_config = {
+    'min_connections': int(os.environ.get('DB_POOL_MIN', 1)),
+    'max_connections': int(os.environ.get('DB_POOL_MAX', 20)),
+    'idle_timeout': float(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300)),
+    'max_age': float(os.environ.get('DB_POOL_MAX_AGE', 3600)),
+    'check_interval': float(os.environ.get('DB_POOL_CHECK_INTERVAL', 30)),
+}
+
 schema = 'rulzurkitchen'
 
-database = playhouse.postgres_ext.PostgresqlExtDatabase(None)
+database = db.pool.PooledPostgresqlExtDatabase(None, **pool_config)
 database.compiler_class = db.orm.QueryCompiler
 
@@ -17,21 +17,45 @@ class BaseModel(peewee.Model):
 
     @classmethod
     # pylint: disable=arguments-differ
-    def insert_many(cls, rows, unique_field=None):
+    def insert_many(cls, rows, unique_field=None, conflict=None, update=None):
         """Insert many values if they not exists
 
         unique_field determine the field on which the unique filter will be
-        applied
-
-        This function has a possibility of race condition, be sure to protect
+        applied. This has a possibility of race condition, be sure to protect
         your transaction and your table against concurrent access
+
+        conflict turns the query into an upsert (INSERT ... ON CONFLICT) on
+        the fields of an unique constraint, returning the rows as model
+        instances. With update the fields listed are overwritten on conflict
+        and every row given is returned, created or not, the existing rows
+        being locked and rewritten. Without update the conflicting rows are
+        skipped and only the created ones are returned, the others have to be
+        read separately. The database handles the concurrent access, no lock
+        is needed.
         """
 
-        if unique_field is None:
+        if conflict is not None:
+            return db.orm.InsertQuery(
+                cls, conflict=conflict, update=update, rows=rows
+            ).returning()
+        elif unique_field is None:
             return db.orm.InsertQuery(cls, rows=rows)
         else:
             return db.orm.InsertQuery(cls, unique=unique_field, rows=rows)
 
+    @classmethod
+    def update_many(cls, rows):
+        """Update many rows in one statement
+
+        Each row is a dict with the primary key and the fields to update, the
+        query returns the updated rows, the keys which do not exist are not
+        part of it. The rows of a model with a version field get a new
+        version, a row giving its version is skipped if it is not the one of
+        the table.
+        """
+
+        return db.orm.UpdateManyQuery(cls, rows=rows).returning()
+
     class Meta(object):
         """Define the common database configuration for the models
 
@@ -47,12 +71,14 @@ class Ingredient(BaseModel):
     """database's ingredient table"""
     id = peewee.PrimaryKeyField()
     name = peewee.CharField()
+    version = peewee.IntegerField(default=1)
 
 #pylint: disable=too-few-public-methods
 class Utensil(BaseModel):
     """database's utensil table"""
     id = peewee.PrimaryKeyField()
     name = peewee.CharField()
+    version = peewee.IntegerField(default=1)
 
 
 #pylint: disable=too-few-public-methods
@@ -67,6 +93,7 @@ class Recipe(BaseModel):
         '60/75', '75/90', '90/120', '120/150'])
     people = peewee.IntegerField()
     category = db.orm.EnumField(choices=['starter', 'main', 'dessert'])
+    version = peewee.IntegerField(default=1)
 
 
     #Foreign keys linking
@@ -3,7 +3,10 @@
 cloned and (not) adapted from
 https://gist.github.com/b1naryth1ef/607e92dc8c1748a06b5d
 """
+import collections
 import operator
+import time
+
 import peewee
 
 class EnumField(peewee.Field):
@@ -26,37 +29,109 @@ class EnumField(peewee.Field):
         return peewee.SQL("e_%s" % self.name)
 
 
+class QueryHooksDatabase(object):
+    """Call hooks after each query run by a peewee database
+
+    The hooks are called with the SQL, the params, the duration of the
+    query in seconds and the exception it raised (None if it succeeded), even
+    if the query failed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.query_hooks = []
+        super(QueryHooksDatabase, self).__init__(*args, **kwargs)
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        error = None
+        try:
+            return super(QueryHooksDatabase, self).execute_sql(
+                sql, params, *args, **kwargs
+            )
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            for hook in self.query_hooks:
+                hook(sql, params, duration, error)
+
+
 # pylint: disable=abstract-method
 class InsertQuery(peewee.InsertQuery):
-    """Overrides peewee.InsertQuery to add a unique feature"""
+    """Overrides peewee.InsertQuery to add the unique and upsert features"""
 
-    def __init__(self, model_class, unique=None, **kwargs):
+    def __init__(self, model_class, unique=None, conflict=None, update=None,
+                 **kwargs):
         self._unique = unique
+        self._conflict = conflict
+        self._conflict_update = update
         super(InsertQuery, self).__init__(model_class, **kwargs)
 
+    # pylint: disable=protected-access
+    def _clone_attributes(self, query):
+        query = super(InsertQuery, self)._clone_attributes(query)
+        query._unique = self._unique
+        query._conflict = self._conflict
+        query._conflict_update = self._conflict_update
+        return query
+
     def sql(self):
-        if self._unique:
+        if self._conflict:
+            return self.compiler().generate_upsert(self)
+        elif self._unique:
             return self.compiler().generate_unique_insert(self)
         else:
             return self.compiler().generate_insert(self)
 
     def execute(self):
-        if self._rows and len(self._rows):
-            return self.database.rows_affected(self._execute())
+        if not (self._rows and len(self._rows)):
+            return [] if self._returning is not None else None
+        if self._returning is not None:
+            return self._execute_with_result_wrapper()
+        return self.database.rows_affected(self._execute())
+
+# pylint: disable=abstract-method
+class UpdateManyQuery(peewee.UpdateQuery):
+    """Update many rows in one statement, each one with its own values
+
+    The rows are dicts holding the primary key and the fields to update, the
+    last row wins when a key is given twice.
+    """
+
+    def __init__(self, model_class, rows=None):
+        super(UpdateManyQuery, self).__init__(model_class, update={})
+        meta = model_class._meta
+        rows_by_key = collections.OrderedDict()
+        for row in rows or []:
+            row = {
+                meta.fields[field] if isinstance(field, str) else field: value
+                for field, value in row.items()
+            }
+            rows_by_key[row[meta.primary_key]] = row
+        self._rows = list(rows_by_key.values())
+
+    # pylint: disable=protected-access
+    def _clone_attributes(self, query):
+        query = super(UpdateManyQuery, self)._clone_attributes(query)
+        query._rows = self._rows
+        return query
+
+    def sql(self):
+        return self.compiler().generate_update_many(self)
+
+    def execute(self):
+        if not self._rows:
+            return [] if self._returning is not None else 0
+        return super(UpdateManyQuery, self).execute()
 
 # pylint: disable=protected-access, too-few-public-methods
 class QueryCompiler(peewee.QueryCompiler):
     """Overrides peewee.QueryCompiler to add custom behavior"""
 
-    def generate_unique_insert(self, query):
-        """Generate an insert SQL statement which check an unique field"""
-
-        model = query.model_class
-        unique_entity = query._unique
-        alias_map = self.alias_map_class()
-        alias_map.add(model, model._meta.db_table)
-        clauses = [peewee.SQL('INSERT INTO'), model._as_entity()]
-
+    @staticmethod
+    def _get_values_clauses(query):
+        """Build the VALUES part of an insert, return the fields and values"""
         fields, value_clauses = [], []
         have_fields = False
 
@@ -75,6 +150,19 @@ class QueryCompiler(peewee.QueryCompiler):
 
             value_clauses.append(peewee.EnclosedClause(*values))
 
+        return fields, value_clauses
+
+    def generate_unique_insert(self, query):
+        """Generate an insert SQL statement which check an unique field"""
+
+        model = query.model_class
+        unique_entity = query._unique
+        alias_map = self.alias_map_class()
+        alias_map.add(model, model._meta.db_table)
+        clauses = [peewee.SQL('INSERT INTO'), model._as_entity()]
+
+        fields, value_clauses = self._get_values_clauses(query)
+
         clauses.extend([
             self._get_field_clause(fields),
             peewee.SQL('SELECT * FROM'),
@@ -96,3 +184,150 @@ class QueryCompiler(peewee.QueryCompiler):
 
         return self.build_query(clauses, alias_map)
 
+    def generate_upsert(self, query):
+        """Generate an INSERT ... ON CONFLICT statement
+
+        query._conflict holds the fields of the unique constraint, the rows
+        in conflict are skipped (DO NOTHING) or get the fields of
+        query._conflict_update overwritten (DO UPDATE). In that last case the
+        RETURNING clause gives back every row, inserted or already there.
+        """
+        model = query.model_class
+        alias_map = self.alias_map_class()
+        alias_map.add(model, model._meta.db_table)
+
+        fields, value_clauses = self._get_values_clauses(query)
+        clauses = [
+            peewee.SQL('INSERT INTO'), model._as_entity(),
+            self._get_field_clause(fields),
+            peewee.SQL('VALUES'), peewee.CommaClause(*value_clauses),
+            peewee.SQL('ON CONFLICT'),
+            self._get_field_clause(query._conflict)
+        ]
+
+        if query._conflict_update:
+            clauses.extend([
+                peewee.SQL('DO UPDATE SET'),
+                peewee.CommaClause(*[
+                    peewee.Clause(
+                        peewee.Entity(field.db_column), peewee.SQL('='),
+                        peewee.Entity('excluded', field.db_column)
+                    ) for field in query._conflict_update
+                ])
+            ])
+        else:
+            clauses.append(peewee.SQL('DO NOTHING'))
+
+        if query._returning is not None:
+            clauses.extend([
+                peewee.SQL('RETURNING'), peewee.CommaClause(*query._returning)
+            ])
+
+        return self.build_query(clauses, alias_map)
+
+    def generate_update_many(self, query):
+        """Generate an UPDATE ... FROM (VALUES ...) statement
+
+        Each row of query._rows updates the row of the table with the same
+        primary key, a field missing from a row keeps its value while a None
+        sets it to NULL: the fields missing from some rows get a boolean
+        <column>__present column in VALUES telling whether the row gives them.
+        The first row of VALUES is a NULL row cast to the table columns, it
+        gives the right types to the parameters which would be text otherwise.
+
+        The version of a versioned model (with a version field) is increased
+        by every update. A row giving its version is only updated if it
+        matches the one of the table.
+        """
+        model = query.model_class
+        key = model._meta.primary_key
+        version = model._meta.fields.get('version')
+        table = model._meta.db_table
+        alias_map = self.alias_map_class()
+        alias_map.add(model, table)
+
+        # the fields overload ==, they are compared by identity
+        given = {id(field): field for row in query._rows for field in row}
+        fields = sorted(
+            [field for field in given.values()
+             if field is not key and field is not version],
+            key=operator.attrgetter('_sort_key')
+        )
+        if not fields and version is None:
+            fields = [key]
+        columns = [key] + [field for field in fields if field is not key]
+        versioned = version is not None and id(version) in given
+        if versioned:
+            columns.append(version)
+        partial = [field for field in fields
+                   if any(field not in row for row in query._rows)]
+        present = {id(field): '%s__present' % field.db_column
+                   for field in partial}
+
+        entity, _ = self._parse_entity(model._as_entity(), None, None)
+        value_clauses = [peewee.EnclosedClause(*[
+            peewee.SQL('(NULL::%s).%s' % (entity, self.quote(field.db_column)))
+            for field in columns
+        ] + [peewee.SQL('NULL::boolean') for _ in partial])]
+        for row in query._rows:
+            value_clauses.append(peewee.EnclosedClause(*[
+                peewee.Param(row[field], conv=field.db_value)
+                if field in row else peewee.SQL('NULL')
+                for field in columns
+            ] + [peewee.SQL('TRUE' if field in row else 'FALSE')
+                 for field in partial]))
+
+        assignments = []
+        for field in fields:
+            value = peewee.Entity('var', field.db_column)
+            if id(field) in present:
+                value = peewee.Clause(
+                    peewee.SQL('CASE WHEN'),
+                    peewee.Entity('var', present[id(field)]),
+                    peewee.SQL('THEN'), value, peewee.SQL('ELSE'),
+                    peewee.Entity(table, field.db_column), peewee.SQL('END')
+                )
+            assignments.append(peewee.Clause(
+                peewee.Entity(field.db_column), peewee.SQL('='), value
+            ))
+        where_clauses = [peewee.Clause(
+            peewee.Entity(table, key.db_column), peewee.SQL('='),
+            peewee.Entity('var', key.db_column)
+        )]
+        if version is not None:
+            assignments.append(peewee.Clause(
+                peewee.Entity(version.db_column), peewee.SQL('='),
+                peewee.Entity(table, version.db_column), peewee.SQL('+ 1')
+            ))
+        if versioned:
+            where_clauses.append(peewee.Clause(
+                peewee.Entity(table, version.db_column), peewee.SQL('='),
+                peewee.fn.COALESCE(
+                    peewee.Entity('var', version.db_column),
+                    peewee.Entity(table, version.db_column)
+                )
+            ))
+
+        clauses = [
+            peewee.SQL('UPDATE'), model._as_entity(), peewee.SQL('SET'),
+            peewee.CommaClause(*assignments),
+            peewee.SQL('FROM'),
+            peewee.EnclosedClause(
+                peewee.Clause(
+                    peewee.SQL('VALUES'), peewee.CommaClause(*value_clauses)
+                )
+            ),
+            peewee.SQL('AS var'),
+            peewee.EnclosedClause(*[
+                field.as_entity(with_table=False) for field in columns
+            ] + [peewee.Entity(present[id(field)]) for field in partial]),
+            peewee.SQL('WHERE'),
+            peewee.Clause(*where_clauses, glue=' AND ')
+        ]
+
+        if query._returning is not None:
+            clauses.extend([
+                peewee.SQL('RETURNING'), peewee.CommaClause(*query._returning)
+            ])
+
+        return self.build_query(clauses, alias_map)
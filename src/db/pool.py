@@ -0,0 +1,218 @@
+"""Connection pooling
+
+Keep the database connections opened between the requests instead of paying
+a TCP and authentication handshake for each of them.
+
+The pool is plugged in peewee through the _connect/_close hooks, so
+database.connect() checks a connection out of the pool and database.close()
+gives it back. Those hooks are called by peewee with the connection lock held,
+the pool does not need its own lock.
+"""
+import collections
+import logging
+import threading
+import time
+
+import playhouse.postgres_ext
+import psycopg2
+import psycopg2.extensions
+
+import db.orm
+
+logger = logging.getLogger('rulzurapi.pool')
+
+
+class PoolExhausted(Exception):
+    """All the connections allowed for the pool are already checked out"""
+    pass
+
+
+class PooledDatabase(object):
+    """Keep a pool of opened connections for a peewee database
+
+    min_connections: connections opened by fill() and never closed because of
+    their idle time
+    max_connections: maximum of connections opened at the same time, 0 disables
+    the pooling (connections are closed when given back)
+    idle_timeout: seconds after which an unused connection is closed
+    max_age: seconds after which a connection is recycled
+    check_interval: idle seconds after which a connection is pinged before
+    being checked out
+    """
+    stats_keys = ('checkouts', 'created', 'closed', 'recycled', 'expired',
+                  'rollbacks', 'health_check_failures', 'exhausted')
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, database, min_connections=0, max_connections=20,
+                 idle_timeout=None, max_age=None, check_interval=None,
+                 **kwargs):
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self.check_interval = check_interval
+
+        # idle connections as (created, returned, conn), the most recently
+        # returned on the right
+        self._idle = collections.deque()
+        self._in_use = {}
+        self._stats = collections.Counter({key: 0 for key in self.stats_keys})
+
+        super(PooledDatabase, self).__init__(database, **kwargs)
+
+    def _connect(self, *args, **kwargs):
+        self._prune()
+        while self._idle:
+            created, returned, conn = self._idle.pop()
+            if self._is_usable(conn, created, returned):
+                break
+            self._discard(conn)
+        else:
+            if self.max_connections and (
+                    len(self._in_use) >= self.max_connections):
+                self._stats['exhausted'] += 1
+                raise PoolExhausted(
+                    'All the %d connections are in use' % self.max_connections
+                )
+            conn = super(PooledDatabase, self)._connect(*args, **kwargs)
+            created = time.time()
+            self._stats['created'] += 1
+
+        self._in_use[id(conn)] = created
+        self._stats['checkouts'] += 1
+        return conn
+
+    def _close(self, conn, close_conn=False):
+        created = self._in_use.pop(id(conn), None)
+        if created is None or close_conn or not self.max_connections:
+            self._discard(conn)
+            return
+
+        if conn.closed:
+            self._stats['closed'] += 1
+            return
+
+        # A failed statement outside of a transaction leaves the connection in
+        # an aborted state, it must not leak into the next request
+        status = conn.get_transaction_status()
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+                self._stats['rollbacks'] += 1
+            except psycopg2.Error:
+                self._discard(conn)
+                return
+
+        if self._is_expired(created):
+            self._stats['recycled'] += 1
+            self._discard(conn)
+        else:
+            self._idle.append((created, time.time(), conn))
+
+    def _discard(self, conn):
+        """Really close a connection"""
+        self._stats['closed'] += 1
+        if conn.closed:
+            return
+        try:
+            super(PooledDatabase, self)._close(conn)
+        except psycopg2.Error:
+            logger.exception('Error while closing connection %d', id(conn))
+
+    def _is_expired(self, created):
+        """Check if a connection reached its max age"""
+        return bool(self.max_age) and time.time() - created > self.max_age
+
+    def _is_usable(self, conn, created, returned):
+        """Health check run before checking a connection out"""
+        if conn.closed:
+            return False
+        if self._is_expired(created):
+            self._stats['recycled'] += 1
+            return False
+
+        status = conn.get_transaction_status()
+        if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            self._stats['health_check_failures'] += 1
+            return False
+
+        if (self.check_interval is not None and
+                time.time() - returned > self.check_interval):
+            try:
+                cursor = conn.cursor()
+                cursor.execute('SELECT 1')
+                cursor.close()
+                conn.rollback()
+            except psycopg2.Error:
+                self._stats['health_check_failures'] += 1
+                return False
+
+        return True
+
+    def _prune(self):
+        """Close the connections idle for too long, keep min_connections"""
+        if not self.idle_timeout:
+            return
+
+        deadline = time.time() - self.idle_timeout
+        while len(self._idle) > self.min_connections:
+            _, returned, conn = self._idle[0]
+            if returned > deadline:
+                break
+            self._idle.popleft()
+            self._stats['expired'] += 1
+            self._discard(conn)
+
+    def fill(self):
+        """Open connections until min_connections are available
+
+        Nothing is opened before init() gives the settings of a deferred
+        database.
+        """
+        if self.deferred:
+            return
+        with self._conn_lock:
+            while len(self._idle) + len(self._in_use) < self.min_connections:
+                conn = super(PooledDatabase, self)._connect(
+                    self.database, **self.connect_kwargs
+                )
+                self._stats['created'] += 1
+                now = time.time()
+                self._idle.append((now, now, conn))
+
+    def close_all(self):
+        """Close all the idle connections of the pool"""
+        with self._conn_lock:
+            while self._idle:
+                _, _, conn = self._idle.pop()
+                self._discard(conn)
+
+    def reset(self):
+        """Forget the connections inherited from the parent process
+
+        To be called in a forked worker: the sockets are shared with the
+        parent, closing them would end its sessions, so they are dropped
+        without a word and the worker opens its own connections.
+        """
+        self._conn_lock = threading.Lock()
+        self._idle.clear()
+        self._in_use.clear()
+        self._stats = collections.Counter({key: 0 for key in self.stats_keys})
+
+    def stats(self):
+        """Return the counters and the current state of the pool"""
+        stats = dict(self._stats)
+        stats.update(
+            in_use=len(self._in_use),
+            idle=len(self._idle),
+            min_connections=self.min_connections,
+            max_connections=self.max_connections,
+        )
+        return stats
+
+
+#pylint: disable=abstract-method
+class PooledPostgresqlExtDatabase(PooledDatabase, db.orm.QueryHooksDatabase,
+                                  playhouse.postgres_ext.PostgresqlExtDatabase):
+    """PostgresqlExtDatabase with pooled connections and query hooks"""
+    pass
@@ -0,0 +1,157 @@
+"""In-process cache of the reference rows
+
+The ingredients, the utensils and the recipes looked up by id are kept in a
+bounded cache per process: the least recently used entries are evicted past
+CACHE_SIZE entries and an entry is reloaded CACHE_TTL seconds after it was
+loaded, which bounds the staleness of the rows written by the other
+processes. The writes of the process invalidate their entries once the
+request is over, after the commit, the hooks publish them to the other
+processes (see utils.invalidation).
+
+The cached rows are shared between the requests, they are read only.
+"""
+import collections
+import os
+import threading
+import time
+
+import flask
+
+SIZE = int(os.environ.get('CACHE_SIZE', 1024))
+TTL = float(os.environ.get('CACHE_TTL', 60))
+
+# Called with the cache and the keys invalidated by a write, in its
+# transaction
+hooks = []
+
+# Called with the cache and the keys it drops, None when all of them are
+# dropped, for the data built from its rows (see utils.response_cache)
+listeners = []
+
+
+class Cache(object):
+    """Least recently used cache, the entries expiring after ttl seconds
+
+    A size of 0 disables the cache.
+    """
+    stats_keys = ('hits', 'misses', 'evictions', 'expirations',
+                  'invalidations')
+
+    def __init__(self, name, size=SIZE, ttl=TTL, clock=time.monotonic):
+        self.name = name
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget the entries and the counters"""
+        with self._lock:
+            self._entries = collections.OrderedDict()
+            self._stats = collections.Counter(
+                {key: 0 for key in self.stats_keys}
+            )
+
+    def get(self, key, load):
+        """Value of key, load(key) is called on a miss and its value kept
+
+        The exceptions of load are raised and nothing is kept.
+        """
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+                self._stats['expirations'] += 1
+            self._stats['misses'] += 1
+
+        value = load(key)
+        if self.size:
+            self.put(key, value, now)
+        return value
+
+    def put(self, key, value, now=None):
+        """Keep value for key, evicting the least recently used entries"""
+        now = self.clock() if now is None else now
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        """Drop all the entries, the counters are kept"""
+        with self._lock:
+            self._stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+        for listener in listeners:
+            listener(self, None)
+
+    def invalidate(self, keys):
+        """Drop the entries of keys"""
+        with self._lock:
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self._stats['invalidations'] += 1
+        for listener in listeners:
+            listener(self, keys)
+
+    def invalidate_after_request(self, keys):
+        """Drop the entries of keys now and once the request is over
+
+        The second pass drops the rows read by the other requests before
+        the write was committed.
+        """
+        keys = list(keys)
+        self.invalidate(keys)
+        for hook in hooks:
+            hook(self, keys)
+        if not flask.has_request_context():
+            return
+
+        @flask.after_this_request
+        def _invalidate(response):
+            """Drop the entries once the transaction is over"""
+            self.invalidate(keys)
+            return response
+
+    def stats(self):
+        """Return the counters and the current state of the cache"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(entries=len(self._entries), size=self.size,
+                         ttl=self.ttl)
+        return stats
+
+
+ingredients = Cache('ingredients')
+utensils = Cache('utensils')
+recipes = Cache('recipes')
+
+caches = (ingredients, utensils, recipes)
+
+
+def get(name):
+    """Cache of a name, None if there is none"""
+    for cache in caches:
+        if cache.name == name:
+            return cache
+    return None
+
+
+def clear():
+    """Drop the entries of all the caches"""
+    for cache in caches:
+        cache.clear()
+
+
+def reset():
+    """Empty all the caches, the forked workers start from scratch"""
+    for cache in caches:
+        cache.reset()
@@ -0,0 +1,95 @@
+"""JSON encoding of the responses
+
+The responses are dumped compact, without the indentation of flask.jsonify
+(which also lets the stdlib json use its C accelerated encoder), by the
+fastest encoder available: orjson, then ujson, then the stdlib json. The
+JSON_ENCODER environment variable forces one of them (orjson, ujson or json).
+
+orjson and ujson only know the plain JSON types: they are used with the
+default json_encoder of the app only, an app with its own encoder goes
+through the stdlib with it, as do the objects they refuse. orjson always
+writes UTF-8: with JSON_AS_ASCII its non-ASCII characters are escaped as the
+stdlib does, the bytes (and ETags) do not depend on the encoder installed.
+"""
+import json
+import os
+import re
+
+import flask
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+ENCODER = os.environ.get('JSON_ENCODER', 'auto')
+
+MIMETYPE = 'application/json'
+SEPARATORS = (',', ':')
+NON_ASCII = re.compile('[^\x00-\x7f]')
+
+
+def _escape(match):
+    """\\u escape of a non-ASCII character, a surrogate pair past U+FFFF"""
+    code = ord(match.group())
+    if code > 0xffff:
+        code -= 0x10000
+        return '\\u%04x\\u%04x' % (0xd800 | code >> 10, 0xdc00 | code & 0x3ff)
+    return '\\u%04x' % code
+
+def _orjson_dumps(obj, sort_keys, ensure_ascii):
+    """Dump with orjson, which always writes UTF-8"""
+    option = orjson.OPT_SORT_KEYS if sort_keys else 0
+    data = orjson.dumps(obj, option=option).decode('utf-8')
+    if ensure_ascii:
+        # the non-ASCII characters can only be in the strings
+        data = NON_ASCII.sub(_escape, data)
+    return data
+
+def _ujson_dumps(obj, sort_keys, ensure_ascii):
+    """Dump with ujson"""
+    return ujson.dumps(obj, sort_keys=sort_keys, ensure_ascii=ensure_ascii,
+                       escape_forward_slashes=False)
+
+# C encoders, the fastest first
+ENCODERS = (('orjson', orjson, _orjson_dumps),
+            ('ujson', ujson, _ujson_dumps))
+
+
+def select(name=ENCODER):
+    """Dumps function of the C encoder name, None for the stdlib json
+
+    'auto' selects the fastest C encoder installed.
+    """
+    for encoder_name, module, encoder_dumps in ENCODERS:
+        if module is not None and name in ('auto', encoder_name):
+            return encoder_dumps
+    return None
+
+encoder = select()
+
+
+def dumps(obj):
+    """Dump obj as compact JSON with the settings of the current app"""
+    app = flask.current_app
+    sort_keys = app.config['JSON_SORT_KEYS']
+    ensure_ascii = app.config['JSON_AS_ASCII']
+
+    if encoder is not None and app.json_encoder is flask.json.JSONEncoder:
+        try:
+            return encoder(obj, sort_keys, ensure_ascii)
+        except (TypeError, ValueError, OverflowError):
+            pass
+
+    return json.dumps(obj, cls=app.json_encoder, separators=SEPARATORS,
+                      sort_keys=sort_keys, ensure_ascii=ensure_ascii)
+
+
+def jsonify(data):
+    """Response holding data as JSON"""
+    return flask.current_app.response_class(dumps(data), mimetype=MIMETYPE)
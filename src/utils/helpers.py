@@ -1,8 +1,18 @@
 """Helpers for rulzurapi"""
+import base64
+import binascii
 import functools
+import json
 
 import flask
-import peewee
+
+import utils.encoding
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STREAM_BATCH_SIZE = 1000
 
 class APIException(Exception):
     """Exception for the API, customize error output"""
@@ -19,7 +29,7 @@ def jsonify_api_exception(api_exception):
 
     response_dict = {'message': message, 'status_code': status_code}
     response_dict.update(dict(payload or ()))
-    return flask.jsonify(response_dict), status_code
+    return utils.encoding.jsonify(response_dict), status_code
 
 def raise_or_return(schema):
     """Load the data in a dict, if errors are returned, an error is raised"""
@@ -33,18 +43,6 @@ def raise_or_return(schema):
 
     return data
 
-# pylint: disable=protected-access
-def model_entity(model):
-    """Retrieve the entity of a specific model
-
-    ie: "schema"."table"
-    """
-    query_compiler = peewee.QueryCompiler()
-    me, _ = query_compiler._parse_entity(
-        model._as_entity(), None, None
-    )
-    return me
-
 def unpack(value):
     """Return a three tuple of data, code, and headers"""
     if not isinstance(value, tuple):
@@ -82,3 +80,215 @@ def template(mapping):
         return wrapper
 
     return decorator
+
+
+def conditional(response):
+    """Add the validators of a GET response, 304 if the client has it
+
+    The ETag is the hash of the body unless the view gave one (see
+    versioned), the streamed responses are left alone.
+    If-None-Match takes precedence over If-Modified-Since, which is only
+    honoured with a Last-Modified (werkzeug ignores it once there is an
+    ETag). The views with templates answer HTML or JSON depending on Accept,
+    their responses vary with it.
+    """
+    request = flask.request
+    if hasattr(request, 'tpl'):
+        response.vary.add('Accept')
+    if (request.method not in ('GET', 'HEAD') or
+            response.status_code != 200 or response.is_streamed or
+            response.direct_passthrough):
+        return response
+
+    if 'ETag' not in response.headers:
+        response.add_etag()
+
+    if 'If-None-Match' in request.headers:
+        etag, _ = response.get_etag()
+        unmodified = request.if_none_match.contains_weak(etag)
+    else:
+        unmodified = (request.if_modified_since is not None and
+                      response.last_modified is not None and
+                      response.last_modified <= request.if_modified_since)
+
+    if unmodified:
+        response.status_code = 304
+    return response
+
+
+def versioned(data, version, code=200):
+    """Response of a versioned row, the version is the ETag of its JSON
+
+    The rows are versioned by the database (see db.orm.UpdateManyQuery), the
+    templates keep the hash of their body.
+    """
+    if getattr(flask.request, 'tpl', None) is not None:
+        return data, code
+    return data, code, {'ETag': '"%d"' % version}
+
+
+def if_match():
+    """Version required by the If-Match header, None without condition
+
+    A version can only match a single strong numeric ETag: 412 if none of the
+    ETags can match, 400 if several of them could.
+    """
+    if 'If-Match' not in flask.request.headers:
+        return None
+    etags = flask.request.if_match
+    if etags.star_tag:
+        return None
+
+    versions = [int(etag) for etag in etags if etag.isdigit()]
+    if not versions:
+        raise APIException('Precondition failed', 412)
+    if len(versions) > 1:
+        raise APIException('Request malformed', 400,
+                           {'errors': {'If-Match': ['Only one ETag.']}})
+    return versions[0]
+
+
+def not_found(message):
+    """404 of a row which does not exist, 412 for a conditional request
+
+    An If-Match can not match a row without any version (RFC 7232 3.1).
+    """
+    if 'If-Match' in flask.request.headers:
+        return APIException('Precondition failed', 412)
+    return APIException(message, 404)
+
+
+def check_versions(model, rows, not_found):
+    """412 if rows not updated exist, the version they gave is not theirs
+
+    Only the ids of not_found given with a version are looked up, in one
+    query, the others do not exist.
+    """
+    ids = [row['id'] for row in rows
+           if row['id'] in not_found and row.get('version') is not None]
+    if not ids:
+        return
+
+    conflicts = list(model
+                     .select(model.id, model.version)
+                     .where(model.id << ids)
+                     .order_by(model.id)
+                     .dicts())
+    if conflicts:
+        raise APIException('Precondition failed', 412,
+                           {'conflicts': conflicts})
+
+
+def encode_cursor(value):
+    """Build an opaque pagination cursor from the last value of a page"""
+    cursor = json.dumps({'after': value}).encode('utf-8')
+    return base64.urlsafe_b64encode(cursor).decode('ascii')
+
+def decode_cursor(cursor):
+    """Retrieve the value hidden in a pagination cursor
+
+    The pages are keyed by id, only a positive or null integer is valid.
+    """
+    try:
+        cursor = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        value = json.loads(cursor.decode('utf-8'))['after']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        value = None
+
+    # bool is an int
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise APIException('Request malformed', 400,
+                           {'errors': {'after': ['Invalid cursor.']}})
+    return value
+
+def page_size():
+    """Read the page size requested in the "limit" argument"""
+    limit = flask.request.args.get('limit', PAGE_SIZE)
+    try:
+        limit = int(limit)
+    except ValueError:
+        limit = 0
+
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise APIException(
+            'Request malformed', 400,
+            {'errors': {'limit': ['Must be between 1 and %d.' % MAX_PAGE_SIZE]}}
+        )
+    return limit
+
+def paginate(query, field):
+    """Keyset pagination of a dicts query on an unique field
+
+    Reads the "limit" and "after" arguments of the request and return the rows
+    of the page and the cursor of the next one (None on the last page). The
+    cost of a page does not depend on its position in the table.
+    """
+    limit = page_size()
+    after = flask.request.args.get('after')
+    if after is not None:
+        query = query.where(field > decode_cursor(after))
+
+    rows = list(query.order_by(field).limit(limit + 1))
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1][field.name])
+
+def stream_requested():
+    """Check if the client asked for a streamed response
+
+    Either NDJSON through the Accept header or a JSON document with the
+    "stream" argument
+    """
+    return (flask.request.accept_mimetypes.best == NDJSON_MIMETYPE or
+            flask.request.args.get('stream') in ('1', 'true'))
+
+def server_side(query, batch_size=STREAM_BATCH_SIZE):
+    """Iterate over the rows of a query through a server-side cursor
+
+    Rows are fetched batch_size at a time, only one batch is held in memory.
+    The rows are yielded as dicts of the raw database values.
+    """
+    sql, params = query.sql()
+    with query.database.transaction():
+        cursor = query.database.execute_sql(
+            sql, params, require_commit=False, named_cursor=True
+        )
+        rows = cursor.fetchmany(batch_size)
+        # named cursors only describe the columns after the first fetch
+        columns = [column[0] for column in cursor.description or ()]
+        while rows:
+            yield [dict(zip(columns, row)) for row in rows]
+            rows = cursor.fetchmany(batch_size)
+        cursor.close()
+
+def stream(query, key):
+    """Stream all the rows of a query, in a JSON document or in NDJSON
+
+    The JSON document has the same shape than the paginated one:
+    {"<key>": [rows...]}, without the "next" cursor.
+    """
+    dumps = utils.encoding.dumps
+
+    if flask.request.accept_mimetypes.best == NDJSON_MIMETYPE:
+        mimetype = NDJSON_MIMETYPE
+
+        def generate():
+            """Write one row per line"""
+            for rows in server_side(query):
+                yield ''.join(dumps(row) + '\n' for row in rows)
+    else:
+        mimetype = 'application/json'
+
+        def generate():
+            """Write the rows inside a JSON array"""
+            yield '{%s: [' % dumps(key)
+            separator = ''
+            for rows in server_side(query):
+                yield separator + ', '.join(dumps(row) for row in rows)
+                separator = ', '
+            yield ']}'
+
+    return flask.Response(flask.stream_with_context(generate()),
+                          mimetype=mimetype)
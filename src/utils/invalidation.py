@@ -0,0 +1,149 @@
+"""Invalidation of the caches of all the processes
+
+The writes publish the keys they invalidate with pg_notify in their
+transaction: PostgreSQL only delivers the notification once the transaction
+is committed, and never if it is rolled back. Each worker runs a Listener
+thread on its own connection (outside of the pool) which drops the entries
+notified by the other processes.
+
+While the listener is connected, an entry is stale for the time the
+notification takes to arrive. The listener pings the connection every
+CACHE_LISTEN_PING seconds, a lost connection is noticed within that delay.
+While it is disconnected, the entries are only reloaded after CACHE_TTL
+seconds (see utils.cache), and all the caches are emptied when it connects
+again since the notifications sent meanwhile are lost.
+"""
+import json
+import logging
+import os
+import select
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+import db.connector
+import utils.cache
+
+logger = logging.getLogger('rulzurapi.invalidation')
+
+CHANNEL = os.environ.get('CACHE_CHANNEL', 'rulzurapi_cache')
+PING_INTERVAL = float(os.environ.get('CACHE_LISTEN_PING', 5))
+RECONNECT_DELAY = float(os.environ.get('CACHE_LISTEN_RECONNECT', 1))
+MAX_RECONNECT_DELAY = 30
+
+# Keys per notification, the payload of a notification is below 8000 bytes
+CHUNK_SIZE = 500
+
+
+def publish(cache, keys):
+    """Notify the other processes of the keys invalidated by a write
+
+    Cache hook (see utils.cache.hooks), run in the transaction of the write.
+    """
+    keys = sorted(keys)
+    for start in range(0, len(keys), CHUNK_SIZE):
+        payload = json.dumps({'pid': os.getpid(), 'cache': cache.name,
+                              'keys': keys[start:start + CHUNK_SIZE]})
+        db.connector.database.execute_sql('SELECT pg_notify(%s, %s)',
+                                          (CHANNEL, payload))
+
+
+def invalidate(payload):
+    """Drop the entries of a notification sent by another process"""
+    try:
+        message = json.loads(payload)
+        pid, name, keys = message['pid'], message['cache'], message['keys']
+    except (ValueError, TypeError, KeyError):
+        logger.warning('Invalid cache notification: %r', payload)
+        return
+
+    cache = utils.cache.get(name)
+    if pid != os.getpid() and cache is not None:
+        cache.invalidate(keys)
+
+
+class Listener(threading.Thread):
+    """Listen to the notifications of the channel and apply them"""
+
+    def __init__(self, connect=None, channel=CHANNEL):
+        super(Listener, self).__init__(name='cache-listener', daemon=True)
+        self.connect = connect or (lambda: psycopg2.connect(
+            database=db.connector.database.database,
+            **db.connector.database.connect_kwargs
+        ))
+        self.channel = channel
+        self.connected = False
+        self.stats = {'notifications': 0, 'connections': 0}
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """Stop listening, the thread ends within PING_INTERVAL seconds"""
+        self._stop_event.set()
+
+    def run(self):
+        delay = RECONNECT_DELAY
+        while not self._stop_event.is_set():
+            try:
+                self.listen()
+                delay = RECONNECT_DELAY
+            except (psycopg2.Error, OSError) as error:
+                logger.warning('Cache listener disconnected, the caches '
+                               'expire after %ss: %s', utils.cache.TTL, error)
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            finally:
+                self.connected = False
+
+    def listen(self):
+        """Apply the notifications until the connection fails or stop()"""
+        conn = self.connect()
+        try:
+            conn.set_isolation_level(
+                psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT
+            )
+            with conn.cursor() as cursor:
+                cursor.execute('LISTEN "%s"' % self.channel.replace('"', ''))
+                # the notifications sent while disconnected are lost
+                utils.cache.clear()
+                self.connected = True
+                self.stats['connections'] += 1
+
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], PING_INTERVAL)[0]:
+                        conn.poll()
+                    else:
+                        cursor.execute('SELECT 1')
+                    while conn.notifies:
+                        self.stats['notifications'] += 1
+                        invalidate(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+
+listener = None
+
+
+def start():
+    """Publish the invalidations and listen to the other processes
+
+    To be called in each worker, after the fork.
+    """
+    global listener # pylint: disable=global-statement
+    if publish not in utils.cache.hooks:
+        utils.cache.hooks.append(publish)
+    listener = Listener()
+    listener.start()
+
+
+def stop():
+    """Stop the listener of the process"""
+    if listener is not None:
+        listener.stop()
+
+
+def stats():
+    """State of the listener of the process"""
+    if listener is None:
+        return {'connected': False, 'notifications': 0, 'connections': 0}
+    return dict(listener.stats, connected=listener.connected)
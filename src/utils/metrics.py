@@ -0,0 +1,291 @@
+"""Metrics in the Prometheus text exposition format
+
+Each process counts in memory (a dict update under a lock per event) and
+writes a snapshot of its counters in METRICS_DIR at most every
+FLUSH_INTERVAL seconds, /metrics sums the snapshots of all the processes so
+any gunicorn worker can answer the scrape. The snapshots of the dead workers
+are kept for the counters and the histograms (they never go down) but not for
+the gauges.
+
+METRICS_DIR must be emptied when the server starts (see on_starting in the
+gunicorn configuration).
+"""
+import bisect
+import collections
+import json
+import os
+import tempfile
+import threading
+import time
+
+import flask
+
+import db.connector
+import utils.cache
+import utils.response_cache
+
+METRICS_DIR = os.environ.get(
+    'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'rulzurapi_metrics')
+)
+FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1))
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+MIMETYPE = 'text/plain; version=0.0.4'
+PREFIX = 'rulzurapi_'
+
+DESCRIPTIONS = {
+    'requests_total': ('counter', 'Requests handled'),
+    'request_errors_total': ('counter', 'Requests answered with an error'),
+    'request_duration_seconds': ('histogram', 'Time spent on the requests'),
+    'db_queries_total': ('counter', 'Queries sent to the database'),
+    'db_query_duration_seconds_total': ('counter',
+                                        'Time spent waiting for the database'),
+    'db_pool_events_total': ('counter', 'Events of the connection pool'),
+    'db_pool_connections': ('gauge', 'Connections of the pool by state'),
+    'cache_events_total': ('counter', 'Events of the in-process caches'),
+    'cache_entries': ('gauge', 'Entries kept in the in-process caches'),
+}
+
+
+def _key(name, labels):
+    """Hashable key of a metric"""
+    return name, tuple(sorted((key, str(value))
+                              for key, value in labels.items()))
+
+
+class Registry(object):
+    """Metrics of the current process"""
+
+    def __init__(self, path=METRICS_DIR, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flushed = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the metrics, the forked workers start from zero"""
+        self.counters = collections.Counter()
+        self.histograms = {}
+
+    def inc(self, name, labels=None, value=1):
+        """Increment a counter"""
+        key = _key(name, labels or {})
+        with self._lock:
+            self.counters[key] += value
+
+    def observe(self, name, labels, value):
+        """Add a value to an histogram"""
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0
+                }
+            histogram['buckets'][bisect.bisect_left(BUCKETS, value)] += 1
+            histogram['sum'] += value
+
+    def snapshot(self):
+        """Metrics of the process, in a JSON serialisable form"""
+        with self._lock:
+            counters = [[name, labels, value]
+                        for (name, labels), value in self.counters.items()]
+            histograms = [[name, labels, {'buckets': list(value['buckets']),
+                                          'sum': value['sum']}]
+                          for (name, labels), value in self.histograms.items()]
+
+        stats = db.connector.database.stats()
+        counters.extend(
+            ['db_pool_events_total', [['event', event]], stats[event]]
+            for event in db.connector.database.stats_keys
+        )
+        gauges = [['db_pool_connections', [['state', state]], stats[state]]
+                  for state in ('in_use', 'idle')]
+
+        for cache in utils.cache.caches + (utils.response_cache.responses,):
+            stats = cache.stats()
+            counters.extend(
+                ['cache_events_total',
+                 [['cache', cache.name], ['event', event]], stats[event]]
+                for event in cache.stats_keys
+            )
+            gauges.append(['cache_entries', [['cache', cache.name]],
+                           stats['entries']])
+
+        return {'pid': os.getpid(), 'counters': counters,
+                'histograms': histograms, 'gauges': gauges}
+
+    def flush(self, force=False):
+        """Write the snapshot of the process, at most every flush_interval
+
+        The threads of the process flush one at a time, each through its own
+        temporary file.
+        """
+        with self._flush_lock:
+            now = time.time()
+            if not force and now - self._flushed < self.flush_interval:
+                return
+            self._flushed = now
+
+            os.makedirs(self.path, exist_ok=True)
+            filename = os.path.join(self.path, '%d.json' % os.getpid())
+            tmp_fd, tmp_filename = tempfile.mkstemp(dir=self.path,
+                                                    suffix='.tmp')
+            try:
+                with os.fdopen(tmp_fd, 'w') as tmp_file:
+                    json.dump(self.snapshot(), tmp_file)
+                os.replace(tmp_filename, filename)
+            except BaseException:
+                os.remove(tmp_filename)
+                raise
+
+    def clear(self):
+        """Remove the snapshots of all the processes"""
+        if not os.path.isdir(self.path):
+            return
+        for filename in os.listdir(self.path):
+            if filename.endswith('.json'):
+                os.remove(os.path.join(self.path, filename))
+
+    def collect(self):
+        """Sum the snapshots of all the processes"""
+        self.flush(force=True)
+        counters, gauges = collections.Counter(), collections.Counter()
+        histograms = {}
+
+        for filename in sorted(os.listdir(self.path)):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.path, filename)) as snapshot_file:
+                    snapshot = json.load(snapshot_file)
+            except (OSError, ValueError):
+                continue
+
+            for name, labels, value in snapshot['counters']:
+                counters[name, tuple(map(tuple, labels))] += value
+            for name, labels, histogram in snapshot['histograms']:
+                key = name, tuple(map(tuple, labels))
+                total = histograms.setdefault(
+                    key, {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0}
+                )
+                total['buckets'] = [a + b for a, b in zip(
+                    total['buckets'], histogram['buckets']
+                )]
+                total['sum'] += histogram['sum']
+            if _alive(snapshot['pid']):
+                for name, labels, value in snapshot['gauges']:
+                    gauges[name, tuple(map(tuple, labels))] += value
+
+        return counters, histograms, gauges
+
+    def exposition(self):
+        """Metrics of all the processes in the text exposition format"""
+        counters, histograms, gauges = self.collect()
+        samples = collections.defaultdict(list)
+
+        for (name, labels), value in sorted(counters.items()):
+            samples[name].append((name, labels, value))
+        for (name, labels), value in sorted(gauges.items()):
+            samples[name].append((name, labels, value))
+        for (name, labels), histogram in sorted(histograms.items()):
+            cumulated = 0
+            for bound, count in zip(BUCKETS + ('+Inf',),
+                                    histogram['buckets']):
+                cumulated += count
+                samples[name].append((
+                    name + '_bucket', labels + (('le', str(bound)),), cumulated
+                ))
+            samples[name].append((name + '_sum', labels, histogram['sum']))
+            samples[name].append((name + '_count', labels, cumulated))
+
+        lines = []
+        for name in sorted(samples):
+            metric_type, description = DESCRIPTIONS[name]
+            lines.append('# HELP %s%s %s' % (PREFIX, name, description))
+            lines.append('# TYPE %s%s %s' % (PREFIX, name, metric_type))
+            for sample_name, labels, value in samples[name]:
+                lines.append('%s%s%s %s' % (
+                    PREFIX, sample_name, _labels(labels), _value(value)
+                ))
+        return '\n'.join(lines) + '\n'
+
+
+def _alive(pid):
+    """Check if a process still runs"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _labels(labels):
+    """Format the labels of a sample"""
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (label, _escape(value)) for label, value in labels
+    )
+
+
+def _escape(value):
+    """Escape a label value"""
+    return (str(value).replace('\\', r'\\').replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+
+def _value(value):
+    """Format the value of a sample"""
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+registry = Registry()
+
+
+def start():
+    """Start measuring the request, to be run before the request"""
+    flask.g.metrics_start = time.perf_counter()
+
+
+def record_status(response):
+    """Keep the status of the response, to be run after the request"""
+    flask.g.metrics_status = response.status_code
+    return response
+
+
+def record_request(_):
+    """Count the request, to be run on the request teardown
+
+    The teardown also runs after an unhandled exception, which is counted as
+    a 500.
+    """
+    begin = getattr(flask.g, 'metrics_start', None)
+    if begin is None:
+        return
+
+    status = getattr(flask.g, 'metrics_status', 500)
+    endpoint = flask.request.endpoint or 'none'
+    registry.observe('request_duration_seconds',
+                     {'endpoint': endpoint, 'status': status},
+                     time.perf_counter() - begin)
+    registry.inc('requests_total', {'endpoint': endpoint, 'status': status,
+                                    'method': flask.request.method})
+    if status >= 400:
+        registry.inc('request_errors_total',
+                     {'endpoint': endpoint, 'status': status})
+    registry.flush()
+
+
+def record_query(_, __, duration, _error=None):
+    """Query hook of the database"""
+    registry.inc('db_queries_total')
+    registry.inc('db_query_duration_seconds_total', value=duration)
@@ -0,0 +1,116 @@
+"""On demand profiling of the requests
+
+A request is profiled when it carries an X-Profile header holding the admin
+token, or randomly with a probability of PROFILE_SAMPLE_RATE. The view runs
+under cProfile, the stats are stored in PROFILE_DIR as <id>.pstats, the id
+is sent back in the X-Profile-Id header and the reports are listed on
+/admin/profiles/. Only the last PROFILE_KEEP profiles are kept.
+"""
+import contextlib
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import re
+import tempfile
+import uuid
+
+import flask
+
+PROFILE_DIR = os.environ.get(
+    'PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'rulzurapi_profiles')
+)
+SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+
+PROFILE_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def requested():
+    """Check if the current request has to be profiled"""
+    token = flask.current_app.config.get('ADMIN_TOKEN')
+    given_token = flask.request.headers.get('X-Profile')
+    if token and given_token and hmac.compare_digest(
+            given_token.encode('utf-8'), token.encode('utf-8')):
+        return True
+
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+def path(profile_id):
+    """File of a profile, None if the id is not valid"""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    return os.path.join(PROFILE_DIR, '%s.pstats' % profile_id)
+
+
+def store(profiler):
+    """Write the stats of a profiler and return the profile id"""
+    profile_id = uuid.uuid4().hex
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(path(profile_id))
+
+    for old_profile in profiles()[KEEP:]:
+        try:
+            os.remove(path(old_profile['id']))
+        except OSError:
+            pass
+
+    return profile_id
+
+
+def profiles():
+    """Stored profiles, the newest first"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+
+    stored = []
+    for filename in os.listdir(PROFILE_DIR):
+        profile_id, ext = os.path.splitext(filename)
+        if ext != '.pstats' or not PROFILE_ID.match(profile_id):
+            continue
+        try:
+            mtime = os.path.getmtime(os.path.join(PROFILE_DIR, filename))
+        except OSError:
+            continue
+        stored.append({'id': profile_id, 'time': mtime})
+
+    return sorted(stored, key=lambda profile: profile['time'], reverse=True)
+
+
+def report(profile_id, sort='cumulative', limit=50):
+    """Text report of a profile, None if it does not exist"""
+    filename = path(profile_id)
+    if filename is None or not os.path.exists(filename):
+        return None
+
+    output = io.StringIO()
+    stats = pstats.Stats(filename, stream=output)
+    stats.sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+
+@contextlib.contextmanager
+def profile():
+    """Run the block under cProfile if the request has to be profiled"""
+    if not requested():
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        flask.g.profile_id = store(profiler)
+
+
+def add_header(response):
+    """Send the id of the profile back, to be run after the request"""
+    profile_id = getattr(flask.g, 'profile_id', None)
+    if profile_id is not None:
+        response.headers['X-Profile-Id'] = profile_id
+    return response
@@ -0,0 +1,359 @@
+"""Cache of the encoded responses of the read endpoints
+
+A view decorated with cached() is answered from the bytes of its previous
+response, keyed by the endpoint, its arguments and the template chosen for the
+request (None for JSON). Only the 200 responses are kept, with their ETag and
+the time they were built as Last-Modified, along with tags
+naming the rows they were built from, e.g. ('ingredients', 3): the
+invalidations of the utils.cache caches, local or notified by the other
+workers (see utils.invalidation), drop the responses tagged with their keys.
+
+RESPONSE_CACHE selects the backend:
+
+* memory (default): least recently used responses of the process
+* sqlite:<path>: responses shared by the workers of the host in a SQLite file,
+  a local stand-in for a shared store
+* none: disable the cache
+
+RESPONSE_CACHE_SIZE responses are kept, at most RESPONSE_CACHE_TTL seconds.
+"""
+import collections
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import flask
+
+import utils.cache
+import utils.helpers
+
+BACKEND = os.environ.get('RESPONSE_CACHE', 'memory')
+SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+TTL = float(os.environ.get('RESPONSE_CACHE_TTL', utils.cache.TTL))
+
+# Status, mimetype, body and validators of a cached response
+Entry = collections.namedtuple('Entry', 'status mimetype body etag modified')
+
+
+class MemoryBackend(object):
+    """Least recently used responses of the process"""
+
+    def __init__(self, size=SIZE, ttl=TTL, clock=time.monotonic):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.clear()
+
+    def get(self, key):
+        """Entry of key, None if it is missing or expired"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] <= self.clock():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return item[1]
+
+    def set(self, key, entry, tags):
+        """Keep entry for key, evicting the least recently used ones"""
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (self.clock() + self.ttl, entry, tags)
+            for tag in tags:
+                self._tagged[tag].add(key)
+            while len(self._entries) > self.size:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, tags):
+        """Drop the entries tagged with one of tags, return their number"""
+        with self._lock:
+            keys = set()
+            for tag in tags:
+                keys.update(self._tagged.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        """Drop all the entries"""
+        with self._lock:
+            self._entries = collections.OrderedDict()
+            self._tagged = collections.defaultdict(set)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        """Drop an entry and its tags, the lock held"""
+        item = self._entries.pop(key, None)
+        if item is None:
+            return
+        for tag in item[2]:
+            keys = self._tagged[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tagged[tag]
+
+
+class SqliteBackend(object):
+    """Responses shared by the processes of the host in a SQLite file
+
+    Each thread of each process opens its own connection.
+    """
+
+    def __init__(self, path, size=SIZE, ttl=TTL, clock=time.time):
+        self.path = path
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY, status INTEGER, mimetype TEXT,
+                    body BLOB, etag TEXT, modified REAL, expires REAL,
+                    used REAL
+                );
+                CREATE TABLE IF NOT EXISTS tags (tag TEXT, key TEXT);
+                CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+                CREATE INDEX IF NOT EXISTS tags_key ON tags (key);
+            ''')
+
+    def _connection(self):
+        """Connection of the thread, a forked process opens its own"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        """Entry of key, None if it is missing or expired"""
+        key, now = json.dumps(key), self.clock()
+        with self._connection() as conn:
+            row = conn.execute(
+                'SELECT status, mimetype, body, etag, modified FROM responses '
+                'WHERE key = ? AND expires > ?', (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE responses SET used = ? WHERE key = ?',
+                         (now, key))
+        return Entry(row[0], row[1], bytes(row[2]), row[3], row[4])
+
+    def set(self, key, entry, tags):
+        """Keep entry for key, evicting the least recently used ones"""
+        key, now = json.dumps(key), self.clock()
+        with self._connection() as conn:
+            self._delete(conn, [key])
+            conn.execute(
+                'INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, entry.status, entry.mimetype, entry.body, entry.etag,
+                 entry.modified, now + self.ttl, now)
+            )
+            conn.executemany('INSERT INTO tags VALUES (?, ?)',
+                             [(json.dumps(tag), key) for tag in tags])
+            conn.execute('DELETE FROM responses WHERE expires <= ?', (now,))
+            self._delete(conn, [row[0] for row in conn.execute(
+                'SELECT key FROM responses ORDER BY used DESC '
+                'LIMIT -1 OFFSET ?', (self.size,)
+            )])
+            conn.execute('DELETE FROM tags WHERE key NOT IN '
+                         '(SELECT key FROM responses)')
+
+    def invalidate(self, tags):
+        """Drop the entries tagged with one of tags, return their number"""
+        tags = [json.dumps(tag) for tag in tags]
+        with self._connection() as conn:
+            keys = set()
+            for tag in tags:
+                keys.update(row[0] for row in conn.execute(
+                    'SELECT key FROM tags WHERE tag = ?', (tag,)
+                ))
+            self._delete(conn, keys)
+        return len(keys)
+
+    def clear(self):
+        """Drop all the entries"""
+        with self._connection() as conn:
+            conn.execute('DELETE FROM responses')
+            conn.execute('DELETE FROM tags')
+
+    def __len__(self):
+        with self._connection() as conn:
+            return conn.execute('SELECT count(*) FROM responses').fetchone()[0]
+
+    @staticmethod
+    def _delete(conn, keys):
+        """Drop entries and their tags"""
+        keys = [(key,) for key in keys]
+        conn.executemany('DELETE FROM responses WHERE key = ?', keys)
+        conn.executemany('DELETE FROM tags WHERE key = ?', keys)
+
+
+def backend(name=BACKEND):
+    """Backend configured by name, None when the cache is disabled"""
+    if name == 'none' or not SIZE:
+        return None
+    if name == 'memory':
+        return MemoryBackend()
+    if name.startswith('sqlite:'):
+        return SqliteBackend(name[len('sqlite:'):])
+    raise ValueError('Unknown response cache backend: %s' % name)
+
+
+def not_modified(version, kwargs):
+    """304 if the JSON request has the version(**kwargs) of the row
+
+    None otherwise, or without version.
+    """
+    request = flask.request
+    if (version is None or getattr(request, 'tpl', None) is not None or
+            'If-None-Match' not in request.headers):
+        return None
+
+    etag = str(version(**kwargs))
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = flask.current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+
+class ResponseCache(object):
+    """Encoded responses, dropped with the rows they were built from"""
+    name = 'responses'
+    stats_keys = ('hits', 'misses', 'invalidations')
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        # incremented by each invalidation, see cached()
+        self._generation = 0
+        self._stats = collections.Counter({key: 0 for key in self.stats_keys})
+
+    def _count(self, event, value=1):
+        """Increment a counter"""
+        with self._lock:
+            self._stats[event] += value
+
+    def cached(self, tags, version=None):
+        """Decorator serving a view from the cache
+
+        tags(data, **kwargs) gives the tags of the data returned by the view
+        called with kwargs. version(**kwargs), if given, is the version of
+        the row of a versioned view (see utils.helpers.versioned): a JSON
+        request naming it in If-None-Match gets a 304 without loading the
+        row, even if its response is not cached.
+        """
+        def decorator(func):
+            """Take the view to decorate and return a wrapper"""
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                """Answer with the cached bytes, or keep the response
+
+                The cached responses carry their validators, a conditional
+                request is answered without loading the rows. A response is
+                not kept if an invalidation happened while it was built: its
+                rows may be older than the invalidation.
+                """
+                if self.store is None:
+                    return (not_modified(version, kwargs) or
+                            func(*args, **kwargs))
+
+                key = (flask.request.endpoint,
+                       tuple(sorted(flask.request.view_args.items())),
+                       getattr(flask.request, 'tpl', None))
+                entry = self.store.get(key)
+                if entry is not None:
+                    self._count('hits')
+                    response = flask.current_app.response_class(
+                        entry.body, status=entry.status,
+                        mimetype=entry.mimetype
+                    )
+                    response.set_etag(entry.etag)
+                    response.last_modified = entry.modified
+                    return response
+
+                self._count('misses')
+                response = not_modified(version, kwargs)
+                if response is not None:
+                    return response
+
+                generation = self._generation
+                data = func(*args, **kwargs)
+                response = flask.current_app.make_response(data)
+                if response.status_code == 200:
+                    modified = int(time.time())
+                    response.add_etag()
+                    response.last_modified = modified
+                    entry = Entry(
+                        response.status_code, response.mimetype,
+                        response.get_data(), response.get_etag()[0], modified
+                    )
+                    entry_tags = tuple(
+                        tags(utils.helpers.unpack(data)[0], **kwargs)
+                    )
+                    # an invalidation after the check drops the entry
+                    with self._lock:
+                        if generation == self._generation:
+                            self.store.set(key, entry, entry_tags)
+                return response
+
+            return wrapper
+
+        return decorator
+
+    def invalidate(self, cache, keys):
+        """Drop the responses built from the keys of cache, all if None
+
+        utils.cache listener, run on every invalidation of the caches.
+        """
+        if self.store is None:
+            return
+        with self._lock:
+            self._generation += 1
+        if keys is None:
+            with self._lock:
+                self._stats['invalidations'] += len(self.store)
+            self.store.clear()
+            return
+        self._count('invalidations', self.store.invalidate(
+            [(cache.name, key) for key in keys]
+        ))
+
+    def reset(self):
+        """Forget the responses and the counters"""
+        if self.store is not None:
+            self.store.clear()
+        with self._lock:
+            self._stats = collections.Counter(
+                {key: 0 for key in self.stats_keys}
+            )
+
+    def stats(self):
+        """Return the counters and the current state of the cache"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update(backend=BACKEND if self.store is not None else 'none',
+                     entries=len(self.store) if self.store is not None else 0)
+        return stats
+
+
+responses = ResponseCache(backend())
+
+if responses.invalidate not in utils.cache.listeners:
+    utils.cache.listeners.append(responses.invalidate)
+
+
+def cached(tags, version=None):
+    """Decorator serving a view from the response cache of the process"""
+    return responses.cached(tags, version)
@@ -6,10 +6,20 @@ import marshmallow.exceptions
 import marshmallow.validate
 
 import db.models
+import utils.timing
 
 
 # pylint: disable=too-few-public-methods
-class DefaultSchema(marshmallow.Schema):
+class Schema(marshmallow.Schema):
+    """Base schema, the time spent dumping is measured for the request"""
+
+    def dump(self, *args, **kwargs):
+        with utils.timing.measure('dump'):
+            return super(Schema, self).dump(*args, **kwargs)
+
+
+# pylint: disable=too-few-public-methods
+class DefaultSchema(Schema):
     """Default configuration for a Schema
 
     Has an id field required and a skip missing option
@@ -22,7 +32,7 @@ class DefaultSchema(marshmallow.Schema):
         skip_missing = True
 
 # pylint: disable=too-few-public-methods
-class PostSchema(marshmallow.Schema):
+class PostSchema(Schema):
     """Default configuration for post arguments
 
     Exclude the id field, and require all the other fields
@@ -36,7 +46,7 @@ class PostSchema(marshmallow.Schema):
 
     class Meta(object):
         """Options for the PostSchema"""
-        exclude = ('id',)
+        exclude = ('id', 'version')
 
 
 def validate_nested(field, needed_field, _, data):
@@ -51,7 +61,7 @@ def validate_nested(field, needed_field, _, data):
 
 
 # pylint: disable=too-few-public-methods
-class NestedSchema(marshmallow.Schema):
+class NestedSchema(Schema):
     """Default configuration for a nested schema
 
     If an object is nested the method can either be a post or a put, that is
@@ -73,12 +83,16 @@ class NestedSchema(marshmallow.Schema):
 
 # pylint: disable=too-few-public-methods
 class UtensilSchema(DefaultSchema):
-    """Utensil schema (for put method, ie: the 'id' field is required)"""
+    """Utensil schema (for put method, ie: the 'id' field is required)
+
+    A version given is the one the utensil must have to be updated
+    """
     name = marshmallow.fields.String()
+    version = marshmallow.fields.Integer()
 
 
 # pylint: disable=too-few-public-methods
-class UtensilListSchema(marshmallow.Schema):
+class UtensilListSchema(Schema):
     """UtensilList schema, this is for a bulk update.
 
     We need a list of utensils with the arguments of the put method
@@ -96,12 +110,16 @@ class UtensilPostSchema(PostSchema, UtensilSchema):
 
 # pylint: disable=too-few-public-methods
 class IngredientSchema(DefaultSchema):
-    """Ingredient schema (for put method, ie: the 'id' field is required)"""
+    """Ingredient schema (for put method, ie: the 'id' field is required)
+
+    A version given is the one the ingredient must have to be updated
+    """
     name = marshmallow.fields.String()
+    version = marshmallow.fields.Integer()
 
 
 # pylint: disable=too-few-public-methods
-class IngredientListSchema(marshmallow.Schema):
+class IngredientListSchema(Schema):
     """UtensilList schema, this is for a bulk update.
 
     We need a list of utensils with the arguments of the put method
@@ -156,34 +174,17 @@ class RecipeUtensilsSchema(NestedSchema, DefaultSchema):
         return super(RecipeUtensilsSchema, self).dump(obj, *args, **kwargs)
 
 
-def validate_unique(model, field, elts):
-    """Validate if an entry is unique
+def validate_unique(field, elts):
+    """Validate that each element is given once
 
-    Checks against the db if all the elements with ids exist and if all the
-    elements are unique (no redundancy)
+    The ids and the names are checked within the request, without the
+    database: the existence of the ids and an element given both by id and by
+    name are checked by api.recipes, once the elements are looked up.
     """
-    insert_elts = [elt for elt in elts if elt.get('id') is None]
-    update_elts = [elt['id'] for elt in elts if elt.get('id') is not None]
-
-    # check if all the elements are unique by name
-
-    # avoid running the request if no elements
-    if update_elts:
-        update_elts_count = len(update_elts)
+    ids = [elt['id'] for elt in elts if elt.get('id') is not None]
+    names = [elt['name'] for elt in elts if elt.get('id') is None]
 
-        update_elts = list(model
-                           .select(model.name)
-                           .where(model.id << update_elts)
-                           .dicts())
-        if update_elts_count != len(update_elts):
-            raise marshmallow.ValidationError(
-                'There is some entries to update which does not exist.'
-            )
-
-
-    elts_tmp = {elt['name'] for elt in update_elts + insert_elts}
-
-    if len(elts_tmp) != len(elts):
+    if len(set(ids)) != len(ids) or len(set(names)) != len(names):
         raise marshmallow.ValidationError(
             'There is multiple entries for the same entity.', field
         )
@@ -191,7 +192,10 @@ def validate_unique(model, field, elts):
 
 # pylint: disable=too-few-public-methods
 class RecipeSchema(DefaultSchema):
-    """Recipe schema (for put method, ie: the 'id' field is required)"""
+    """Recipe schema (for put method, ie: the 'id' field is required)
+
+    A version given is the one the recipe must have to be updated
+    """
 
     name = marshmallow.fields.String()
     people = marshmallow.fields.Integer(
@@ -210,36 +214,29 @@ class RecipeSchema(DefaultSchema):
     ])
     ingredients = marshmallow.fields.List(
         marshmallow.fields.Nested(RecipeIngredientsSchema),
-        validate=functools.partial(
-            validate_unique, db.models.Ingredient, 'ingredients'
-        )
+        validate=functools.partial(validate_unique, 'ingredients')
     )
     utensils = marshmallow.fields.List(
         marshmallow.fields.Nested(RecipeUtensilsSchema),
-        validate=functools.partial(
-            validate_unique, db.models.Utensil, 'utensils'
-        )
+        validate=functools.partial(validate_unique, 'utensils')
     )
+    version = marshmallow.fields.Integer()
 
 
 def validate_recipes(recipes):
-    """Checks if all the recipes in the request exist in the db"""
-    ids = [recipe['id'] for recipe in recipes]
-    db_recipes_count = (
-        db.models.Recipe
-        .select()
-        .where(db.models.Recipe.id << ids)
-        .count()
-    )
+    """Checks if each recipe is given once
 
-    if len(recipes) != db_recipes_count:
+    Their existence is checked by api.recipes while updating them.
+    """
+    ids = [recipe.get('id') for recipe in recipes]
+    if len(set(ids)) != len(ids):
         raise marshmallow.ValidationError(
-            'One recipe or more do not match the database entries'
+            'There is multiple entries for the same entity.'
         )
 
 
 # pylint: disable=too-few-public-methods
-class RecipeListSchema(marshmallow.Schema):
+class RecipeListSchema(Schema):
     """RecipeList schema, this is for a bulk update.
 
     We need a list of recipes with the arguments of the put method
@@ -256,17 +253,17 @@ class RecipePostSchema(PostSchema, RecipeSchema):
     pass
 
 utensil_schema = UtensilSchema()
-utensil_schema_put = UtensilSchema(exclude=('id',))
+utensil_schema_put = UtensilSchema(exclude=('id', 'version'))
 utensil_schema_post = UtensilPostSchema()
 utensil_schema_list = UtensilListSchema()
 
 ingredient_schema = IngredientSchema()
-ingredient_schema_put = IngredientSchema(exclude=('id',))
+ingredient_schema_put = IngredientSchema(exclude=('id', 'version'))
 ingredient_schema_post = IngredientPostSchema()
 ingredient_schema_list = IngredientListSchema()
 
 recipe_schema = RecipeSchema()
-recipe_schema_put = RecipeSchema(exclude=('id',))
+recipe_schema_put = RecipeSchema(exclude=('id', 'version'))
 recipe_schema_post = RecipePostSchema()
 recipe_schema_list = RecipeListSchema()
 
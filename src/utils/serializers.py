@@ -0,0 +1,161 @@
+"""Compiled serializers for the read endpoints
+
+marshmallow 1.x dumps every field of every object through several layers of
+calls (accessor, key split, error store, ...). A Serializer reads the field
+list of a schema once and builds a converter per field, then dumps an object
+with a single loop. The output is the dump of the schema: same keys, values,
+defaults and skipped values. An invalid value is dumped as None, as
+marshmallow does when it records an error, the errors are not returned.
+
+The custom dump methods of the nested schemas are replaced by PREPARE
+functions, building the object the fields are read from.
+"""
+import marshmallow.fields as fields
+import marshmallow.utils
+
+import db.models
+import utils.schemas as schemas
+import utils.timing
+
+
+def _integer(value):
+    """Integer field"""
+    try:
+        return int(value)
+    except TypeError as error:
+        raise ValueError(error)
+
+def _text(value):
+    """String field"""
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    return str(value)
+
+def _select(choices):
+    """Select field"""
+    def select(value):
+        """Only the choices are valid"""
+        if value not in choices:
+            raise ValueError('%r is not a valid choice' % (value,))
+        return value
+    return select
+
+def _list(element):
+    """List field, the elements converted by element"""
+    def convert(value):
+        """A single value is dumped as a list of one element"""
+        if (marshmallow.utils.is_indexable_but_not_string(value) and
+                not isinstance(value, dict)):
+            return [element(item) for item in value]
+        return [element(value)]
+    return convert
+
+
+def compile_field(field):
+    """Function dumping a value as field does, ValueError if it is invalid"""
+    if isinstance(field, fields.Nested):
+        if field.many or field.only or field.exclude:
+            raise TypeError('Nested fields are compiled without options')
+        return Serializer(field.schema).serialize
+
+    # pylint: disable=unidiomatic-typecheck
+    if isinstance(field, fields.List):
+        convert = _list(compile_field(field.container))
+    elif isinstance(field, fields.Integer) and not field.as_string:
+        convert = _integer
+    elif isinstance(field, fields.Select):
+        convert = _select(field.choices)
+    elif type(field) is fields.String:
+        convert = _text
+    elif type(field) in (fields.Field, fields.Raw):
+        convert = lambda value: value
+    else:
+        raise TypeError('%s fields can not be compiled' %
+                        type(field).__name__)
+
+    default = field.default
+    def dump(value):
+        """The missing values get the default of the field"""
+        if value is None:
+            return default() if callable(default) else default
+        return convert(value)
+    return dump
+
+
+class Serializer(object):
+    """Dump function of a schema, compiled from its fields"""
+
+    def __init__(self, schema):
+        schema_class = type(schema)
+        self.prepare = PREPARE.get(schema_class)
+        custom_dump = schema_class.dump is not schemas.Schema.dump
+        if self.prepare is None and custom_dump:
+            raise TypeError('%s.dump has to be replaced by a PREPARE function'
+                            % schema_class.__name__)
+
+        skippable = lambda field: (
+            field.SKIPPABLE_VALUES if schema.skip_missing else ()
+        )
+        self.fields = [
+            (key, field.attribute or key, compile_field(field),
+             skippable(field))
+            for key, field in schema.fields.items()
+        ]
+        self.attributes = [attribute for _, attribute, _, _ in self.fields]
+
+    def serialize(self, obj):
+        """Dump obj, a dict or an object"""
+        if self.prepare is not None:
+            obj = self.prepare(obj, self.attributes)
+
+        if isinstance(obj, dict):
+            get = obj.get
+        else:
+            get = lambda attribute: getattr(obj, attribute, None)
+
+        data = {}
+        for key, attribute, dump, skippable in self.fields:
+            try:
+                value = dump(get(attribute))
+            except ValueError:
+                value = None
+            if value not in skippable:
+                data[key] = value
+        return data
+
+    def dump(self, obj):
+        """Dump obj, the time spent is measured for the request"""
+        with utils.timing.measure('dump'):
+            return self.serialize(obj)
+
+
+def merge_ingredient(obj, attributes):
+    """RecipeIngredientsSchema.dump: the fields of the ingredient are merged
+
+    The fields dumped by IngredientSchema override the ones of the link,
+    the link is left untouched.
+    """
+    if isinstance(obj, dict):
+        merged, ingredient = dict(obj), obj['ingredient']
+    else:
+        merged = {attribute: getattr(obj, attribute, None)
+                  for attribute in attributes}
+        ingredient = obj.ingredient
+    merged.update(ingredient_serializer.serialize(ingredient))
+    return merged
+
+def link_utensil(obj, _):
+    """RecipeUtensilsSchema.dump: a link is dumped as its utensil"""
+    if isinstance(obj, db.models.RecipeUtensils):
+        return obj.utensil
+    return obj
+
+PREPARE = {
+    schemas.RecipeIngredientsSchema: merge_ingredient,
+    schemas.RecipeUtensilsSchema: link_utensil,
+}
+
+utensil_serializer = Serializer(schemas.utensil_schema)
+ingredient_serializer = Serializer(schemas.ingredient_schema)
+recipe_serializer = Serializer(schemas.recipe_schema)
+recipe_list_serializer = Serializer(schemas.recipe_schema_list)
@@ -0,0 +1,108 @@
+"""Slow query log
+
+The queries slower than SLOW_QUERY_THRESHOLD milliseconds are logged as a
+JSON line on the rulzurapi.slow_queries logger with their SQL, their redacted
+parameters, their duration and the endpoint which sent them. The last
+SLOW_QUERY_BUFFER ones are kept in memory for /admin/slow_queries/.
+
+With SLOW_QUERY_EXPLAIN=1 the plan of the slow SELECT queries is captured with
+EXPLAIN (ANALYZE, BUFFERS), which runs the query a second time: keep it for
+the investigations. Only the reads of tables are analyzed, the selects
+calling a function with side effects (pg_notify, pg_advisory_xact_lock,
+setval, ...) or reading no table get the plan of EXPLAIN, without running
+them. The other statements and the failed queries are never explained.
+"""
+import collections
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import flask
+import peewee
+
+import db.connector
+
+logger = logging.getLogger('rulzurapi.slow_queries')
+
+THRESHOLD = float(os.environ.get('SLOW_QUERY_THRESHOLD', 200)) / 1000
+EXPLAIN = int(os.environ.get('SLOW_QUERY_EXPLAIN', 0)) != 0
+
+# Last slow queries of the process, the oldest ones are dropped
+recent = collections.deque(maxlen=int(os.environ.get('SLOW_QUERY_BUFFER',
+                                                     100)))
+
+# Functions with side effects, ANALYZE would call them a second time
+SIDE_EFFECTS = re.compile(r'\b(?:pg_\w+|setval|nextval|lo_\w+)\s*\(',
+                          re.IGNORECASE)
+FROM = re.compile(r'\bFROM\b', re.IGNORECASE)
+
+# Set while explaining a query, the EXPLAIN itself is not recorded
+_local = threading.local()
+
+
+def redact(params):
+    """Hide the values of the parameters, only keep their types
+
+    The numbers, booleans and NULL are kept, they are ids or flags and often
+    explain the plan.
+    """
+    if isinstance(params, (list, tuple)):
+        return [redact(param) for param in params]
+    if params is None or isinstance(params, (bool, int, float)):
+        return params
+    return '<%s>' % type(params).__name__
+
+
+def explain(sql, params):
+    """Plan of a SELECT query, None for the other statements or on error
+
+    Only the plain reads of tables are analyzed (run again). The EXPLAIN runs
+    in a savepoint, its failure does not abort the transaction of the
+    request.
+    """
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    if FROM.search(sql) and not SIDE_EFFECTS.search(sql):
+        command = 'EXPLAIN (ANALYZE, BUFFERS) '
+    else:
+        command = 'EXPLAIN '
+
+    _local.explaining = True
+    try:
+        with db.connector.database.atomic():
+            cursor = db.connector.database.execute_sql(command + sql, params)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+    except peewee.DatabaseError:
+        logger.exception('Cannot explain the slow query')
+        return None
+    finally:
+        _local.explaining = False
+
+
+def record_query(sql, params, duration, error=None):
+    """Query hook of the database, record the queries above the threshold
+
+    The failed queries are recorded without their plan.
+    """
+    if duration < THRESHOLD or getattr(_local, 'explaining', False):
+        return
+
+    endpoint = None
+    if flask.has_request_context():
+        endpoint = flask.request.endpoint
+
+    entry = {
+        'time': time.time(),
+        'duration_ms': round(duration * 1000, 2),
+        'endpoint': endpoint,
+        'sql': sql,
+        'params': redact(params),
+    }
+    if EXPLAIN:
+        entry['plan'] = explain(sql, params) if error is None else None
+
+    recent.append(entry)
+    logger.warning(json.dumps(entry, sort_keys=True))
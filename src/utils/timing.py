@@ -0,0 +1,94 @@
+"""Per request instrumentation
+
+Measure where the time of a request goes: the database (time and number of
+queries), the serialisation (marshmallow dumps) and the rendering (template
+or JSON). The measures are sent back in a Server-Timing header and logged as
+a JSON line on the rulzurapi.requests logger.
+"""
+import contextlib
+import json
+import logging
+import time
+
+import flask
+
+logger = logging.getLogger('rulzurapi.requests')
+
+# Server-Timing metrics, in the order of the header
+METRICS = ('db', 'dump', 'render')
+
+
+def start():
+    """Open the measures of the request, to be run before the request"""
+    flask.g.timing = {metric: 0.0 for metric in METRICS}
+    flask.g.timing['queries'] = 0
+    flask.g.timing_active = set()
+    flask.g.timing_start = time.perf_counter()
+
+
+def _timing():
+    """Measures of the current request, None outside of a request"""
+    if not flask.has_request_context():
+        return None
+    return getattr(flask.g, 'timing', None)
+
+
+def record_query(_, __, duration, _error=None):
+    """Query hook of the database, count the query and its duration"""
+    timing = _timing()
+    if timing is not None:
+        timing['db'] += duration
+        timing['queries'] += 1
+
+
+@contextlib.contextmanager
+def measure(metric):
+    """Add the time spent in the block to a metric of the request
+
+    The nested measures of the same metric are ignored (a schema dumping
+    nested schemas is only counted once).
+    """
+    timing = _timing()
+    if timing is None or metric in flask.g.timing_active:
+        yield
+        return
+
+    flask.g.timing_active.add(metric)
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing[metric] += time.perf_counter() - begin
+        flask.g.timing_active.discard(metric)
+
+
+def server_timing(timing, total):
+    """Format the measures as a Server-Timing header value"""
+    metrics = ['%s;dur=%.2f' % (metric, timing[metric] * 1000)
+               for metric in METRICS]
+    metrics[0] += ';desc="%d queries"' % timing['queries']
+    metrics.append('total;dur=%.2f' % (total * 1000))
+    return ', '.join(metrics)
+
+
+def finish(response):
+    """Report the measures of the request, to be run after the request"""
+    timing = _timing()
+    if timing is None:
+        return response
+
+    total = time.perf_counter() - flask.g.timing_start
+    response.headers['Server-Timing'] = server_timing(timing, total)
+
+    logger.info(json.dumps({
+        'method': flask.request.method,
+        'path': flask.request.path,
+        'endpoint': flask.request.endpoint,
+        'status': response.status_code,
+        'total_ms': round(total * 1000, 2),
+        'db_ms': round(timing['db'] * 1000, 2),
+        'queries': timing['queries'],
+        'dump_ms': round(timing['dump'] * 1000, 2),
+        'render_ms': round(timing['render'] * 1000, 2),
+    }, sort_keys=True))
+    return response
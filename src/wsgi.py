@@ -0,0 +1,28 @@
+"""WSGI entry point of the application
+
+Served by gunicorn with misc/gunicorn_conf.py (see the README), src/app.py
+keeps running the development server.
+
+The application is imported once by the gunicorn master, the workers are
+forked from it and open their own database connections (see post_fork and
+post_worker_init in the gunicorn configuration). No connection must be opened
+at import time.
+"""
+import logging
+import os
+
+import api
+import db.connector
+
+db.connector.database.init(**db.connector.config)
+
+# request log lines (utils.timing) and pool messages
+logging.getLogger('rulzurapi').setLevel(logging.INFO)
+logging.getLogger('rulzurapi').addHandler(logging.StreamHandler())
+
+if int(os.environ.get('DEBUG', 0)) != 0:
+    logger = logging.getLogger('peewee')
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler())
+
+app = api.app
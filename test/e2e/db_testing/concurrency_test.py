@@ -0,0 +1,85 @@
+"""Integration tests for the concurrent writes
+
+Each request keeps its transaction opened on a barrier until all of them
+reached it, if the writes were serialised by a lock the barrier would break.
+The updates of a row already written are refused with a 412, without lock.
+"""
+import json
+import threading
+
+import api
+import db.models
+import utils.schemas
+
+WRITERS = 4
+
+
+def recipe(index):
+    """Recipe with its own ingredient and utensil"""
+    return {
+        'name': 'test_recipe_%d' % index,
+        'directions': {},
+        'difficulty': 1,
+        'people': 2,
+        'duration': '0/5',
+        'category': 'starter',
+        'utensils': [{'name': 'test_utensil_%d' % index}],
+        'ingredients': [{
+            'name': 'test_ingredient_%d' % index,
+            'measurement': 'g',
+            'quantity': 1
+        }]
+    }
+
+
+def test_parallel_recipes_post(monkeypatch):
+    """Recipes with disjoint ingredients are written in parallel"""
+    barrier = threading.Barrier(WRITERS, timeout=10)
+    dump = utils.schemas.recipe_schema.dump
+
+    def wait_and_dump(*args, **kwargs):
+        """Wait for the other writers, the transaction is still opened"""
+        barrier.wait()
+        return dump(*args, **kwargs)
+
+    monkeypatch.setattr(utils.schemas.recipe_schema, 'dump', wait_and_dump)
+
+    status_codes = []
+    def post(index):
+        """Post a recipe from its own thread and connection"""
+        client = api.app.test_client()
+        rv = client.post('/recipes/', data=json.dumps(recipe(index)),
+                         content_type='application/json')
+        status_codes.append(rv.status_code)
+
+    threads = [threading.Thread(target=post, args=(index,))
+               for index in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not barrier.broken
+    assert status_codes == [201] * WRITERS
+    assert db.models.Recipe.select().count() == WRITERS
+    assert db.models.Ingredient.select().count() == WRITERS
+
+
+def test_put_if_match():
+    """The writer holding an old version gets a 412, nothing is written"""
+    client = api.app.test_client()
+    rv = client.post('/utensils/', data=json.dumps({'name': 'test_pan'}),
+                     content_type='application/json')
+    utensil_id = json.loads(rv.data.decode('utf-8'))['utensil']['id']
+    url, etag = '/utensils/%d/' % utensil_id, rv.headers['ETag']
+
+    status_codes = []
+    for name in ('test_pot', 'test_wok'):
+        rv = client.put(url, data=json.dumps({'name': name}),
+                        content_type='application/json',
+                        headers={'If-Match': etag})
+        status_codes.append(rv.status_code)
+
+    assert status_codes == [200, 412]
+    utensil = db.models.Utensil.get(db.models.Utensil.name == 'test_pot')
+    assert utensil.version == 2
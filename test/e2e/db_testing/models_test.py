@@ -77,3 +77,26 @@ def test_model():
 
     assert len(ingredients) == 0
 
+
+def test_upsert():
+    """Test the upsert returns both the created and the existing rows"""
+
+    existing = db.models.Ingredient.create(name='test_ingredient_1')
+
+    rows = db.models.Ingredient.insert_many(
+        [{'name': 'test_ingredient_1'}, {'name': 'test_ingredient_2'}],
+        conflict=[db.models.Ingredient.name],
+        update=[db.models.Ingredient.name]
+    ).execute()
+    rows = {row.name: row.id for row in rows}
+
+    assert len(rows) == 2
+    assert rows['test_ingredient_1'] == existing.id
+    assert db.models.Ingredient.select().count() == 2
+
+    rows = db.models.Ingredient.insert_many(
+        [{'name': 'test_ingredient_1'}, {'name': 'test_ingredient_3'}],
+        conflict=[db.models.Ingredient.name]
+    ).execute()
+
+    assert [row.name for row in rows] == ['test_ingredient_3']
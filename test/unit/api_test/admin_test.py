@@ -0,0 +1,125 @@
+"""API admin endpoint testing"""
+import collections
+import unittest.mock as mock
+
+import pytest
+
+import db.pool
+import test.utils as utils
+
+
+@pytest.fixture
+def admin_token(app):
+    """Configure an admin token for the application"""
+    app.application.config['ADMIN_TOKEN'] = 'secret'
+    return {'X-Admin-Token': 'secret'}
+
+
+def test_admin_forbidden(app):
+    """Test /admin/ without a configured token"""
+    app.application.config['ADMIN_TOKEN'] = None
+    page = app.get('/admin/pool/', headers={'X-Admin-Token': ''})
+
+    assert page.status_code == 403
+    assert utils.load(page) == {'message': 'Forbidden', 'status_code': 403}
+
+
+def test_admin_wrong_token(app, admin_token):
+    """Test /admin/ with a wrong token"""
+    admin_token['X-Admin-Token'] = 'wrong'
+    page = app.get('/admin/pool/', headers=admin_token)
+
+    assert page.status_code == 403
+
+
+def test_pool_get(app, monkeypatch, admin_token):
+    """Test /admin/pool/"""
+    stats = {str(mock.sentinel.stat): 1}
+    mock_stats = mock.Mock(return_value=stats)
+
+    monkeypatch.setattr('db.connector.database.stats', mock_stats)
+    page = app.get('/admin/pool/', headers=admin_token)
+
+    assert page.status_code == 200
+    assert utils.load(page) == {'pool': stats}
+    assert mock_stats.call_args_list == [mock.call()]
+
+
+def test_pool_exhausted(app, monkeypatch):
+    """Test the 503 raised when no connection is available"""
+    mock_connect = mock.Mock(side_effect=db.pool.PoolExhausted)
+
+    monkeypatch.setattr('db.connector.database.connect', mock_connect)
+    page = app.get('/')
+
+    assert page.status_code == 503
+    assert utils.load(page) == {'message': 'Service unavailable',
+                                'status_code': 503}
+
+
+def test_slow_queries_get(app, monkeypatch, admin_token):
+    """Test /admin/slow_queries/"""
+    recent = collections.deque([{'sql': 'SELECT 1'}, {'sql': 'SELECT 2'}])
+
+    monkeypatch.setattr('utils.slow_queries.recent', recent)
+    monkeypatch.setattr('utils.slow_queries.THRESHOLD', 0.2)
+    page = app.get('/admin/slow_queries/', headers=admin_token)
+
+    assert page.status_code == 200
+    assert utils.load(page) == {
+        'slow_queries': [{'sql': 'SELECT 2'}, {'sql': 'SELECT 1'}],
+        'threshold_ms': 200
+    }
+
+
+def test_profiles_get(app, monkeypatch, admin_token):
+    """Test /admin/profiles/"""
+    profiles = [{'id': '0' * 32, 'time': 1.0}]
+
+    monkeypatch.setattr('utils.profiling.profiles', lambda: profiles)
+    page = app.get('/admin/profiles/', headers=admin_token)
+
+    assert page.status_code == 200
+    assert utils.load(page) == {'profiles': profiles}
+
+
+def test_profile_get(app, monkeypatch, tmpdir, admin_token):
+    """Test /admin/profiles/<profile_id>/"""
+    monkeypatch.setattr('utils.profiling.PROFILE_DIR', str(tmpdir))
+    admin_token['X-Profile'] = admin_token['X-Admin-Token']
+    profile_id = app.get('/', headers=admin_token).headers['X-Profile-Id']
+    url = '/admin/profiles/%s/' % profile_id
+
+    page = app.get(url, headers=admin_token)
+    page_pstats = app.get(url + '?format=pstats', headers=admin_token)
+    page_sort = app.get(url + '?sort=unknown', headers=admin_token)
+
+    assert page.status_code == 200
+    assert page.mimetype == 'text/plain'
+    assert b'cumulative' in page.data
+    assert page_pstats.status_code == 200
+    assert page_pstats.data == tmpdir.join(profile_id + '.pstats').read('rb')
+    assert page_sort.status_code == 400
+
+
+def test_profile_not_found(app, monkeypatch, tmpdir, admin_token):
+    """Test /admin/profiles/<profile_id>/ with an unknown profile"""
+    monkeypatch.setattr('utils.profiling.PROFILE_DIR', str(tmpdir))
+    page = app.get('/admin/profiles/%s/' % ('0' * 32), headers=admin_token)
+    page_invalid = app.get('/admin/profiles/invalid/', headers=admin_token)
+
+    assert page.status_code == 404
+    assert utils.load(page) == {'message': 'Profile not found',
+                                'status_code': 404}
+    assert page_invalid.status_code == 404
+
+
+def test_cache_get(app, admin_token):
+    """Test /admin/cache/"""
+    page = app.get('/admin/cache/', headers=admin_token)
+
+    caches = utils.load(page)['caches']
+    assert page.status_code == 200
+    assert sorted(caches) == ['ingredients', 'recipes', 'responses',
+                              'utensils']
+    assert caches['utensils']['hits'] == 0
@@ -28,6 +28,28 @@ def test_get_ingredient(monkeypatch):
     assert mock_ingredient_get.call_args_list == [mock.call(get_clause)]
 
 
+def test_get_ingredient_cached(app, monkeypatch):
+    """The ingredients are read once, until they are updated"""
+    mock_ingredient_get = mock.Mock(
+        return_value=models.Ingredient(id=1, name='salt')
+    )
+    mock_update_many = mock.Mock()
+    mock_update_many.return_value.dicts.return_value.execute.return_value = [
+        {'id': 1, 'name': 'pepper'}
+    ]
+
+    monkeypatch.setattr('db.models.Ingredient.get', mock_ingredient_get)
+    monkeypatch.setattr('db.models.Ingredient.update_many', mock_update_many)
+    monkeypatch.setattr('api.recipes.touch_recipes', mock.Mock())
+    pages = [app.get('/ingredients/1/') for _ in range(2)]
+    pages.append(app.put('/ingredients/',
+                         data={'ingredients': [{'id': 1, 'name': 'pepper'}]}))
+    pages.append(app.get('/ingredients/1/'))
+
+    assert [page.status_code for page in pages] == [200, 200, 200, 200]
+    assert mock_ingredient_get.call_count == 2
+
+
 def test_get_ingredient_404(monkeypatch):
     """Test the get ingredient method with ingredient not found"""
     mock_ingredient_get = mock.Mock(side_effect=peewee.DoesNotExist)
@@ -41,35 +63,38 @@ def test_get_ingredient_404(monkeypatch):
 
 def test_update_ingredient(monkeypatch, ingredient):
     """Test the update ingredient method against API"""
-    ingredient['id'] = mock.sentinel.ingredient_id
-    where_exp = peewee.Expression(models.Ingredient.id, peewee.OP.EQ,
-                                  mock.sentinel.ingredient_id)
-
-    mock_ingredient_update = mock.Mock()
-    where = mock_ingredient_update.return_value.where
-    returning = where.return_value.returning
-    dicts = returning.return_value.dicts
-    dicts.return_value = mock.sentinel.ingredient
+    mock_update_ingredients = mock.Mock(
+        return_value=([mock.sentinel.ingredient], [])
+    )
 
-    monkeypatch.setattr('db.models.Ingredient.update', mock_ingredient_update)
-    returned_ingredient = api_ingredients.update_ingredient(ingredient)
+    monkeypatch.setattr(api_ingredients, 'update_ingredients',
+                        mock_update_ingredients)
+    returned_ingredient = api_ingredients.update_ingredient(ingredient, 3)
 
     assert returned_ingredient is mock.sentinel.ingredient
-    assert mock_ingredient_update.call_args_list == [mock.call(**ingredient)]
-    assert where.call_args_list == [mock.call(where_exp)]
-    assert returning.call_args_list == [mock.call()]
-    assert dicts.call_args_list == [mock.call()]
+    assert mock_update_ingredients.call_args_list == [
+        mock.call([{'id': 1, 'name': 'ingredient_1', 'version': 3}])
+    ]
 
 
-def test_update_ingredient_404(monkeypatch, ingredient):
-    """Test the update ingredient method with ingredient not found"""
-    mock_ingredient_update = mock.Mock(side_effect=peewee.DoesNotExist)
+@pytest.mark.parametrize('headers,args', [
+    ({}, ('Ingredient not found', 404, None)),
+    ({'If-Match': '*'}, ('Precondition failed', 412, None)),
+])
+def test_update_ingredient_404(app, monkeypatch, ingredient, headers, args):
+    """Test the update ingredient method with ingredient not found
 
-    monkeypatch.setattr('db.models.Ingredient.update', mock_ingredient_update)
-    with pytest.raises(helpers.APIException) as excinfo:
-        api_ingredients.update_ingredient(ingredient)
+    Under If-Match the missing ingredient is a 412.
+    """
+    mock_update_ingredients = mock.Mock(return_value=([], [1]))
 
-    assert excinfo.value.args == ('Ingredient not found', 404, None)
+    monkeypatch.setattr(api_ingredients, 'update_ingredients',
+                        mock_update_ingredients)
+    with app.application.test_request_context(headers=headers):
+        with pytest.raises(helpers.APIException) as excinfo:
+            api_ingredients.update_ingredient(ingredient)
+
+    assert excinfo.value.args == args
 
 
 def test_ingredients_list(app, monkeypatch, ingredients):
@@ -77,20 +102,46 @@ def test_ingredients_list(app, monkeypatch, ingredients):
 
     mock_ingredient_select = mock.Mock()
     dicts = mock_ingredient_select.return_value.dicts
-    dicts.return_value = ingredients['ingredients']
+    mock_paginate = mock.Mock(return_value=(ingredients['ingredients'], None))
 
     monkeypatch.setattr('db.models.Ingredient.select', mock_ingredient_select)
+    monkeypatch.setattr('utils.helpers.paginate', mock_paginate)
     ingredients_page = app.get('/ingredients/')
 
+    paginate_calls = [mock.call(dicts.return_value, models.Ingredient.id)]
+    ingredients['next'] = None
+
     assert ingredients_page.status_code == 200
     assert mock_ingredient_select.call_args_list == [mock.call()]
     assert dicts.call_args_list == [mock.call()]
+    assert mock_paginate.call_args_list == paginate_calls
     assert utils.load(ingredients_page) == ingredients
 
 
+def test_ingredients_list_stream(app, monkeypatch):
+    """Test /ingredients/ streamed as NDJSON"""
+    mock_ingredient_select = mock.Mock()
+    mock_stream = mock.Mock(return_value='streamed')
+
+    dicts = mock_ingredient_select.return_value.dicts
+    order_by = dicts.return_value.order_by
+
+    monkeypatch.setattr('db.models.Ingredient.select', mock_ingredient_select)
+    monkeypatch.setattr('utils.helpers.stream', mock_stream)
+    page = app.get('/ingredients/', headers={'Accept': helpers.NDJSON_MIMETYPE})
+
+    stream_calls = [mock.call(order_by.return_value, 'ingredients')]
+
+    assert page.status_code == 200
+    assert page.data == b'streamed'
+    assert order_by.call_args_list == [mock.call(models.Ingredient.id)]
+    assert mock_stream.call_args_list == stream_calls
+
+
 def test_ingredients_post(app, monkeypatch, ingredient, ingredient_no_id):
     """Test post /ingredients/"""
 
+    ingredient['version'] = 1
     mock_raise_or_return = mock.Mock(return_value=ingredient_no_id)
     mock_ingredient_create = mock.Mock(
         return_value=utils.FakeModel(ingredient)
@@ -105,6 +156,7 @@ def test_ingredients_post(app, monkeypatch, ingredient, ingredient_no_id):
     ingredients_create_page = app.post('/ingredients/', data=ingredient_no_id)
 
     assert ingredients_create_page.status_code == 201
+    assert ingredients_create_page.headers['ETag'] == '"1"'
     assert utils.load(ingredients_create_page) == {'ingredient': ingredient}
     assert mock_ingredient_create.call_args_list == ingredient_create_calls
     assert mock_raise_or_return.call_args_list == [mock.call(schema)]
@@ -124,65 +176,84 @@ def test_ingredients_post_409(app, monkeypatch, ingredient_no_id):
     assert utils.load(ingredients_create_page) == error_msg
 
 
+def test_update_ingredients(monkeypatch):
+    """Test api.ingredients.update_ingredients function"""
+    ingredients = [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}]
+
+    mock_update_many = mock.Mock()
+    dicts = mock_update_many.return_value.dicts
+    dicts.return_value.execute.return_value = iter([ingredients[1]])
+    mock_check_versions = mock.Mock()
+    mock_touch_recipes = mock.Mock()
+
+    monkeypatch.setattr('db.models.Ingredient.update_many', mock_update_many)
+    monkeypatch.setattr('utils.helpers.check_versions', mock_check_versions)
+    monkeypatch.setattr('api.recipes.touch_recipes', mock_touch_recipes)
+    rv = api_ingredients.update_ingredients(ingredients)
+
+    assert rv == ([ingredients[1]], [1])
+    assert mock_update_many.call_args_list == [mock.call(ingredients)]
+    assert dicts.call_args_list == [mock.call()]
+    assert mock_check_versions.call_args_list == [
+        mock.call(models.Ingredient, ingredients, [1])
+    ]
+    assert mock_touch_recipes.call_args_list == [mock.call(
+        models.RecipeIngredients, models.RecipeIngredients.ingredient, {2}
+    )]
+
+
+def test_update_ingredients_409(monkeypatch):
+    """Test api.ingredients.update_ingredients with a name conflict"""
+    mock_update_many = mock.Mock()
+    dicts = mock_update_many.return_value.dicts
+    dicts.return_value.execute.side_effect = peewee.IntegrityError
+
+    monkeypatch.setattr('db.models.Ingredient.update_many', mock_update_many)
+    with pytest.raises(helpers.APIException) as excinfo:
+        api_ingredients.update_ingredients([{'id': 1, 'name': 'a'}])
+
+    assert excinfo.value.args == ('Ingredient already exists', 409, None)
+
+
 def test_ingredients_put(app, monkeypatch, ingredients):
     """Test put /ingredients/"""
 
     mock_raise_or_return = mock.Mock(return_value=ingredients)
-    mock_update_ingredient = mock.Mock(
-        side_effect=iter(ingredients['ingredients'])
+    mock_update_ingredients = mock.Mock(
+        return_value=(ingredients['ingredients'], [42])
     )
 
     monkeypatch.setattr('utils.helpers.raise_or_return', mock_raise_or_return)
-    monkeypatch.setattr(api_ingredients, 'update_ingredient',
-                        mock_update_ingredient)
+    monkeypatch.setattr(api_ingredients, 'update_ingredients',
+                        mock_update_ingredients)
 
     schema = schemas.ingredient_schema_list
     ingredients_update_page = app.put('/ingredients/', data=ingredients)
 
-    update_calls = [
-        mock.call(ingredient) for ingredient in ingredients['ingredients']
-    ]
+    update_calls = [mock.call(ingredients['ingredients'])]
     assert ingredients_update_page.status_code == 200
-    assert utils.load(ingredients_update_page) == ingredients
-    assert mock_update_ingredient.call_args_list == update_calls
+    assert utils.load(ingredients_update_page) == {
+        'ingredients': ingredients['ingredients'],
+        'not_found': [42]
+    }
+    assert mock_update_ingredients.call_args_list == update_calls
     assert mock_raise_or_return.call_args_list == [mock.call(schema)]
 
 
-def test_ingredients_put_with_exception(app, monkeypatch, ingredients):
-    """Test put /ingredients/ with an exception raise"""
-    update_ingredient_returns = iter([
-        helpers.APIException('Error')
-        for _ in range(len(ingredients['ingredients']))
-    ])
-    mock_raise_or_return = mock.Mock(return_value=ingredients)
-    mock_update_ingredient = mock.Mock(side_effect=update_ingredient_returns)
-
-    monkeypatch.setattr('utils.helpers.raise_or_return', mock_raise_or_return)
-    monkeypatch.setattr(api_ingredients, 'update_ingredient',
-                        mock_update_ingredient)
-    ingredients_update_page = app.put('/ingredients/', data=ingredients)
-
-    update_calls = [
-        mock.call(ingredient) for ingredient in ingredients['ingredients']
-    ]
-    assert ingredients_update_page.status_code == 200
-    assert utils.load(ingredients_update_page) == {'ingredients': []}
-    assert mock_update_ingredient.call_args_list == update_calls
-
-
 def test_ingredient_get(app, monkeypatch, ingredient):
     """Test /ingredients/<id>"""
-    sentinel_ingredient = mock.sentinel.ingredient
+    sentinel_ingredient = mock.Mock(version=4)
     mock_get_ingredient = mock.Mock(return_value=sentinel_ingredient)
-    mock_ingredient_dump = mock.Mock(return_value=(ingredient, None))
+    mock_ingredient_dump = mock.Mock(return_value=ingredient)
 
     monkeypatch.setattr(api_ingredients, 'get_ingredient', mock_get_ingredient)
-    monkeypatch.setattr('utils.schemas.ingredient_schema.dump',
+    monkeypatch.setattr('utils.serializers.ingredient_serializer.dump',
                         mock_ingredient_dump)
 
     ingredient_page = app.get('/ingredients/1/')
     ingredient_dump_calls = [mock.call(sentinel_ingredient)]
     assert ingredient_page.status_code == 200
+    assert ingredient_page.headers['ETag'] == '"4"'
     assert utils.load(ingredient_page) == {'ingredient': ingredient}
     assert mock_get_ingredient.call_args_list == [mock.call(1)]
     assert mock_ingredient_dump.call_args_list == ingredient_dump_calls
@@ -193,8 +264,10 @@ def test_ingredient_put(app, monkeypatch, ingredient):
     ingredient_copy = copy.deepcopy(ingredient)
     ingredient_copy['id'] = 2
 
+    updated = dict(ingredient_copy, version=2)
+
     mock_raise_or_return = mock.Mock(return_value=ingredient)
-    mock_update_ingredient = mock.Mock(return_value=ingredient)
+    mock_update_ingredient = mock.Mock(return_value=updated)
 
     monkeypatch.setattr('utils.helpers.raise_or_return', mock_raise_or_return)
     monkeypatch.setattr(api_ingredients, 'update_ingredient',
@@ -202,14 +275,35 @@ def test_ingredient_put(app, monkeypatch, ingredient):
 
     schema = schemas.ingredient_schema_put
     ingredient_put_page = app.put('/ingredients/2/', data=ingredient)
-    update_ingredient_calls = [mock.call(ingredient_copy)]
+    update_ingredient_calls = [mock.call(ingredient_copy, None)]
 
     assert ingredient_put_page.status_code == 200
-    assert utils.load(ingredient_put_page) == {'ingredient': ingredient}
+    assert ingredient_put_page.headers['ETag'] == '"2"'
+    assert utils.load(ingredient_put_page) == {'ingredient': updated}
     assert mock_raise_or_return.call_args_list == [mock.call(schema)]
     assert mock_update_ingredient.call_args_list == update_ingredient_calls
 
 
+def test_ingredient_put_if_match(app, monkeypatch, ingredient):
+    """The version of If-Match is the one the ingredient must have"""
+    mock_raise_or_return = mock.Mock(return_value=ingredient)
+    mock_update_ingredient = mock.Mock(
+        side_effect=helpers.APIException('Precondition failed', 412)
+    )
+
+    monkeypatch.setattr('utils.helpers.raise_or_return', mock_raise_or_return)
+    monkeypatch.setattr(api_ingredients, 'update_ingredient',
+                        mock_update_ingredient)
+
+    ingredient_put_page = app.put('/ingredients/2/', data=ingredient,
+                                  headers={'If-Match': '"3"'})
+
+    assert ingredient_put_page.status_code == 412
+    assert mock_update_ingredient.call_args_list == [
+        mock.call(dict(ingredient, id=2), 3)
+    ]
+
+
 def test_ingredient_get_recipes(app, monkeypatch):
     """Test /ingredients/<id>/recipes"""
 
@@ -218,23 +312,27 @@ def test_ingredient_get_recipes(app, monkeypatch):
     mock_recipes = mock.MagicMock(wraps=recipes, spec=dict)
 
     mock_get_ingredient = mock.Mock()
+    mock_recipes_with = mock.Mock(return_value=mock.sentinel.where_clause)
     mock_select_recipes = mock.Mock(return_value=[mock.sentinel.recipe])
-    mock_recipe_dump = mock.Mock(return_value=(mock_recipes, None))
+    mock_recipe_dump = mock.Mock(return_value=mock_recipes)
 
     monkeypatch.setattr(api_ingredients, 'get_ingredient', mock_get_ingredient)
+    monkeypatch.setattr('api.recipes.recipes_with', mock_recipes_with)
     monkeypatch.setattr('api.recipes.select_recipes', mock_select_recipes)
-    monkeypatch.setattr('utils.schemas.recipe_schema_list.dump',
+    monkeypatch.setattr('utils.serializers.recipe_list_serializer.dump',
                         mock_recipe_dump)
 
     ingredient_recipes_page = app.get('/ingredients/1/recipes/')
-    select_recipes_calls = [mock.call(
-        peewee.Expression(models.RecipeIngredients.ingredient, peewee.OP.EQ, 1)
+    recipes_with_calls = [mock.call(
+        models.RecipeIngredients, models.RecipeIngredients.ingredient, 1
     )]
+    select_recipes_calls = [mock.call(mock.sentinel.where_clause)]
 
     assert ingredient_recipes_page.status_code == 200
     assert utils.load(ingredient_recipes_page) == recipes
 
     assert mock_get_ingredient.call_args_list == [mock.call(1)]
+    assert mock_recipes_with.call_args_list == recipes_with_calls
     assert mock_select_recipes.call_args_list == select_recipes_calls
     assert mock_recipe_dump.call_args_list == [mock.call({
         'recipes': [mock.sentinel.recipe]
@@ -0,0 +1,144 @@
+"""Query budgets of the endpoints
+
+The number of queries of an endpoint must not grow with the size of the
+catalogue or of the request (no N+1), each endpoint runs with a small and a
+large catalogue against the same budget.
+"""
+import pytest
+
+import db.connector
+import test.utils as utils
+
+SIZES = (1, 50)
+
+TABLES = ('recipe', 'ingredient', 'utensil', 'recipe_ingredients',
+          'recipe_utensils')
+
+
+def recipe(index):
+    """Recipe linking ingredients and utensils by id and by name"""
+    return {
+        'id': index,
+        'name': 'recipe_%d' % index,
+        'difficulty': 1,
+        'people': 2,
+        'duration': '0/5',
+        'category': 'starter',
+        'directions': {},
+        'utensils': [{'id': 1}, {'name': 'utensil_%d' % index}],
+        'ingredients': [
+            {'id': 1, 'measurement': 'L', 'quantity': 1},
+            {'name': 'ingredient_%d' % index, 'measurement': 'g',
+             'quantity': 2},
+        ]
+    }
+
+
+def recipes_post(_):
+    """POST /recipes/"""
+    data = recipe(1)
+    data.pop('id')
+    return 'post', '/recipes/', data
+
+
+def recipes_put(size):
+    """PUT /recipes/ with size recipes"""
+    return 'put', '/recipes/', {
+        'recipes': [recipe(index) for index in range(1, size + 1)]
+    }
+
+
+def recipe_put(_):
+    """PUT /recipes/<id>/"""
+    data = recipe(1)
+    data.pop('id')
+    return 'put', '/recipes/1/', data
+
+
+def elements_put(kind):
+    """PUT /<kind>s/ with size elements"""
+    return lambda size: ('put', '/%ss/' % kind, {
+        kind + 's': [{'id': index, 'name': '%s_%d' % (kind, index)}
+                     for index in range(1, size + 1)]
+    })
+
+
+# endpoint, request builder (the size of the catalogue as argument), budget
+BUDGETS = [
+    ('recipes.recipes_get', lambda _: ('get', '/recipes/', None), 1),
+    ('recipes.recipes_post', recipes_post, 9),
+    ('recipes.recipes_put', recipes_put, 12),
+    ('recipes.recipe_get', lambda _: ('get', '/recipes/1/', None), 3),
+    ('recipes.recipe_put', recipe_put, 12),
+    ('recipes.recipe_ingredients_get',
+     lambda _: ('get', '/recipes/1/ingredients/', None), 2),
+    ('recipes.recipe_utensils_get',
+     lambda _: ('get', '/recipes/1/utensils/', None), 2),
+    ('ingredients.ingredients_get',
+     lambda _: ('get', '/ingredients/', None), 1),
+    ('ingredients.ingredients_post',
+     lambda _: ('post', '/ingredients/', {'name': 'ingredient'}), 1),
+    ('ingredients.ingredients_put', elements_put('ingredient'), 2),
+    ('ingredients.ingredient_get',
+     lambda _: ('get', '/ingredients/1/', None), 1),
+    ('ingredients.ingredient_put',
+     lambda _: ('put', '/ingredients/1/', {'name': 'ingredient'}), 2),
+    ('ingredients.get', lambda _: ('get', '/ingredients/1/recipes/', None), 4),
+    ('utensils.utensils_get', lambda _: ('get', '/utensils/', None), 1),
+    ('utensils.utensils_post',
+     lambda _: ('post', '/utensils/', {'name': 'utensil'}), 1),
+    ('utensils.utensils_put', elements_put('utensil'), 2),
+    ('utensils.utensil_get', lambda _: ('get', '/utensils/1/', None), 1),
+    ('utensils.utensil_put',
+     lambda _: ('put', '/utensils/1/', {'name': 'utensil'}), 2),
+    ('utensils.recipe_get',
+     lambda _: ('get', '/utensils/1/recipes/', None), 4),
+]
+
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('endpoint,build,budget', BUDGETS,
+                         ids=[endpoint for endpoint, _, _ in BUDGETS])
+def test_query_budget(app, endpoint, build, budget, size):
+    """The endpoint stays within its query budget"""
+    method, url, data = build(size)
+    sizes = {table: size for table in TABLES}
+    urls = app.application.url_map.bind('localhost')
+
+    with utils.QueryCounter(db.connector.database, sizes) as queries:
+        page = getattr(app, method)(url, data=data)
+
+    assert urls.match(url, method.upper())[0] == endpoint
+    assert page.status_code < 400
+    assert len(queries) <= budget, '\n'.join(
+        sql for sql, _ in queries.statements
+    )
+
+
+@pytest.mark.parametrize('url', ['/recipes/1/', '/ingredients/1/',
+                                 '/utensils/1/'])
+def test_query_conditional(app, url):
+    """The conditional requests of the entities are answered without query"""
+    sizes = {table: 1 for table in TABLES}
+
+    with utils.QueryCounter(db.connector.database, sizes):
+        etag = app.get(url).headers['ETag']
+    with utils.QueryCounter(db.connector.database, sizes) as queries:
+        page = app.get(url, headers={'If-None-Match': etag})
+
+    assert page.status_code == 304
+    assert len(queries) == 0
+
+
+@pytest.mark.parametrize('url', ['/recipes/1/', '/ingredients/1/',
+                                 '/utensils/1/'])
+def test_query_version(app, url):
+    """The conditional requests are answered from the version of the row"""
+    sizes = {table: 1 for table in TABLES}
+
+    with utils.QueryCounter(db.connector.database, sizes) as queries:
+        page = app.get(url, headers={'If-None-Match': '"1"'})
+
+    assert page.status_code == 304
+    assert page.headers['ETag'] == '"1"'
+    assert len(queries) == 1
@@ -8,6 +8,7 @@ import pytest
 import api.recipes.endpoint as api_recipes
 import db.models as models
 import test.utils as utils
+import utils.cache as utils_cache
 import utils.helpers as helpers
 import utils.schemas as schemas
 
@@ -17,46 +18,62 @@ class TestUtilityFunctions(object):
 
     @staticmethod
     @pytest.fixture
-    def update_recipe_fixture_mocks(monkeypatch):
-        """fixture for update_recipe function"""
+    def update_recipes_fixture_mocks(monkeypatch):
+        """fixture for update_recipes function
+
+        All the recipes updated exist, their ids are returned.
+        """
+        def update_many(rows):
+            """UPDATE ... RETURNING the ids of the rows"""
+            query = mock.Mock()
+            query.returning.return_value.execute.return_value = [
+                models.Recipe(id=row['id']) for row in rows
+            ]
+            return query
+
         mocks = dict(
-            mock_recipe_update=mock.Mock(),
-            mock_ingrs_select=mock.Mock(),
-            mock_ingrs_delete=mock.Mock(),
-            mock_ingrs_insert=mock.Mock(),
+            mock_recipe_update_many=mock.Mock(side_effect=update_many),
             mock_ingrs_parsing=mock.Mock(),
-            mock_utensils_select=mock.Mock(),
-            mock_utensils_delete=mock.Mock(),
-            mock_utensils_insert=mock.Mock(),
-            mock_utensils_parsing=mock.Mock()
+            mock_utensils_parsing=mock.Mock(return_value=[]),
+            mock_sync_links=mock.Mock(return_value=1),
+            mock_select_recipes=mock.Mock(return_value=[])
         )
 
         mocks = type('Mocks', (object,), mocks)
 
-        # monkeypatch all the things o/
-        monkeypatch.setattr('db.models.Recipe.update',
-                            mocks.mock_recipe_update)
-        monkeypatch.setattr('db.models.RecipeIngredients.select',
-                            mocks.mock_ingrs_select)
-        monkeypatch.setattr('db.models.RecipeIngredients.delete',
-                            mocks.mock_ingrs_delete)
-        monkeypatch.setattr('db.models.RecipeIngredients.insert_many',
-                            mocks.mock_ingrs_insert)
+        monkeypatch.setattr('db.models.Recipe.update_many',
+                            mocks.mock_recipe_update_many)
         monkeypatch.setattr(api_recipes, 'ingredients_parsing',
                             mocks.mock_ingrs_parsing)
-
-        monkeypatch.setattr('db.models.Utensil.select',
-                            mocks.mock_utensils_select)
-        monkeypatch.setattr('db.models.RecipeUtensils.delete',
-                            mocks.mock_utensils_delete)
-        monkeypatch.setattr('db.models.RecipeUtensils.insert_many',
-                            mocks.mock_utensils_insert)
         monkeypatch.setattr(api_recipes, 'utensils_parsing',
                             mocks.mock_utensils_parsing)
+        monkeypatch.setattr(api_recipes, 'sync_links', mocks.mock_sync_links)
+        monkeypatch.setattr(api_recipes, 'select_recipes',
+                            mocks.mock_select_recipes)
 
         return mocks
 
 
+    @staticmethod
+    @pytest.fixture
+    def sync_links_mocks(monkeypatch):
+        """fixture for sync_links function"""
+        mocks = dict(
+            mock_select=mock.Mock(),
+            mock_insert_many=mock.Mock(),
+            mock_delete=mock.Mock()
+        )
+        mocks = type('Mocks', (object,), mocks)
+
+        monkeypatch.setattr('db.models.RecipeIngredients.select',
+                            mocks.mock_select)
+        monkeypatch.setattr('db.models.RecipeIngredients.insert_many',
+                            mocks.mock_insert_many)
+        monkeypatch.setattr('db.models.RecipeIngredients.delete',
+                            mocks.mock_delete)
+        return mocks
+
+
     def test_get_recipe(self, monkeypatch):
         """Test the get_recipe method"""
         mock_recipe_get = mock.Mock(return_value=mock.sentinel.recipe)
@@ -80,128 +97,210 @@ class TestUtilityFunctions(object):
         assert excinfo.value.args == ('Recipe not found', 404, None)
 
 
-    def test_select_recipes(self, monkeypatch):
+    @staticmethod
+    @pytest.fixture
+    def select_recipes_mocks(monkeypatch):
+        """Mock the three queries of select_recipes"""
+        mocks = dict(
+            mock_rcp_select=mock.Mock(),
+            mock_ingrs_select=mock.Mock(),
+            mock_utensils_select=mock.Mock()
+        )
+        mocks = type('Mocks', (object,), mocks)
+
+        monkeypatch.setattr('db.models.Recipe.select', mocks.mock_rcp_select)
+        monkeypatch.setattr('db.models.RecipeIngredients.select',
+                            mocks.mock_ingrs_select)
+        monkeypatch.setattr('db.models.RecipeUtensils.select',
+                            mocks.mock_utensils_select)
+        return mocks
+
+
+    def test_select_recipes(self, select_recipes_mocks):
         """Test the select_recipes method"""
-        mock_rcp_select = mock.Mock()
-        join_rcp_ingrs = mock_rcp_select.return_value.join
-        join_ingr = join_rcp_ingrs.return_value.join
-        switch = join_ingr.return_value.switch
-        join_rcp_utensils = switch.return_value.join
-        join_utensil = join_rcp_utensils.return_value.join
-        where = join_utensil.return_value.where
-        aggregate_rows = where.return_value.aggregate_rows
-        execute = aggregate_rows.return_value.execute
-        execute.return_value = mock.sentinel.rcps
-
-        monkeypatch.setattr('db.models.Recipe.select', mock_rcp_select)
-        rcps = api_recipes.select_recipes(mock.sentinel.where_clause)
-
-        select_calls = [mock.call(models.Recipe,
-                                  models.RecipeIngredients, models.Ingredient,
-                                  models.RecipeUtensils, models.Utensil)]
-        join_rcp_ingrs_calls = [mock.call(models.RecipeIngredients)]
-        join_rcp_utensils_calls = [mock.call(models.RecipeUtensils)]
-
-        assert rcps == mock.sentinel.rcps
-        assert mock_rcp_select.call_args_list == select_calls
-        assert join_rcp_ingrs.call_args_list == join_rcp_ingrs_calls
-        assert join_ingr.call_args_list == [mock.call(models.Ingredient)]
-        assert switch.call_args_list == [mock.call(models.Recipe)]
-        assert join_rcp_utensils.call_args_list == join_rcp_utensils_calls
-        assert join_utensil.call_args_list == [mock.call(models.Utensil)]
-        assert where.call_args_list == [mock.call(mock.sentinel.where_clause)]
-        assert aggregate_rows.call_args_list == [mock.call()]
-        assert execute.call_args_list == [mock.call()]
-
-
-    def test_lock_table(self, monkeypatch):
-        """Test the db lock_table feature"""
-        mock_model_entity = mock.Mock(return_value=mock.sentinel.me)
-        mock_execute_sql = mock.Mock()
+        mocks = select_recipes_mocks
+        rcps = [mock.Mock(id=1), mock.Mock(id=2)]
+        ingrs = [mock.Mock(_data={'recipe': recipe_id})
+                 for recipe_id in (1, 2, 1)]
+        utensils = [mock.Mock(_data={'recipe': 2})]
 
-        monkeypatch.setattr('utils.helpers.model_entity', mock_model_entity)
-        monkeypatch.setattr('db.connector.database.execute_sql',
-                            mock_execute_sql)
+        rcp_where = mocks.mock_rcp_select.return_value.where
+        rcp_order_by = rcp_where.return_value.order_by
+        rcp_order_by.return_value = rcps
 
-        api_recipes.lock_table(mock.sentinel.model)
-        sql_str = ('LOCK TABLE %s IN SHARE ROW EXCLUSIVE MODE' %
-                   str(mock.sentinel.me))
-        model_entity_calls = [mock.call(mock.sentinel.model)]
-        assert mock_model_entity.call_args_list == model_entity_calls
-        assert mock_execute_sql.call_args_list == [mock.call(sql_str)]
+        ingrs_join = mocks.mock_ingrs_select.return_value.join
+        ingrs_where = ingrs_join.return_value.where
+        ingrs_where.return_value = ingrs
 
+        utensils_join = mocks.mock_utensils_select.return_value.join
+        utensils_where = utensils_join.return_value.where
+        utensils_where.return_value = utensils
+
+        rv = api_recipes.select_recipes(mock.sentinel.where_clause)
+
+        ingrs_where_exp = peewee.Expression(models.RecipeIngredients.recipe,
+                                            peewee.OP.IN, [1, 2])
+        utensils_where_exp = peewee.Expression(models.RecipeUtensils.recipe,
+                                               peewee.OP.IN, [1, 2])
+
+        assert rv == rcps
+        assert rcps[0].ingredients == [ingrs[0], ingrs[2]]
+        assert rcps[0].utensils == []
+        assert rcps[1].ingredients == [ingrs[1]]
+        assert rcps[1].utensils == utensils
+        assert [ingr.recipe for ingr in ingrs] == [rcps[0], rcps[1], rcps[0]]
+        assert utensils[0].recipe == rcps[1]
+
+        assert mocks.mock_rcp_select.call_args_list == [mock.call()]
+        assert rcp_where.call_args_list == [
+            mock.call(mock.sentinel.where_clause)
+        ]
+        assert rcp_order_by.call_args_list == [mock.call(models.Recipe.id)]
 
-    def test_get_or_insert(self, monkeypatch, model):
-        """Test the get_or_insert function"""
-        reset_mocks = lambda mocks: [mock.reset_mock() for mock in mocks]
-        mock_model_insert_many = mock.Mock()
-        insert_many_execute = mock_model_insert_many.return_value.execute
+        assert mocks.mock_ingrs_select.call_args_list == [
+            mock.call(models.RecipeIngredients, models.Ingredient)
+        ]
+        assert ingrs_join.call_args_list == [mock.call(models.Ingredient)]
+        assert ingrs_where.call_args_list == [mock.call(ingrs_where_exp)]
 
-        mock_model_select = mock.Mock()
-        model_select_where = mock_model_select.return_value.where
-        model_select_where.return_value = [mock.sentinel.rv]
+        assert mocks.mock_utensils_select.call_args_list == [
+            mock.call(models.RecipeUtensils, models.Utensil)
+        ]
+        assert utensils_join.call_args_list == [mock.call(models.Utensil)]
+        assert utensils_where.call_args_list == [mock.call(utensils_where_exp)]
 
-        mock_elt_insert = mock.MagicMock()
-        mock_elt_insert.__getitem__.return_value = mock.sentinel.elt_insert
 
-        mocks = [mock_model_insert_many, insert_many_execute, mock_elt_insert,
-                 mock_model_select, model_select_where]
+    def test_select_recipes_query_count(self, select_recipes_mocks):
+        """The number of queries does not depend on the number of recipes"""
+        mocks = select_recipes_mocks
+        rcps = [mock.Mock(id=i) for i in range(100)]
+        (mocks.mock_rcp_select.return_value
+         .where.return_value
+         .order_by.return_value) = rcps
+        (mocks.mock_ingrs_select.return_value
+         .join.return_value
+         .where.return_value) = [mock.Mock(_data={'recipe': i % 100})
+                                 for i in range(1500)]
+        (mocks.mock_utensils_select.return_value
+         .join.return_value
+         .where.return_value) = [mock.Mock(_data={'recipe': i % 100})
+                                 for i in range(800)]
+
+        rv = api_recipes.select_recipes(mock.sentinel.where_clause)
+
+        assert len(rv) == 100
+        assert [len(rcp.ingredients) for rcp in rv] == [15] * 100
+        assert [len(rcp.utensils) for rcp in rv] == [8] * 100
+        assert mocks.mock_rcp_select.call_count == 1
+        assert mocks.mock_ingrs_select.call_count == 1
+        assert mocks.mock_utensils_select.call_count == 1
+
+
+    def test_select_recipes_no_recipe(self, select_recipes_mocks):
+        """Test the select_recipes method without any recipe found"""
+        mocks = select_recipes_mocks
+        (mocks.mock_rcp_select.return_value
+         .where.return_value
+         .order_by.return_value) = []
 
-        monkeypatch.setattr(model, 'insert_many', mock_model_insert_many)
+        rv = api_recipes.select_recipes(mock.sentinel.where_clause)
+
+        assert rv == []
+        assert mocks.mock_ingrs_select.call_args_list == []
+        assert mocks.mock_utensils_select.call_args_list == []
+
+
+    def test_recipes_with(self):
+        """Test the recipes_with where clause"""
+        where_clause = api_recipes.recipes_with(
+            models.RecipeIngredients, models.RecipeIngredients.ingredient, 3
+        )
+        sql = models.Recipe.select(models.Recipe.id).where(where_clause).sql()
+
+        assert sql == (
+            'SELECT "t1"."id" FROM "rulzurkitchen"."recipe" AS t1 '
+            'WHERE ("t1"."id" IN (SELECT "t2"."fk_recipe" '
+            'FROM "rulzurkitchen"."recipe_ingredients" AS t2 '
+            'WHERE ("t2"."fk_ingredient" = %s)))', [3]
+        )
+
+
+    def test_lock_name(self, monkeypatch):
+        """Test the db lock_name feature"""
+        mock_execute_sql = mock.Mock()
+        monkeypatch.setattr('db.connector.database.execute_sql',
+                            mock_execute_sql)
+
+        api_recipes.lock_name(models.Recipe, mock.sentinel.name)
+        sql_str = 'SELECT pg_advisory_xact_lock(hashtext(%s), hashtext(%s))'
+        assert mock_execute_sql.call_args_list == [
+            mock.call(sql_str, ('recipe', mock.sentinel.name))
+        ]
+
+
+    def test_lookup(self, monkeypatch, model):
+        """Test the lookup of elements by id or by name"""
+        mock_model_select = mock.Mock()
+        model_select_where = mock_model_select.return_value.where
+        model_select_where.return_value = iter([mock.sentinel.elt])
         monkeypatch.setattr(model, 'select', mock_model_select)
 
-        elts_insert = [mock_elt_insert]
-        elts_get = [mock.sentinel.elt_get]
-
-        rv = api_recipes.get_or_insert(model, elts_insert, elts_get)
-
-        where_exp_get = peewee.Expression(model.id, peewee.OP.IN,
-                                          [mock.sentinel.elt_get])
-        where_exp_insert = peewee.Expression(model.name, peewee.OP.IN,
-                                             [mock.sentinel.elt_insert])
-        where_exp = peewee.Expression(where_exp_get, peewee.OP.OR,
-                                      where_exp_insert)
-
-        insert_many_calls = [mock.call(elts_insert, model.name)]
-        get_item_calls = [mock.call('name')]
-        assert rv == [mock.sentinel.rv]
-        assert mock_model_insert_many.call_args_list == insert_many_calls
-        assert insert_many_execute.call_args_list == [mock.call()]
-        assert mock_elt_insert.__getitem__.call_args_list == get_item_calls
-        assert mock_model_select.call_args_list == [mock.call()]
+        rv = api_recipes.lookup(model, [1], ['a'])
+
+        where_exp = peewee.Expression(
+            peewee.Expression(model.id, peewee.OP.IN, [1]), peewee.OP.OR,
+            peewee.Expression(model.name, peewee.OP.IN, ['a'])
+        )
+        assert rv == [mock.sentinel.elt]
         assert model_select_where.call_args_list == [mock.call(where_exp)]
 
-        reset_mocks(mocks)
-        rv = api_recipes.get_or_insert(model, elts_insert, None)
+        model_select_where.reset_mock()
+        api_recipes.lookup(model, [1], [])
+        api_recipes.lookup(model, [], ['a'])
 
-        assert rv == [mock.sentinel.rv]
-        assert mock_model_insert_many.call_args_list == insert_many_calls
-        assert insert_many_execute.call_args_list == [mock.call()]
-        assert mock_elt_insert.__getitem__.call_args_list == get_item_calls
-        assert mock_model_select.call_args_list == [mock.call()]
         assert model_select_where.call_args_list == [
-            mock.call(where_exp_insert)
+            mock.call(peewee.Expression(model.id, peewee.OP.IN, [1])),
+            mock.call(peewee.Expression(model.name, peewee.OP.IN, ['a']))
         ]
 
-        reset_mocks(mocks)
-        rv = api_recipes.get_or_insert(model, None, elts_get)
+        mock_model_select.reset_mock()
+        assert api_recipes.lookup(model, [], []) == []
+        assert mock_model_select.call_args_list == []
 
-        assert rv == [mock.sentinel.rv]
-        assert mock_model_insert_many.call_args_list == []
-        assert insert_many_execute.call_args_list == []
-        assert mock_elt_insert.__getitem__.call_args_list == []
-        assert mock_model_select.call_args_list == [mock.call()]
-        assert model_select_where.call_args_list == [mock.call(where_exp_get)]
 
-        reset_mocks(mocks)
-        rv = api_recipes.get_or_insert(model, None, None)
+    def test_get_or_insert(self, monkeypatch, model):
+        """Test the get_or_insert function"""
+        elt_get, elt_c, elt_b, elt_a = (model(name=name) for name in 'gcba')
+
+        mock_lookup = mock.Mock(side_effect=[[elt_get, elt_c], [elt_b]])
+        mock_model_insert_many = mock.Mock()
+        insert_many_execute = mock_model_insert_many.return_value.execute
+        insert_many_execute.return_value = [elt_a]
 
-        assert rv == []
+        monkeypatch.setattr(api_recipes, 'lookup', mock_lookup)
+        monkeypatch.setattr(model, 'insert_many', mock_model_insert_many)
+
+        elts_insert = [{'name': 'b'}, {'name': 'c'}, {'name': 'a'},
+                       {'name': 'b'}]
+        rv = api_recipes.get_or_insert(model, elts_insert, [1])
+
+        assert rv == [elt_get, elt_c, elt_a, elt_b]
+        assert mock_lookup.call_args_list == [
+            mock.call(model, [1], ['a', 'b', 'c']),
+            mock.call(model, [], ['b'])
+        ]
+        assert mock_model_insert_many.call_args_list == [mock.call(
+            [{'name': 'a'}, {'name': 'b'}], conflict=[model.name]
+        )]
+
+        mock_lookup.reset_mock()
+        mock_lookup.side_effect = [[elt_get]]
+        mock_model_insert_many.reset_mock()
+        rv = api_recipes.get_or_insert(model, None, [1])
+
+        assert rv == [elt_get]
+        assert mock_lookup.call_args_list == [mock.call(model, [1], [])]
         assert mock_model_insert_many.call_args_list == []
-        assert insert_many_execute.call_args_list == []
-        assert mock_elt_insert.__getitem__.call_args_list == []
-        assert mock_model_select.call_args_list == []
-        assert model_select_where.call_args_list == []
 
 
     def test_ingredients_parsing(self, monkeypatch):
@@ -244,168 +343,257 @@ class TestUtilityFunctions(object):
         assert mock_insert.__setitem__.call_args_list == insert_setitem_calls
 
 
-    def test_utensils_parsing(self, monkeypatch):
-        """Test utensils_parsing function"""
-        mock_get_or_insert = mock.Mock()
-        mock_get = mock.MagicMock()
-        mock_insert = mock.MagicMock()
+    def test_ingredients_parsing_shared(self, monkeypatch):
+        """The same ingredient given by id and by name in a batch"""
+        salt = models.Ingredient(id=3, name='salt')
+        monkeypatch.setattr(api_recipes, 'get_or_insert',
+                            mock.Mock(return_value=[salt]))
+        ingrs = [{'id': 3}, {'name': 'salt'}, {'name': 'salt'}]
+
+        rv = api_recipes.ingredients_parsing(ingrs)
+
+        assert rv == [{'ingredient': salt}] * 3
 
-        mock_get.get.return_value = mock.sentinel.get
-        mock_get.__getitem__.return_value = mock.sentinel.get
-        mock_insert.get.return_value = None
-        mock_get_or_insert.return_value = mock.sentinel.get_or_insert_rv
 
+    def test_utensils_parsing(self, monkeypatch):
+        """Test utensils_parsing function"""
+        db_utensils = [models.Utensil(id=1, name='a'),
+                       models.Utensil(id=2, name='b')]
+        mock_get_or_insert = mock.Mock(return_value=db_utensils)
         monkeypatch.setattr(api_recipes, 'get_or_insert', mock_get_or_insert)
 
-        rv = api_recipes.utensils_parsing([mock_get, mock_insert])
+        rv = api_recipes.utensils_parsing([{'id': 1}, {'name': 'b'}])
 
-        get_id_calls = [mock.call('id'), mock.call('id')]
-        get_or_insert_calls = [
-            mock.call(models.Utensil, [mock_insert], [mock.sentinel.get])
+        assert rv == db_utensils
+        assert mock_get_or_insert.call_args_list == [
+            mock.call(models.Utensil, [{'name': 'b'}], [1])
         ]
+        assert api_recipes.utensil_ids([{'name': 'b'}, {'id': 1}],
+                                       db_utensils) == [2, 1]
 
-        assert rv == mock.sentinel.get_or_insert_rv
-        assert mock_get.get.call_args_list == get_id_calls
-        assert mock_insert.get.call_args_list == get_id_calls
-        assert mock_get.__getitem__.call_args_list == [mock.call('id')]
-        assert mock_get_or_insert.call_args_list == get_or_insert_calls
+        with pytest.raises(helpers.APIException) as excinfo:
+            api_recipes.utensils_parsing([{'id': 3}])
 
+        assert excinfo.value.args == ('Request malformed', 400, {
+            'errors': {'utensils': [
+                'There is some entries to update which does not exist.'
+            ]}
+        })
 
-    def test_update_recipe(self, update_recipe_fixture_mocks):
-        """Test update_recipe function"""
-        recipe = {str(mock.sentinel.recipe_attr): mock.sentinel.recipe_attr}
-        mocks = update_recipe_fixture_mocks
-        mock_recipe = mock.MagicMock(wraps=recipe)
-        mock_db_recipe = mock.Mock()
-        mock_ingr = mock.MagicMock()
-        mock_recipe.pop.side_effect = iter([mock.sentinel.recipe_id,
-                                            mock.sentinel.ingrs,
-                                            mock.sentinel.utensils])
-
-        update_where = mocks.mock_recipe_update.return_value.where
-        update_returning = update_where.return_value.returning
-        update_returning.return_value = mock_db_recipe
-
-        mocks.mock_ingrs_parsing.return_value = [mock_ingr]
-        mocks.mock_utensils_parsing.return_value = [mock.sentinel.utensil]
-
-        rv = api_recipes.update_recipe(mock_recipe)
-        pop_calls = [mock.call('id'),
-                     mock.call('ingredients', None),
-                     mock.call('utensils', None)]
-
-        where_exp = peewee.Expression(models.Recipe.id, peewee.OP.EQ,
-                                      mock.sentinel.recipe_id)
-
-        assert rv == mock_db_recipe
-        assert rv.ingredients == [mock_ingr]
-        assert rv.utensils == [mock.sentinel.utensil]
-
-        assert mock_recipe.pop.call_args_list == pop_calls
-        assert mocks.mock_recipe_update.call_args_list == [mock.call(**recipe)]
-        assert update_where.call_args_list == [mock.call(where_exp)]
-        assert update_returning.call_args_list == [mock.call()]
-
-        # checks the replacement of old ingredients
-        mock_ingrs_delete = mocks.mock_ingrs_delete
-        ingrs_delete_where = mock_ingrs_delete.return_value.where
-        ingrs_delete_execute = ingrs_delete_where.return_value.execute
-        ingrs_insert_many = mocks.mock_ingrs_insert
-        ingrs_insert_execute = ingrs_insert_many.return_value.execute
-
-        ingrs_parsing_calls = [mock.call(mock.sentinel.ingrs)]
-        ingr_setitem_calls = [mock.call('recipe', mock_db_recipe)]
-        where_exp = peewee.Expression(models.RecipeIngredients.recipe,
-                                      peewee.OP.EQ, mock.sentinel.recipe_id)
-
-        assert mock_ingrs_delete.call_args_list == [mock.call()]
-        assert mocks.mock_ingrs_parsing.call_args_list == ingrs_parsing_calls
-        assert mock_ingr.__setitem__.call_args_list == ingr_setitem_calls
-
-        assert ingrs_delete_where.call_args_list == [mock.call(where_exp)]
-        assert ingrs_delete_execute.call_args_list == [mock.call()]
-        assert ingrs_insert_many.call_args_list == [mock.call([mock_ingr])]
-        assert ingrs_insert_execute.call_args_list == [mock.call()]
-
-        # checks the replacement of old utensils
-        mock_utensils_delete = mocks.mock_utensils_delete
-        utensils_delete_where = mock_utensils_delete.return_value.where
-        utensils_delete_execute = utensils_delete_where.return_value.execute
-        utensils_insert_many = mocks.mock_utensils_insert
-        utensils_insert_execute = utensils_insert_many.return_value.execute
-
-        mock_utensils_parsing = mocks.mock_utensils_parsing
-        utensils_parsing_calls = [mock.call(mock.sentinel.utensils)]
-        where_exp = peewee.Expression(models.RecipeIngredients.recipe,
-                                      peewee.OP.EQ, mock.sentinel.recipe_id)
-        utensil_elts = [{'recipe': mock_db_recipe,
-                         'utensil': mock.sentinel.utensil}]
-
-        assert mock_utensils_delete.call_args_list == [mock.call()]
-        assert mock_utensils_parsing.call_args_list == utensils_parsing_calls
 
-        assert utensils_delete_where.call_args_list == [mock.call(where_exp)]
-        assert utensils_delete_execute.call_args_list == [mock.call()]
-        assert utensils_insert_many.call_args_list == [mock.call(utensil_elts)]
-        assert utensils_insert_execute.call_args_list == [mock.call()]
+    def test_check_unique(self):
+        """A recipe is linked once to each element"""
+        api_recipes.check_unique('utensils', [1, 2])
 
+        with pytest.raises(helpers.APIException) as excinfo:
+            api_recipes.check_unique('utensils', [1, 2, 1])
+
+        assert excinfo.value.args == ('Request malformed', 400, {
+            'errors': {'utensils': [
+                'There is multiple entries for the same entity.'
+            ]}
+        })
+
+
+    def test_sync_links(self, sync_links_mocks):
+        """Only the changed links are written"""
+        mocks = sync_links_mocks
+        model = models.RecipeIngredients
+        link = lambda recipe, ingr, quantity: {
+            'recipe': recipe, 'ingredient': ingr, 'quantity': quantity,
+            'measurement': 'g'
+        }
+        select_where = mocks.mock_select.return_value.where
+        select_where.return_value.dicts.return_value = [
+            link(1, 1, 1), link(1, 2, 1), link(1, 3, 1), link(2, 1, 1)
+        ]
+        rows = [link(1, 1, 1), link(1, 2, 5), link(1, 4, 1), link(2, 1, 1)]
 
-    def test_update_recipe_no_foreign(self, update_recipe_fixture_mocks):
-        """Test update_recipe function with no foreign key linking"""
-        mocks = update_recipe_fixture_mocks
-        mock_recipe = mock.MagicMock(wraps={})
-        mock_db_recipe = mock.Mock()
-        mock_recipe.pop.side_effect = iter([mock.sentinel.recipe_id,
-                                            None, None])
+        rv = api_recipes.sync_links(model, model.ingredient, [1, 2], rows,
+                                    columns=('quantity', 'measurement'))
 
-        (mocks.mock_recipe_update.return_value
+        delete_where = mocks.mock_delete.return_value.where
+        select_exp = peewee.Expression(model.recipe, peewee.OP.IN, [1, 2])
+        delete_exp = peewee.Expression(
+            peewee.Expression(model.recipe, peewee.OP.EQ, 1),
+            peewee.OP.AND,
+            peewee.Expression(model.ingredient, peewee.OP.IN, [3])
+        )
+
+        assert rv == 3
+        assert select_where.call_args_list == [mock.call(select_exp)]
+        assert mocks.mock_insert_many.call_args_list == [mock.call(
+            [link(1, 2, 5), link(1, 4, 1)],
+            conflict=[model.recipe, model.ingredient],
+            update=[model.quantity, model.measurement]
+        )]
+        assert delete_where.call_args_list == [mock.call(delete_exp)]
+
+
+    def test_sync_links_unchanged(self, sync_links_mocks):
+        """Nothing is written when the links did not change"""
+        mocks = sync_links_mocks
+        model = models.RecipeIngredients
+        rows = [{'recipe': 1, 'ingredient': 1}]
+        (mocks.mock_select.return_value
          .where.return_value
-         .returning.return_value) = mock_db_recipe
+         .dicts.return_value) = rows
 
-        ingrs_select = mocks.mock_ingrs_select
-        ingrs_select_join = ingrs_select.return_value.join
-        ingrs_select_where = ingrs_select_join.return_value.where
-        ingrs_select_where.return_value = [mock.sentinel.ingr]
+        rv = api_recipes.sync_links(model, model.ingredient, [1], rows)
 
-        utensils_select = mocks.mock_utensils_select
-        utensils_select_join = utensils_select.return_value.join
-        utensils_select_where = utensils_select_join.return_value.where
-        utensils_select_where.return_value = [mock.sentinel.utensil]
+        assert rv == 0
+        assert mocks.mock_insert_many.call_args_list == []
+        assert mocks.mock_delete.call_args_list == []
+        assert api_recipes.sync_links(model, model.ingredient, [], []) == 0
 
-        rv = api_recipes.update_recipe(mock_recipe)
 
-        ingrs_select_calls = [mock.call(models.RecipeIngredients,
-                                        models.Ingredient)]
-        ingrs_select_join_calls = [mock.call(models.Ingredient)]
-        ingrs_select_where_calls = [mock.call(
-            peewee.Expression(models.RecipeIngredients.recipe, peewee.OP.EQ,
-                              mock.sentinel.recipe_id)
-        )]
+    def test_update_recipes(self, update_recipes_fixture_mocks):
+        """Test update_recipes function"""
+        mocks = update_recipes_fixture_mocks
+        salt = models.Ingredient(id=3, name='salt')
+        ingrs = [
+            {'ingredient': salt, 'quantity': 1, 'measurement': 'g'},
+            {'ingredient': salt, 'quantity': 2, 'measurement': 'L'},
+        ]
+        recipes = [
+            {'id': 2, 'name': 'b', 'ingredients': [ingrs[0]],
+             'utensils': [{'id': 5}, {'name': 'pan'}]},
+            {'id': 1, 'ingredients': [ingrs[1]]},
+        ]
+        db_recipes = [models.Recipe(id=1), models.Recipe(id=2)]
 
-        utensils_select_calls = [mock.call()]
-        utensils_select_join_calls = [mock.call(models.RecipeUtensils)]
-        utensils_select_where_calls = [mock.call(
-            peewee.Expression(models.RecipeUtensils.recipe, peewee.OP.EQ,
-                              mock.sentinel.recipe_id)
-        )]
+        mocks.mock_utensils_parsing.return_value = [
+            models.Utensil(id=5, name='knife'),
+            models.Utensil(id=6, name='pan')
+        ]
+        mocks.mock_select_recipes.return_value = db_recipes
+
+        rv = api_recipes.update_recipes(recipes)
+
+        ingrs_rows = [
+            {'recipe': 2, 'ingredient': 3, 'quantity': 1, 'measurement': 'g'},
+            {'recipe': 1, 'ingredient': 3, 'quantity': 2, 'measurement': 'L'}
+        ]
+        utensils_rows = [{'recipe': 2, 'utensil': 5},
+                         {'recipe': 2, 'utensil': 6}]
+        select_exp = peewee.Expression(models.Recipe.id, peewee.OP.IN, [2, 1])
 
-        assert rv == mock_db_recipe
-        assert rv.ingredients == [mock.sentinel.ingr]
-        assert rv.utensils == [mock.sentinel.utensil]
+        assert rv == ([db_recipes[1], db_recipes[0]], 2)
+        assert mocks.mock_recipe_update_many.call_args_list == [
+            mock.call([{'id': 1}, {'id': 2, 'name': 'b'}])
+        ]
+        assert mocks.mock_ingrs_parsing.call_args_list == [mock.call(ingrs)]
+        assert mocks.mock_utensils_parsing.call_args_list == [
+            mock.call([{'id': 5}, {'name': 'pan'}])
+        ]
+        assert mocks.mock_sync_links.call_args_list == [
+            mock.call(models.RecipeIngredients,
+                      models.RecipeIngredients.ingredient, [2, 1], ingrs_rows,
+                      columns=('quantity', 'measurement')),
+            mock.call(models.RecipeUtensils, models.RecipeUtensils.utensil,
+                      [2], utensils_rows)
+        ]
+        assert mocks.mock_select_recipes.call_args_list == [
+            mock.call(select_exp)
+        ]
 
-        assert ingrs_select.call_args_list == ingrs_select_calls
-        assert ingrs_select_join.call_args_list == ingrs_select_join_calls
-        assert ingrs_select_where.call_args_list == ingrs_select_where_calls
 
+    def test_update_recipes_no_foreign(self, update_recipes_fixture_mocks):
+        """Test update_recipes function with no foreign key linking"""
+        mocks = update_recipes_fixture_mocks
+        mocks.mock_sync_links.return_value = 0
+        mocks.mock_select_recipes.return_value = [models.Recipe(id=1)]
 
-        assert utensils_select.call_args_list == utensils_select_calls
-        assert utensils_select_join.call_args_list == (
-            utensils_select_join_calls
-        )
-        assert utensils_select_where.call_args_list == (
-            utensils_select_where_calls
+        recipes, rows_touched = api_recipes.update_recipes(
+            [{'id': 1, 'people': 2}]
         )
 
+        assert [recipe.id for recipe in recipes] == [1]
+        assert rows_touched == 0
+        assert mocks.mock_recipe_update_many.call_args_list == [
+            mock.call([{'id': 1, 'people': 2}])
+        ]
+        assert mocks.mock_ingrs_parsing.call_args_list == [mock.call([])]
+        assert mocks.mock_sync_links.call_args_list == [
+            mock.call(models.RecipeIngredients,
+                      models.RecipeIngredients.ingredient, [], [],
+                      columns=('quantity', 'measurement')),
+            mock.call(models.RecipeUtensils, models.RecipeUtensils.utensil,
+                      [], [])
+        ]
+
+
+    def test_update_recipes_missing(self, update_recipes_fixture_mocks):
+        """The recipes not updated do not exist, nothing else is written"""
+        mocks = update_recipes_fixture_mocks
+        mocks.mock_recipe_update_many.side_effect = None
+        update_many = mocks.mock_recipe_update_many.return_value
+        returning = update_many.returning
+        returning.return_value.execute.return_value = [models.Recipe(id=1)]
+
+        with pytest.raises(helpers.APIException) as excinfo:
+            api_recipes.update_recipes([{'id': 1}, {'id': 2, 'name': 'b'}])
+
+        assert excinfo.value.args == ('Request malformed', 400, {
+            'errors': {'recipes': [
+                'One recipe or more do not match the database entries'
+            ]}
+        })
+        assert returning.call_args_list == [mock.call(models.Recipe.id)]
+        assert mocks.mock_ingrs_parsing.call_args_list == []
+        assert mocks.mock_sync_links.call_args_list == []
+
+
+    def test_update_recipes_conflict(self, monkeypatch,
+                                     update_recipes_fixture_mocks):
+        """A recipe given with another version than its own is a 412"""
+        mocks = update_recipes_fixture_mocks
+        mocks.mock_recipe_update_many.side_effect = None
+        update_many = mocks.mock_recipe_update_many.return_value
+        returning = update_many.returning
+        returning.return_value.execute.return_value = [models.Recipe(id=1)]
+
+        mock_select = mock.Mock()
+        where = mock_select.return_value.where
+        dicts = where.return_value.order_by.return_value.dicts
+        dicts.return_value = [{'id': 2, 'version': 4}]
+        monkeypatch.setattr('db.models.Recipe.select', mock_select)
+
+        with pytest.raises(helpers.APIException) as excinfo:
+            api_recipes.update_recipes([{'id': 1},
+                                        {'id': 2, 'version': 3},
+                                        {'id': 3, 'version': 1}])
+
+        assert excinfo.value.args == ('Precondition failed', 412, {
+            'conflicts': [{'id': 2, 'version': 4}]
+        })
+        assert mock_select.call_args_list == [
+            mock.call(models.Recipe.id, models.Recipe.version)
+        ]
+        assert where.call_args_list == [mock.call(
+            peewee.Expression(models.Recipe.id, peewee.OP.IN, [2, 3])
+        )]
+        assert mocks.mock_sync_links.call_args_list == []
+
+
+    def test_touch_recipes(self, monkeypatch):
+        """The recipes of the elements get a new version"""
+        mock_update = mock.Mock()
+        returning = mock_update.return_value.where.return_value.returning
+        returning.return_value.execute.return_value = [models.Recipe(id=3)]
+        monkeypatch.setattr('db.models.Recipe.update', mock_update)
+        utils_cache.recipes.put(3, mock.sentinel.recipe)
+
+        api_recipes.touch_recipes(models.RecipeUtensils,
+                                  models.RecipeUtensils.utensil, {5})
+        api_recipes.touch_recipes(models.RecipeUtensils,
+                                  models.RecipeUtensils.utensil, set())
+
+        assert mock_update.call_count == 1
+        assert returning.call_args_list == [mock.call(models.Recipe.id)]
+        assert utils_cache.recipes.stats()['entries'] == 0
+
+
 class TestRecipeAPI(object):
     """Test the /recipes endpoint"""
 
@@ -413,17 +601,42 @@ class TestRecipeAPI(object):
         """Test get /recipes/"""
         mock_recipes = [str(mock.sentinel.recipe)]
         mock_recipe_select = mock.Mock()
+        mock_paginate = mock.Mock(return_value=(mock_recipes, 'cursor'))
 
         dicts = mock_recipe_select.return_value.dicts
-        dicts.return_value = mock_recipes
 
         monkeypatch.setattr('db.models.Recipe.select', mock_recipe_select)
+        monkeypatch.setattr('utils.helpers.paginate', mock_paginate)
         recipes_page = app.get('/recipes/')
 
+        paginate_calls = [mock.call(dicts.return_value, models.Recipe.id)]
+
         assert recipes_page.status_code == 200
         assert mock_recipe_select.call_args_list == [mock.call()]
         assert dicts.call_args_list == [mock.call()]
-        assert utils.load(recipes_page) == {'recipes': mock_recipes}
+        assert mock_paginate.call_args_list == paginate_calls
+        assert utils.load(recipes_page) == {'recipes': mock_recipes,
+                                            'next': 'cursor'}
+
+
+    def test_recipes_list_stream(self, app, monkeypatch):
+        """Test get /recipes/ streamed"""
+        mock_recipe_select = mock.Mock()
+        mock_stream = mock.Mock(return_value='streamed')
+
+        dicts = mock_recipe_select.return_value.dicts
+        order_by = dicts.return_value.order_by
+
+        monkeypatch.setattr('db.models.Recipe.select', mock_recipe_select)
+        monkeypatch.setattr('utils.helpers.stream', mock_stream)
+        recipes_page = app.get('/recipes/?stream=1')
+
+        stream_calls = [mock.call(order_by.return_value, 'recipes')]
+
+        assert recipes_page.status_code == 200
+        assert recipes_page.data == b'streamed'
+        assert order_by.call_args_list == [mock.call(models.Recipe.id)]
+        assert mock_stream.call_args_list == stream_calls
 
 
     def test_recipes_post(self, app, monkeypatch):
@@ -434,7 +647,8 @@ class TestRecipeAPI(object):
         }
 
         mock_recipe = mock.MagicMock(spec=dict)
-        mock_lock_table = mock.Mock()
+        mock_recipe.version = 1
+        mock_lock_name = mock.Mock()
         mock_raise_or_return = mock.Mock(return_value=mock_recipe)
 
         mock_ingr = mock.MagicMock()
@@ -442,7 +656,8 @@ class TestRecipeAPI(object):
         mock_ingrs_parsing = mock.Mock(return_value=mock_ingrs)
         mock_ingrs_insert = mock.Mock()
 
-        mock_utensils = [mock.sentinel.utensil]
+        utensil = models.Utensil(id=5, name='pan')
+        mock_utensils = [utensil]
         mock_utensils_parsing = mock.Mock(return_value=mock_utensils)
         mock_utensils_insert = mock.Mock()
 
@@ -466,7 +681,7 @@ class TestRecipeAPI(object):
                             mock_ingrs_parsing)
         monkeypatch.setattr(api_recipes, 'utensils_parsing',
                             mock_utensils_parsing)
-        monkeypatch.setattr(api_recipes, 'lock_table', mock_lock_table)
+        monkeypatch.setattr(api_recipes, 'lock_name', mock_lock_name)
 
         monkeypatch.setattr('utils.schemas.recipe_schema.dump',
                             mock_recipe_schema_dump)
@@ -478,8 +693,7 @@ class TestRecipeAPI(object):
 
         recipes_create_page = app.post('/recipes/', data=recipe)
 
-        lock_table_calls = [mock.call(models.Utensil),
-                            mock.call(models.Ingredient)]
+        lock_name_calls = [mock.call(models.Recipe, mock_recipe.get('name'))]
         raise_or_return_calls = [mock.call(schema)]
         recipe_where_exp = peewee.Expression(models.Recipe.name, peewee.OP.EQ,
                                              mock_recipe.get('name'))
@@ -487,9 +701,8 @@ class TestRecipeAPI(object):
         ingrs_parsing_calls = [mock.call(mock_recipe['ingredients'])]
         utensils_parsing_calls = [mock.call(mock_recipe['utensils'])]
 
-        utensil_elts = [{'recipe': mock_recipe,
-                         'utensil': mock.sentinel.utensil}]
-        assert mock_lock_table.call_args_list == lock_table_calls
+        utensil_elts = [{'recipe': mock_recipe, 'utensil': utensil}]
+        assert mock_lock_name.call_args_list == lock_name_calls
         assert mock_raise_or_return.call_args_list == raise_or_return_calls
 
         assert mock_recipe_select.call_args_list == [mock.call()]
@@ -503,6 +716,7 @@ class TestRecipeAPI(object):
         assert mock_ingrs_insert.call_args_list == [mock.call(mock_ingrs)]
 
         assert recipes_create_page.status_code == 201
+        assert recipes_create_page.headers['ETag'] == '"1"'
         assert utils.load(recipes_create_page) == {
             'recipe': str(mock.sentinel.recipe)
         }
@@ -519,6 +733,7 @@ class TestRecipeAPI(object):
         monkeypatch.setattr('utils.helpers.raise_or_return',
                             mock_raise_or_return)
         monkeypatch.setattr('db.models.Recipe.select', mock_recipe_select)
+        monkeypatch.setattr(api_recipes, 'lock_name', mock.Mock())
 
         recipes_create_page = app.post('/recipes/', data={})
         error_msg = {'message': 'Recipe already exists.', 'status_code': 409}
@@ -531,47 +746,89 @@ class TestRecipeAPI(object):
         """Test put /recipes/"""
         recipe = {str(mock.sentinel.recipe_key): str(mock.sentinel.recipe)}
         recipes = {'recipes': [recipe]}
-        mock_recipes = mock.MagicMock(wraps=recipes, spec=dict)
 
         schema = schemas.recipe_schema_list
 
-        mock_lock_table = mock.Mock()
         mock_raise_or_return = mock.Mock(return_value=recipes)
-        mock_update_recipe = mock.Mock(return_value=mock.sentinel.recipe)
+        mock_update_recipes = mock.Mock(
+            return_value=([mock.sentinel.recipe], 3)
+        )
         mock_recipe_schema_dump = mock.Mock(
-            return_value=mock.Mock(data=mock_recipes)
+            return_value=mock.Mock(data={'recipes': [recipe]})
         )
 
-        monkeypatch.setattr(api_recipes, 'lock_table', mock_lock_table)
         monkeypatch.setattr('utils.helpers.raise_or_return', mock_raise_or_return)
-        monkeypatch.setattr(api_recipes, 'update_recipe', mock_update_recipe)
+        monkeypatch.setattr(api_recipes, 'update_recipes', mock_update_recipes)
         monkeypatch.setattr(schema, 'dump', mock_recipe_schema_dump)
 
-        lock_table_calls = [mock.call(models.Utensil),
-                            mock.call(models.Ingredient)]
         schema_dump_calls = [mock.call({'recipes': [mock.sentinel.recipe]})]
-        update_calls = [mock.call(recipe)]
+        update_calls = [mock.call([recipe])]
 
         recipes_update_page = app.put('/recipes/', data={})
 
         assert recipes_update_page.status_code == 200
-        assert utils.load(recipes_update_page) == recipes
+        assert utils.load(recipes_update_page) == {
+            'recipes': [recipe], 'rows_touched': 3
+        }
 
-        assert mock_lock_table.call_args_list == lock_table_calls
         assert mock_raise_or_return.call_args_list == [mock.call(schema)]
-        assert mock_update_recipe.call_args_list == update_calls
+        assert mock_update_recipes.call_args_list == update_calls
         assert mock_recipe_schema_dump.call_args_list == schema_dump_calls
 
 
+    def test_recipe_put(self, app, monkeypatch):
+        """Test put /recipes/<id>/ with If-Match"""
+        recipe = models.Recipe(id=2, version=4)
+        schema = schemas.recipe_schema_put
+
+        mock_raise_or_return = mock.Mock(return_value={'name': 'soup'})
+        mock_update_recipes = mock.Mock(return_value=([recipe], 1))
+        mock_recipe_schema_dump = mock.Mock(
+            return_value=mock.Mock(data={'id': 2, 'version': 4})
+        )
+
+        monkeypatch.setattr('utils.helpers.raise_or_return',
+                            mock_raise_or_return)
+        monkeypatch.setattr(api_recipes, 'update_recipes', mock_update_recipes)
+        monkeypatch.setattr('utils.schemas.recipe_schema.dump',
+                            mock_recipe_schema_dump)
+
+        recipe_put_page = app.put('/recipes/2/', data={},
+                                  headers={'If-Match': '"3"'})
+
+        assert recipe_put_page.status_code == 200
+        assert recipe_put_page.headers['ETag'] == '"4"'
+        assert utils.load(recipe_put_page) == {
+            'recipe': {'id': 2, 'version': 4}
+        }
+        assert mock_raise_or_return.call_args_list == [mock.call(schema)]
+        (rows, missing), _ = mock_update_recipes.call_args
+        assert rows == [{'id': 2, 'name': 'soup', 'version': 3}]
+        assert missing.args == ('Precondition failed', 412, None)
+
+
+    def test_recipe_put_if_match_list(self, app, monkeypatch):
+        """Only one version can be required"""
+        mock_update_recipes = mock.Mock()
+        monkeypatch.setattr(api_recipes, 'update_recipes', mock_update_recipes)
+
+        recipe_put_page = app.put('/recipes/2/', data={'name': 'soup'},
+                                  headers={'If-Match': '"3", "4"'})
+
+        assert recipe_put_page.status_code == 400
+        assert mock_update_recipes.call_count == 0
+
+
     def test_recipe_get(self, app, monkeypatch):
         """Test get /recipes/<id>"""
-        recipe = mock.sentinel.recipe
-        mock_select_recipes = mock.Mock(return_value=iter([recipe]))
-        mock_recipe_schema_dump = mock.Mock(return_value=(str(recipe), None))
+        recipe = mock.Mock(version=3)
+        dumped = {'id': 1, 'ingredients': [], 'utensils': []}
+        mock_select_recipes = mock.Mock(return_value=[recipe])
+        mock_recipe_schema_dump = mock.Mock(return_value=dumped)
 
         monkeypatch.setattr(api_recipes, 'select_recipes',
                             mock_select_recipes)
-        monkeypatch.setattr('utils.schemas.recipe_schema.dump',
+        monkeypatch.setattr('utils.serializers.recipe_serializer.dump',
                             mock_recipe_schema_dump)
 
         recipe_get_page = app.get('/recipes/1/')
@@ -581,15 +838,91 @@ class TestRecipeAPI(object):
         )]
 
         assert recipe_get_page.status_code == 200
-        assert utils.load(recipe_get_page) == {'recipe': str(recipe)}
+        assert recipe_get_page.headers['ETag'] == '"3"'
+        assert utils.load(recipe_get_page) == {'recipe': dumped}
 
         assert mock_select_recipes.call_args_list == select_recipes_calls
         assert mock_recipe_schema_dump.call_args_list == [mock.call(recipe)]
 
 
+    def test_recipe_get_cached(self, app, monkeypatch):
+        """The responses are cached per mimetype until their rows change"""
+        dumped = {'id': 1, 'name': 'soup', 'directions': {},
+                  'ingredients': [{'id': 3, 'name': 'salt'}],
+                  'utensils': [{'id': 5, 'name': 'pan'}]}
+        mock_select_recipes = mock.Mock(return_value=[mock.Mock(version=1)])
+        monkeypatch.setattr(api_recipes, 'select_recipes',
+                            mock_select_recipes)
+        monkeypatch.setattr('utils.serializers.recipe_serializer.dump',
+                            mock.Mock(return_value=dumped))
+        html = {'Accept': 'text/html'}
+
+        pages = [app.get('/recipes/1/'), app.get('/recipes/1/'),
+                 app.get('/recipes/1/', headers=html),
+                 app.get('/recipes/1/', headers=html)]
+
+        assert [page.status_code for page in pages] == [200] * 4
+        assert pages[0].data == pages[1].data
+        assert pages[2].data == pages[3].data
+        assert pages[2].mimetype == 'text/html'
+        assert mock_select_recipes.call_count == 2
+
+        utils_cache.utensils.invalidate([4])
+        app.get('/recipes/1/')
+        assert mock_select_recipes.call_count == 2
+
+        utils_cache.ingredients.invalidate([3])
+        app.get('/recipes/1/')
+        app.get('/recipes/1/', headers=html)
+        assert mock_select_recipes.call_count == 4
+
+        utils_cache.recipes.clear()
+        app.get('/recipes/1/')
+        assert mock_select_recipes.call_count == 5
+
+
+    def test_recipe_get_conditional(self, app, monkeypatch):
+        """A 304 is sent from the cached validators, without loading"""
+        dumped = {'id': 1, 'ingredients': [], 'utensils': []}
+        mock_select_recipes = mock.Mock(return_value=[mock.Mock(version=1)])
+        monkeypatch.setattr(api_recipes, 'select_recipes',
+                            mock_select_recipes)
+        monkeypatch.setattr('utils.serializers.recipe_serializer.dump',
+                            mock.Mock(return_value=dumped))
+
+        page = app.get('/recipes/1/')
+        page_etag = app.get('/recipes/1/', headers={
+            'If-None-Match': page.headers['ETag']
+        })
+        page_date = app.get('/recipes/1/', headers={
+            'If-Modified-Since': page.headers['Last-Modified']
+        })
+
+        assert page.status_code == 200
+        assert page_etag.status_code == page_date.status_code == 304
+        assert page_etag.headers['ETag'] == page.headers['ETag'] == '"1"'
+        assert mock_select_recipes.call_count == 1
+
+
+    def test_recipe_get_version(self, app, monkeypatch):
+        """A 304 is sent from the version of the recipe, without loading"""
+        mock_select_recipes = mock.Mock()
+        mock_get_recipe = mock.Mock(return_value=models.Recipe(version=2))
+        monkeypatch.setattr(api_recipes, 'select_recipes',
+                            mock_select_recipes)
+        monkeypatch.setattr(api_recipes, 'get_recipe', mock_get_recipe)
+
+        page = app.get('/recipes/1/', headers={'If-None-Match': '"2"'})
+
+        assert page.status_code == 304
+        assert page.headers['ETag'] == '"2"'
+        assert mock_get_recipe.call_args_list == [mock.call(1)]
+        assert mock_select_recipes.call_count == 0
+
+
     def test_recipe_get_404(self, app, monkeypatch):
         """Test get /recipes/<id> with a non existing recipe"""
-        mock_select_recipes = mock.Mock(side_effect=StopIteration)
+        mock_select_recipes = mock.Mock(return_value=[])
 
         monkeypatch.setattr(api_recipes, 'select_recipes',
                             mock_select_recipes)
@@ -39,35 +39,36 @@ def test_get_utensil_404(monkeypatch):
 
 def test_update_utensil(monkeypatch, utensil):
     """Test api.utensils.update_utensil function"""
-    utensil['id'] = mock.sentinel.utensil_id
-    where_exp = peewee.Expression(models.Utensil.id, peewee.OP.EQ,
-                                  mock.sentinel.utensil_id)
+    mock_update_utensils = mock.Mock(
+        return_value=([mock.sentinel.utensil], [])
+    )
 
-    mock_utensil_update = mock.Mock()
-    where = mock_utensil_update.return_value.where
-    returning = where.return_value.returning
-    dicts = returning.return_value.dicts
-    dicts.return_value = mock.sentinel.utensil
-
-    monkeypatch.setattr('db.models.Utensil.update', mock_utensil_update)
-    returned_utensil = api_utensils.update_utensil(utensil)
+    monkeypatch.setattr(api_utensils, 'update_utensils', mock_update_utensils)
+    returned_utensil = api_utensils.update_utensil(utensil, 3)
 
     assert returned_utensil is mock.sentinel.utensil
-    assert mock_utensil_update.call_args_list == [mock.call(**utensil)]
-    assert where.call_args_list == [mock.call(where_exp)]
-    assert returning.call_args_list == [mock.call()]
-    assert dicts.call_args_list == [mock.call()]
+    assert mock_update_utensils.call_args_list == [
+        mock.call([{'id': 1, 'name': 'utensil_1', 'version': 3}])
+    ]
 
 
-def test_update_utensil_404(monkeypatch, utensil):
-    """Test the api_utensils.update_utensil function with inexistent element"""
-    mock_utensil_update = mock.Mock(side_effect=peewee.DoesNotExist)
+@pytest.mark.parametrize('headers,args', [
+    ({}, ('Utensil not found', 404, None)),
+    ({'If-Match': '"3"'}, ('Precondition failed', 412, None)),
+])
+def test_update_utensil_404(app, monkeypatch, utensil, headers, args):
+    """Test the api_utensils.update_utensil function with inexistent element
 
-    monkeypatch.setattr('db.models.Utensil.update', mock_utensil_update)
-    with pytest.raises(helpers.APIException) as excinfo:
-        api_utensils.update_utensil(utensil)
+    Under If-Match the missing utensil is a 412.
+    """
+    mock_update_utensils = mock.Mock(return_value=([], [1]))
 
-    assert excinfo.value.args == ('Utensil not found', 404, None)
+    monkeypatch.setattr(api_utensils, 'update_utensils', mock_update_utensils)
+    with app.application.test_request_context(headers=headers):
+        with pytest.raises(helpers.APIException) as excinfo:
+            api_utensils.update_utensil(utensil)
+
+    assert excinfo.value.args == args
 
 
 def test_utensils_list(app, monkeypatch, utensils):
@@ -75,21 +76,64 @@ def test_utensils_list(app, monkeypatch, utensils):
 
     mock_utensil_select = mock.Mock()
     dicts = mock_utensil_select.return_value.dicts
-    dicts.return_value = utensils['utensils']
+    mock_paginate = mock.Mock(return_value=(utensils['utensils'], 'cursor'))
 
     monkeypatch.setattr('db.models.Utensil.select', mock_utensil_select)
+    monkeypatch.setattr('utils.helpers.paginate', mock_paginate)
     utensils_page = app.get('/utensils/')
 
+    paginate_calls = [mock.call(dicts.return_value, models.Utensil.id)]
+    utensils['next'] = 'cursor'
+
     assert utensils_page.status_code == 200
     assert mock_utensil_select.call_args_list == [mock.call()]
     assert dicts.call_args_list == [mock.call()]
+    assert mock_paginate.call_args_list == paginate_calls
     assert utils.load(utensils_page) == utensils
 
 
+@pytest.mark.parametrize('query,link', [
+    ('', '/utensils/?after=cursor'),
+    ('?limit=5', '/utensils/?after=cursor&amp;limit=5'),
+])
+def test_utensils_list_html(app, monkeypatch, utensils, query, link):
+    """The link to the next page keeps the size of the page"""
+    mock_paginate = mock.Mock(return_value=(utensils['utensils'], 'cursor'))
+
+    monkeypatch.setattr('db.models.Utensil.select', mock.Mock())
+    monkeypatch.setattr('utils.helpers.paginate', mock_paginate)
+    utensils_page = app.get('/utensils/' + query,
+                            headers={'Accept': 'text/html'})
+
+    assert utensils_page.mimetype == 'text/html'
+    assert '<a href="%s">Next</a>' % link in utensils_page.data.decode()
+
+
+def test_utensils_list_stream(app, monkeypatch):
+    """Test /utensils/ streamed as NDJSON"""
+    mock_utensil_select = mock.Mock()
+    mock_stream = mock.Mock(return_value='streamed')
+
+    dicts = mock_utensil_select.return_value.dicts
+    order_by = dicts.return_value.order_by
+
+    monkeypatch.setattr('db.models.Utensil.select', mock_utensil_select)
+    monkeypatch.setattr('utils.helpers.stream', mock_stream)
+    page = app.get('/utensils/', headers={'Accept': helpers.NDJSON_MIMETYPE})
+
+    stream_calls = [mock.call(order_by.return_value, 'utensils')]
+
+    assert page.status_code == 200
+    assert page.data == b'streamed'
+    assert order_by.call_args_list == [mock.call(models.Utensil.id)]
+    assert mock_stream.call_args_list == stream_calls
+
+
 def test_utensils_post(app, monkeypatch):
     """Test post /utensils/"""
     utensil = {
-        str(mock.sentinel.utensil_key): str(mock.sentinel.utensil)
+        str(mock.sentinel.utensil_key): str(mock.sentinel.utensil),
+        'version': 1
     }
     mock_utensil = mock.MagicMock(wraps=utensil)
     mock_raise_or_return = mock.Mock(return_value=mock_utensil)
@@ -105,6 +149,7 @@ def test_utensils_post(app, monkeypatch):
     utensils_create_page = app.post('/utensils/', data=mock_utensil)
 
     assert utensils_create_page.status_code == 201
+    assert utensils_create_page.headers['ETag'] == '"1"'
     assert utils.load(utensils_create_page) == {'utensil': utensil}
     assert mock_utensil_create.call_args_list == [mock.call(**utensil)]
     assert mock_raise_or_return.call_args_list == [mock.call(schema)]
@@ -125,56 +170,81 @@ def test_utensils_post_409(app, monkeypatch):
     assert utils.load(utensils_create_page) == error_msg
 
 
-def test_utensils_put(app, monkeypatch):
-    """Test put /utensils/"""
-    utensil = str(mock.sentinel.utensil)
-    utensils = {'utensils': [utensil]}
+def test_update_utensils(monkeypatch):
+    """Test api.utensils.update_utensils function"""
+    utensils = [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}]
 
-    mock_raise_or_return = mock.Mock(return_value=utensils)
-    mock_update_utensil = mock.Mock(return_value=utensil)
+    mock_update_many = mock.Mock()
+    dicts = mock_update_many.return_value.dicts
+    dicts.return_value.execute.return_value = iter([utensils[0]])
+    mock_check_versions = mock.Mock()
+    mock_touch_recipes = mock.Mock()
 
-    monkeypatch.setattr('utils.helpers.raise_or_return', mock_raise_or_return)
-    monkeypatch.setattr(api_utensils, 'update_utensil', mock_update_utensil)
+    monkeypatch.setattr('db.models.Utensil.update_many', mock_update_many)
+    monkeypatch.setattr('utils.helpers.check_versions', mock_check_versions)
+    monkeypatch.setattr('api.recipes.touch_recipes', mock_touch_recipes)
+    rv = api_utensils.update_utensils(utensils)
 
-    schema = schemas.utensil_schema_list
-    utensils_update_page = app.put('/utensils/', data=utensils)
+    assert rv == ([utensils[0]], [2])
+    assert mock_update_many.call_args_list == [mock.call(utensils)]
+    assert dicts.call_args_list == [mock.call()]
+    assert mock_check_versions.call_args_list == [
+        mock.call(models.Utensil, utensils, [2])
+    ]
+    assert mock_touch_recipes.call_args_list == [mock.call(
+        models.RecipeUtensils, models.RecipeUtensils.utensil, {1}
+    )]
 
-    assert utensils_update_page.status_code == 200
-    assert utils.load(utensils_update_page) == utensils
-    assert mock_update_utensil.call_args_list == [mock.call(utensil)]
-    assert mock_raise_or_return.call_args_list == [mock.call(schema)]
 
+def test_update_utensils_409(monkeypatch):
+    """Test api.utensils.update_utensils with a name conflict"""
+    mock_update_many = mock.Mock()
+    dicts = mock_update_many.return_value.dicts
+    dicts.return_value.execute.side_effect = peewee.IntegrityError
 
-def test_utensils_put_with_exception(app, monkeypatch):
-    """Test put /utensils/ with possible conflict"""
+    monkeypatch.setattr('db.models.Utensil.update_many', mock_update_many)
+    with pytest.raises(helpers.APIException) as excinfo:
+        api_utensils.update_utensils([{'id': 1, 'name': 'a'}])
+
+    assert excinfo.value.args == ('Utensil already exists', 409, None)
+
+
+def test_utensils_put(app, monkeypatch):
+    """Test put /utensils/"""
     utensil = str(mock.sentinel.utensil)
     utensils = {'utensils': [utensil]}
+
     mock_raise_or_return = mock.Mock(return_value=utensils)
-    mock_update_utensil = mock.Mock(side_effect=helpers.APIException('Error'))
+    mock_update_utensils = mock.Mock(return_value=([utensil], [42]))
 
     monkeypatch.setattr('utils.helpers.raise_or_return', mock_raise_or_return)
-    monkeypatch.setattr(api_utensils, 'update_utensil', mock_update_utensil)
+    monkeypatch.setattr(api_utensils, 'update_utensils', mock_update_utensils)
 
+    schema = schemas.utensil_schema_list
     utensils_update_page = app.put('/utensils/', data=utensils)
 
-    update_calls = [mock.call(utensil)]
     assert utensils_update_page.status_code == 200
-    assert utils.load(utensils_update_page) == {'utensils': []}
-    assert mock_update_utensil.call_args_list == update_calls
+    assert utils.load(utensils_update_page) == {
+        'utensils': [utensil], 'not_found': [42]
+    }
+    assert mock_update_utensils.call_args_list == [mock.call([utensil])]
+    assert mock_raise_or_return.call_args_list == [mock.call(schema)]
 
 
 def test_utensil_get(app, monkeypatch):
     """Test /utensils/<id>"""
-    sentinel_utensil = mock.sentinel.utensil
+    sentinel_utensil = mock.Mock(version=4)
     mock_get_utensil = mock.Mock(return_value=sentinel_utensil)
-    mock_utensil_dump = mock.Mock(return_value=(str(sentinel_utensil), None))
+    mock_utensil_dump = mock.Mock(return_value=str(sentinel_utensil))
 
     monkeypatch.setattr(api_utensils, 'get_utensil', mock_get_utensil)
-    monkeypatch.setattr('utils.schemas.utensil_schema.dump', mock_utensil_dump)
+    monkeypatch.setattr('utils.serializers.utensil_serializer.dump',
+                        mock_utensil_dump)
 
     utensil_page = app.get('/utensils/1/')
 
     assert utensil_page.status_code == 200
+    assert utensil_page.headers['ETag'] == '"4"'
     assert utils.load(utensil_page) == {'utensil': str(sentinel_utensil)}
     assert mock_get_utensil.call_args_list == [mock.call(1)]
     assert mock_utensil_dump.call_args_list == [mock.call(sentinel_utensil)]
@@ -182,7 +252,7 @@ def test_utensil_get(app, monkeypatch):
 
 def test_utensil_put(app, monkeypatch):
     """Test put /utensils/<id>"""
-    utensil = str(mock.sentinel.utensil)
+    utensil = {'id': 2, 'name': 'utensil_2', 'version': 2}
     mock_utensil = mock.MagicMock(spec=dict)
     mock_raise_or_return = mock.Mock(return_value=mock_utensil)
     mock_update_utensil = mock.Mock(return_value=utensil)
@@ -194,9 +264,24 @@ def test_utensil_put(app, monkeypatch):
     utensil_put_page = app.put('/utensils/2/', data=utensil)
 
     assert utensil_put_page.status_code == 200
+    assert utensil_put_page.headers['ETag'] == '"2"'
     assert utils.load(utensil_put_page) == {'utensil': utensil}
     assert mock_raise_or_return.call_args_list == [mock.call(schema)]
-    assert mock_update_utensil.call_args_list == [mock.call(mock_utensil)]
+    assert mock_update_utensil.call_args_list == [
+        mock.call(mock_utensil, None)
+    ]
+
+
+def test_utensil_put_if_match_weak(app, monkeypatch):
+    """A weak ETag never matches, nothing is updated"""
+    mock_update_utensil = mock.Mock()
+
+    monkeypatch.setattr(api_utensils, 'update_utensil', mock_update_utensil)
+    utensil_put_page = app.put('/utensils/2/', data={'name': 'a'},
+                               headers={'If-Match': 'W/"3"'})
+
+    assert utensil_put_page.status_code == 412
+    assert mock_update_utensil.call_count == 0
 
 
 def test_utensil_get_recipes(app, monkeypatch):
@@ -207,25 +292,29 @@ def test_utensil_get_recipes(app, monkeypatch):
     mock_recipes = mock.MagicMock(wraps=recipes, spec=dict)
 
     mock_get_utensil = mock.Mock()
+    mock_recipes_with = mock.Mock(return_value=mock.sentinel.where_clause)
     mock_select_recipes = mock.Mock(return_value=[mock.sentinel.recipe])
-    mock_recipe_dump = mock.Mock(return_value=(mock_recipes, None))
+    mock_recipe_dump = mock.Mock(return_value=mock_recipes)
 
     monkeypatch.setattr(api_utensils, 'get_utensil', mock_get_utensil)
+    monkeypatch.setattr('api.recipes.recipes_with', mock_recipes_with)
     monkeypatch.setattr('api.recipes.select_recipes',
                         mock_select_recipes)
-    monkeypatch.setattr('utils.schemas.recipe_schema_list.dump',
+    monkeypatch.setattr('utils.serializers.recipe_list_serializer.dump',
                         mock_recipe_dump)
 
     utensil_recipes_page = app.get('/utensils/1/recipes/')
 
-    select_recipes_calls = [mock.call(
-        peewee.Expression(models.RecipeUtensils.utensil, peewee.OP.EQ, 1)
-    )]
+    recipes_with_calls = [
+        mock.call(models.RecipeUtensils, models.RecipeUtensils.utensil, 1)
+    ]
+    select_recipes_calls = [mock.call(mock.sentinel.where_clause)]
 
     assert utensil_recipes_page.status_code == 200
     assert utils.load(utensil_recipes_page) == recipes
 
     assert mock_get_utensil.call_args_list == [mock.call(1)]
+    assert mock_recipes_with.call_args_list == recipes_with_calls
     assert mock_select_recipes.call_args_list == select_recipes_calls
     assert mock_recipe_dump.call_args_list == [mock.call({
         'recipes': [mock.sentinel.recipe]
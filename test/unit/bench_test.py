@@ -0,0 +1,184 @@
+"""Test the benchmark helpers"""
+import json
+import random
+
+import bench.datagen
+import bench.encoding
+import bench.run
+import bench.seed
+
+
+def catalogue():
+    """Small catalogue to build the requests from"""
+    args = bench.run.parse_args(['--ingredients', '20', '--utensils', '10',
+                                 '--recipes', '5'])
+    return bench.run.Catalogue(args, random.Random(0))
+
+
+def test_percentile():
+    """Test the nearest rank percentiles"""
+    values = list(range(1, 101))
+
+    assert bench.run.percentile(values, 50) == 50
+    assert bench.run.percentile(values, 99) == 99
+    assert bench.run.percentile([3], 95) == 3
+    assert bench.run.percentile([], 50) is None
+
+
+def test_summarise():
+    """Test the statistics of the samples"""
+    samples = [('recipe_get', 200, 0.01, 2), ('recipe_get', 404, 0.03, 1),
+               ('recipe_get', 0, 0.02, None)]
+
+    summary = bench.run.summarise(samples, 2)
+
+    assert summary['requests'] == 3
+    assert summary['requests_per_second'] == 1.5
+    assert summary['errors'] == 2
+    assert summary['statuses'] == {'200': 1, '404': 1, '0': 1}
+    assert summary['latency_ms'] == {'p50': 20, 'p95': 30, 'p99': 30,
+                                     'mean': 20, 'max': 30}
+    assert summary['queries_per_request'] == 1.5
+
+
+def test_report():
+    """The samples are grouped by scenario"""
+    samples = [('recipe_get', 200, 0.01, 2), ('utensil_get', 200, 0.01, 1)]
+
+    result = bench.run.report(samples, 1, {'mix': 'read'})
+
+    assert result['config'] == {'mix': 'read'}
+    assert result['overall']['requests'] == 2
+    assert sorted(result['scenarios']) == ['recipe_get', 'utensil_get']
+
+
+def test_recipes_post():
+    """The recipe posted links distinct existing elements"""
+    method, path, recipe = catalogue().recipes_post()
+    ingredients = [element.get('id') or int(element['name'].split('_')[1])
+                   for element in recipe['ingredients']]
+
+    assert (method, path) == ('POST', '/recipes/')
+    assert recipe['name'].startswith('bench_')
+    assert len(set(ingredients)) == len(ingredients) == 4
+    assert all(1 <= ingredient <= 20 for ingredient in ingredients)
+
+
+def test_recipes_put():
+    """The recipes updated keep their own name"""
+    _, _, data = catalogue().recipes_put()
+
+    assert [recipe['name'] for recipe in data['recipes']] == [
+        'recipe_%d' % recipe['id'] for recipe in data['recipes']
+    ]
+
+
+def test_recipe_put():
+    """A single recipe is updated on its own path, without its id"""
+    method, path, recipe = catalogue().recipe_put()
+
+    assert method == 'PUT'
+    assert path == '/recipes/%s/' % recipe['name'].split('_')[1]
+    assert 'id' not in recipe
+    assert len(recipe['ingredients']) == 3
+
+
+def test_elements_put():
+    """The ingredients are updated from their own payload"""
+    method, path, data = catalogue().elements_put('ingredient')
+
+    assert (method, path) == ('PUT', '/ingredients/')
+    assert [row['name'] for row in data['ingredients']] == [
+        'ingredient_%d' % row['id'] for row in data['ingredients']
+    ]
+
+
+def test_scenarios():
+    """Every scenario builds a request"""
+    scenarios = catalogue().scenarios()
+
+    for _, _, build in scenarios['read'] + scenarios['write']:
+        method, path, _ = build()
+        assert method in ('GET', 'POST', 'PUT')
+        assert path.startswith('/')
+
+
+def test_link_rows():
+    """Each recipe gets distinct elements"""
+    rows = list(bench.seed.link_rows(3, 5, 2, random.Random(0),
+                                     lambda recipe, element: (recipe, element)))
+
+    assert [recipe for recipe, _ in rows] == [1, 1, 2, 2, 3, 3]
+    assert all(rows[index] != rows[index + 1] for index in range(0, 6, 2))
+
+
+def test_batches():
+    """Test the split of the rows in batches"""
+    assert list(bench.seed.batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_csv_stream():
+    """The rows are read as CSV, chunk by chunk"""
+    stream = bench.datagen.CsvStream(iter([(1, 'a'), (2, '{"b": "c,d"}')]))
+
+    data = stream.read(3) + stream.read(3) + stream.read()
+
+    assert data == '1,a\n2,"{""b"": ""c,d""}"\n'
+    assert stream.read(10) == ''
+    assert stream.count == 2
+
+
+def test_popularity():
+    """The lower ids are the most popular ones"""
+    popularity = bench.datagen.Popularity(100, 1.5, random.Random(0))
+    draws = [popularity.draw() for _ in range(1000)]
+
+    assert all(1 <= draw <= 100 for draw in draws)
+    assert draws.count(1) > draws.count(2) > draws.count(50)
+    assert popularity.sample(200) == list(range(1, 101))
+
+
+def test_popularity_uniform():
+    """A null exponent draws uniformly"""
+    popularity = bench.datagen.Popularity(10, 0, random.Random(0))
+    sample = popularity.sample(5)
+
+    assert popularity.cumulated is None
+    assert len(set(sample)) == 5
+
+
+def test_datagen_link_rows():
+    """Each recipe gets at least one distinct element"""
+    rng = random.Random(0)
+    popularity = bench.datagen.Popularity(20, 1, rng)
+    rows = list(bench.datagen.link_rows(10, popularity, 3, 2, rng,
+                                        lambda: ('g',)))
+
+    assert {recipe for recipe, _, _ in rows} == set(range(1, 11))
+    assert len(set(rows)) == len(rows)
+    assert all(extra == 'g' for _, _, extra in rows)
+
+
+def test_recipe_rows():
+    """The directions hold the given number of words per step"""
+    args = bench.datagen.parse_args(['--recipes', '3', '--steps', '2',
+                                     '--step-words', '4'])
+    rows = list(bench.datagen.recipe_rows(args, random.Random(0)))
+
+    assert [row[:2] for row in rows] == [
+        (1, 'recipe_1'), (2, 'recipe_2'), (3, 'recipe_3')
+    ]
+    for row in rows:
+        steps = json.loads(row[2])['steps']
+        assert 1 <= len(steps) <= 4
+        assert all(len(step.split()) == 4 for step in steps)
+
+
+def test_encoding_payload():
+    """The payload is a page of recipes with their directions"""
+    args = bench.encoding.parse_args(['--recipes', '2'])
+    data = bench.encoding.payload(args)
+
+    assert data['next'] is None
+    assert [recipe['id'] for recipe in data['recipes']] == [1, 2]
+    assert all('steps' in recipe['directions'] for recipe in data['recipes'])
@@ -0,0 +1,126 @@
+"""Test the in-process caches"""
+import unittest.mock as mock
+
+import pytest
+
+import utils.cache as cache
+import utils.helpers
+
+
+class Clock(object):
+    """Clock moved forward by the tests"""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    """Fake clock of the cache"""
+    return Clock()
+
+
+def test_get(clock):
+    """The values are loaded once, then served from the cache"""
+    load = mock.Mock(side_effect=lambda key: key * 2)
+    elts = cache.Cache('elts', size=2, ttl=10, clock=clock)
+
+    assert [elts.get(key, load) for key in (1, 1, 2, 1)] == [2, 2, 4, 2]
+    assert load.call_args_list == [mock.call(1), mock.call(2)]
+
+    stats = elts.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (2, 2, 2)
+
+
+def test_get_lru(clock):
+    """The least recently used entry is evicted past the size"""
+    load = mock.Mock(side_effect=lambda key: key)
+    elts = cache.Cache('elts', size=2, ttl=10, clock=clock)
+
+    for key in (1, 2, 1, 3, 1, 2):
+        elts.get(key, load)
+
+    assert load.call_args_list == [mock.call(1), mock.call(2), mock.call(3),
+                                   mock.call(2)]
+    assert elts.stats()['evictions'] == 2
+
+
+def test_get_ttl(clock):
+    """The entries are reloaded once expired"""
+    load = mock.Mock(side_effect=['old', 'new'])
+    elts = cache.Cache('elts', size=2, ttl=10, clock=clock)
+
+    assert elts.get(1, load) == 'old'
+    clock.now = 9.9
+    assert elts.get(1, load) == 'old'
+    clock.now = 10
+    assert elts.get(1, load) == 'new'
+    assert elts.stats()['expirations'] == 1
+
+
+def test_get_error(clock):
+    """The errors of the loads are raised, not cached"""
+    load = mock.Mock(side_effect=utils.helpers.APIException('Not found', 404))
+    elts = cache.Cache('elts', size=2, ttl=10, clock=clock)
+
+    for _ in range(2):
+        with pytest.raises(utils.helpers.APIException):
+            elts.get(1, load)
+
+    assert load.call_count == 2
+    assert elts.stats()['entries'] == 0
+
+
+def test_disabled(clock):
+    """A cache of size 0 keeps nothing"""
+    load = mock.Mock(return_value='value')
+    elts = cache.Cache('elts', size=0, ttl=10, clock=clock)
+
+    assert elts.get(1, load) == elts.get(1, load) == 'value'
+    assert load.call_count == 2
+
+
+def test_invalidate(clock):
+    """The invalidated entries are reloaded"""
+    load = mock.Mock(side_effect=lambda key: key)
+    elts = cache.Cache('elts', size=2, ttl=10, clock=clock)
+    elts.get(1, load)
+    elts.get(2, load)
+
+    elts.invalidate([1, 3])
+    elts.get(1, load)
+    elts.get(2, load)
+
+    assert load.call_args_list == [mock.call(1), mock.call(2), mock.call(1)]
+    assert elts.stats()['invalidations'] == 1
+
+
+def test_invalidate_after_request(clock, request_context):
+    """The entries cached during the request are dropped once it is over"""
+    elts = cache.Cache('elts', size=2, ttl=10, clock=clock)
+    elts.put(1, 'old')
+
+    elts.invalidate_after_request([1])
+    assert elts.stats()['entries'] == 0
+
+    elts.put(1, 'read before the commit')
+    # pylint: disable=protected-access
+    for after_request in request_context._after_request_functions:
+        after_request(mock.sentinel.response)
+
+    assert elts.stats()['entries'] == 0
+
+
+def test_invalidate_hooks(clock, monkeypatch):
+    """The hooks are given the keys invalidated by the writes"""
+    hook = mock.Mock()
+    monkeypatch.setattr(cache, 'hooks', [hook])
+    elts = cache.Cache('elts', size=2, ttl=10, clock=clock)
+
+    elts.invalidate_after_request(key for key in (1, 2))
+
+    assert hook.call_args_list == [mock.call(elts, [1, 2])]
@@ -11,6 +11,8 @@ import pytest
 import api
 import db.connector
 import test.utils
+import utils.cache
+import utils.response_cache
 
 @pytest.fixture(autouse=True, scope='session')
 def mock_transaction():
@@ -41,6 +43,13 @@ def mock_connect(request):
     request.addfinalizer(finalize)
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Start each test with empty caches"""
+    utils.cache.reset()
+    utils.response_cache.responses.reset()
+
+
 # Override mock.call to be compliant with peewee __eq__ override
 unittest.mock._Call = test.utils._Call # pylint: disable=protected-access
 unittest.mock.MagicMock = test.utils.MagicMock
@@ -0,0 +1,88 @@
+"""Test the JSON encoding of the responses"""
+import json
+import unittest.mock as mock
+
+import flask
+import pytest
+
+import test.utils
+import utils.encoding as encoding
+
+
+@pytest.mark.usefixtures('request_context')
+def test_dumps_compact():
+    """The JSON is dumped without spaces, the keys sorted"""
+    assert encoding.dumps({'b': 1, 'a': [1, {'c': None}]}) == (
+        '{"a":[1,{"c":null}],"b":1}'
+    )
+
+
+def test_dumps_encoder(request_context, monkeypatch):
+    """The C encoder is used with the default encoder of the app"""
+    monkeypatch.setattr(request_context.app, 'json_encoder',
+                        flask.json.JSONEncoder)
+    fake_encoder = mock.Mock(return_value='{}')
+    monkeypatch.setattr(encoding, 'encoder', fake_encoder)
+
+    assert encoding.dumps({'a': 1}) == '{}'
+    fake_encoder.assert_called_once_with({'a': 1}, True, True)
+
+
+def test_dumps_encoder_refused(request_context, monkeypatch):
+    """The objects refused by the C encoder go through the stdlib"""
+    monkeypatch.setattr(request_context.app, 'json_encoder',
+                        flask.json.JSONEncoder)
+    monkeypatch.setattr(encoding, 'encoder',
+                        mock.Mock(side_effect=OverflowError))
+
+    assert encoding.dumps({'a': 2 ** 64}) == '{"a":%d}' % 2 ** 64
+
+
+@pytest.mark.parametrize('ensure_ascii', [True, False])
+def test_orjson_ascii(monkeypatch, ensure_ascii):
+    """orjson writes the same JSON as the stdlib, JSON_AS_ASCII or not"""
+    # pylint: disable=protected-access
+    data = {'name': 'cr\u00e8me \U0001f370', 'id': 1}
+    fake_orjson = mock.Mock(OPT_SORT_KEYS=1)
+    fake_orjson.dumps.side_effect = lambda obj, option: json.dumps(
+        obj, separators=(',', ':'), sort_keys=bool(option),
+        ensure_ascii=False
+    ).encode('utf-8')
+    monkeypatch.setattr(encoding, 'orjson', fake_orjson)
+
+    assert encoding._orjson_dumps(data, True, ensure_ascii) == json.dumps(
+        data, separators=(',', ':'), sort_keys=True, ensure_ascii=ensure_ascii
+    )
+
+
+def test_dumps_app_encoder(monkeypatch):
+    """An app with its own encoder does not use the C encoder"""
+    monkeypatch.setattr(encoding, 'encoder', mock.Mock())
+    wrapped = mock.Mock(wraps={'a': 1})
+
+    with flask.Flask(__name__).app_context() as context:
+        context.app.json_encoder = test.utils.MockEncoder
+        assert encoding.dumps({'mock': wrapped}) == '{"mock":{"a":1}}'
+    assert not encoding.encoder.called
+
+
+def test_select(monkeypatch):
+    """The fastest encoder installed is selected"""
+    monkeypatch.setattr(encoding, 'ENCODERS', (
+        ('orjson', None, 'orjson_dumps'), ('ujson', mock.Mock(), 'ujson_dumps')
+    ))
+
+    assert encoding.select('auto') == 'ujson_dumps'
+    assert encoding.select('ujson') == 'ujson_dumps'
+    assert encoding.select('orjson') is None
+    assert encoding.select('json') is None
+
+
+def test_jsonify(app):
+    """The errors are encoded compact as well"""
+    page = app.get('/admin/pool/')
+
+    assert page.mimetype == 'application/json'
+    assert page.data.decode('utf-8') == (
+        '{"message":"Forbidden","status_code":403}'
+    )
@@ -1,8 +1,11 @@
 """"Test rulzurapi helpers"""
 
+import base64
+import json
 import unittest.mock as mock
 
 import flask
+import peewee
 import pytest
 
 import utils.helpers as helpers
@@ -75,30 +78,6 @@ def test_raise_or_return_error():
     assert excinfo.value.args == api_exc
 
 
-def test_model_entity(monkeypatch):
-    """Test the model_entity helper"""
-
-    mock_model_as_entity = mock.Mock(return_value=mock.sentinel.entity)
-    mock_model = mock.Mock(_as_entity=mock_model_as_entity)
-
-    mock_query_compiler = mock.Mock()
-
-    # pylint: disable=protected-access
-    mock_parse_entity = mock_query_compiler.return_value._parse_entity
-    mock_parse_entity.return_value = (mock.sentinel.model_entity, None)
-
-    monkeypatch.setattr('peewee.QueryCompiler', mock_query_compiler)
-
-    me = helpers.model_entity(mock_model)
-
-    parse_entity_calls = [mock.call(mock.sentinel.entity, None, None)]
-
-    assert mock_query_compiler.call_args_list == [mock.call()]
-    assert mock_model_as_entity.call_args_list == [mock.call()]
-    assert mock_parse_entity.call_args_list == parse_entity_calls
-    assert me == mock.sentinel.model_entity
-
-
 def test_unpack():
     """Test the unpack function
 
@@ -146,3 +125,242 @@ def test_template(monkeypatch):
     assert flask.request.tpl == mock.sentinel.tpl
     assert mock_mapping.get.call_args_list == [mock.call('html/text')]
 
+
+
+def test_cursor():
+    """Test the encoding and decoding of pagination cursors"""
+    cursor = helpers.encode_cursor(42)
+
+    assert isinstance(cursor, str)
+    assert helpers.decode_cursor(cursor) == 42
+
+    with pytest.raises(helpers.APIException) as excinfo:
+        helpers.decode_cursor('not a cursor')
+
+    errors = {'errors': {'after': ['Invalid cursor.']}}
+    assert excinfo.value.args == ('Request malformed', 400, errors)
+
+
+@pytest.mark.parametrize('value', ['"abc"', 'null', '[1]', '{}', 'true',
+                                   '-1'])
+def test_cursor_invalid_value(value):
+    """Only an id can be hidden in a cursor"""
+    cursor = base64.urlsafe_b64encode(
+        ('{"after": %s}' % value).encode('utf-8')
+    ).decode('ascii')
+
+    with pytest.raises(helpers.APIException) as excinfo:
+        helpers.decode_cursor(cursor)
+
+    errors = {'errors': {'after': ['Invalid cursor.']}}
+    assert excinfo.value.args == ('Request malformed', 400, errors)
+
+
+def test_cursor_invalid_page(app):
+    """A crafted cursor is a bad request, not an error of the query"""
+    cursor = base64.urlsafe_b64encode(b'{"after": "abc"}').decode('ascii')
+
+    page = app.get('/ingredients/?after=%s' % cursor)
+
+    assert page.status_code == 400
+
+
+@pytest.mark.parametrize('limit', ['0', '-1', '501', 'foo'])
+def test_page_size_error(app, limit):
+    """Test the page size limits"""
+    errors = {'errors': {'limit': ['Must be between 1 and 500.']}}
+
+    with app.application.test_request_context('/?limit=%s' % limit):
+        with pytest.raises(helpers.APIException) as excinfo:
+            helpers.page_size()
+
+    assert excinfo.value.args == ('Request malformed', 400, errors)
+
+
+def test_paginate(app, model):
+    """Test the keyset pagination"""
+    rows = [{'id': i} for i in range(1, 4)]
+    mock_query = mock.Mock()
+    order_by = mock_query.order_by
+    limit = order_by.return_value.limit
+    limit.return_value = rows
+
+    with app.application.test_request_context('/?limit=2'):
+        rv, cursor = helpers.paginate(mock_query, model.id)
+
+    assert rv == rows[:2]
+    assert helpers.decode_cursor(cursor) == 2
+    assert order_by.call_args_list == [mock.call(model.id)]
+    assert limit.call_args_list == [mock.call(3)]
+
+    # last page, the query is filtered by the cursor
+    mock_query.reset_mock()
+    where = mock_query.where
+    where.return_value.order_by.return_value.limit.return_value = rows[2:]
+
+    url = '/?after=%s' % cursor
+    with app.application.test_request_context(url):
+        rv, cursor = helpers.paginate(mock_query, model.id)
+
+    where_exp = peewee.Expression(model.id, peewee.OP.GT, 2)
+    assert rv == rows[2:]
+    assert cursor is None
+    assert where.call_args_list == [mock.call(where_exp)]
+    assert where.return_value.order_by.return_value.limit.call_args_list == [
+        mock.call(51)
+    ]
+
+
+def test_stream_requested(app):
+    """Test the detection of streamed responses"""
+    ndjson = {'Accept': helpers.NDJSON_MIMETYPE}
+
+    with app.application.test_request_context('/'):
+        assert not helpers.stream_requested()
+    with app.application.test_request_context('/', headers=ndjson):
+        assert helpers.stream_requested()
+    with app.application.test_request_context('/?stream=1'):
+        assert helpers.stream_requested()
+
+
+def test_server_side():
+    """Test the iteration through a server-side cursor"""
+    mock_query = mock.MagicMock()
+    mock_query.sql.return_value = (mock.sentinel.sql, mock.sentinel.params)
+    execute_sql = mock_query.database.execute_sql
+    cursor = execute_sql.return_value
+    cursor.fetchmany.side_effect = iter([[(1, 'a'), (2, 'b')], [(3, 'c')], []])
+    cursor.description = (('id',), ('name',))
+
+    rv = list(helpers.server_side(mock_query, batch_size=2))
+
+    assert rv == [[{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}],
+                  [{'id': 3, 'name': 'c'}]]
+    assert execute_sql.call_args_list == [mock.call(
+        mock.sentinel.sql, mock.sentinel.params,
+        require_commit=False, named_cursor=True
+    )]
+    assert cursor.fetchmany.call_args_list == [mock.call(2)] * 3
+    assert cursor.close.call_args_list == [mock.call()]
+    assert mock_query.database.transaction.call_args_list == [mock.call()]
+
+
+def test_stream(app, monkeypatch):
+    """Test the streamed responses"""
+    batches = [[{'id': 1}, {'id': 2}], [{'id': 3}]]
+    mock_server_side = mock.Mock(side_effect=lambda _: iter(batches))
+    monkeypatch.setattr(helpers, 'server_side', mock_server_side)
+
+    with app.application.test_request_context('/?stream=1'):
+        response = helpers.stream(mock.sentinel.query, 'elts')
+        body = ''.join(response.response)
+
+    assert response.mimetype == 'application/json'
+    assert json.loads(body) == {'elts': [{'id': 1}, {'id': 2}, {'id': 3}]}
+
+    ndjson = {'Accept': helpers.NDJSON_MIMETYPE}
+    with app.application.test_request_context('/', headers=ndjson):
+        response = helpers.stream(mock.sentinel.query, 'elts')
+        body = ''.join(response.response)
+
+    assert response.mimetype == helpers.NDJSON_MIMETYPE
+    assert [json.loads(line) for line in body.splitlines()] == [
+        {'id': 1}, {'id': 2}, {'id': 3}
+    ]
+    assert mock_server_side.call_args_list == [
+        mock.call(mock.sentinel.query)
+    ] * 2
+
+
+def test_conditional(app, monkeypatch):
+    """The GET responses carry an ETag, a 304 is sent when it matches"""
+    mock_paginate = mock.Mock(return_value=([{'id': 1}], None))
+    monkeypatch.setattr('db.models.Ingredient.select', mock.Mock())
+    monkeypatch.setattr('utils.helpers.paginate', mock_paginate)
+
+    page = app.get('/ingredients/')
+    etag = page.headers['ETag']
+    page_304 = app.get('/ingredients/', headers={'If-None-Match': etag})
+    page_200 = app.get('/ingredients/', headers={'If-None-Match': '"old"'})
+
+    assert page.status_code == 200
+    assert page_304.status_code == 304
+    assert page_304.data == b''
+    assert page_200.status_code == 200
+    assert page_200.headers['ETag'] == etag
+
+
+def test_conditional_vary(app, monkeypatch):
+    """The responses of the views with templates vary with Accept"""
+    mock_paginate = mock.Mock(return_value=([{'id': 1}], None))
+    monkeypatch.setattr('db.models.Utensil.select', mock.Mock())
+    monkeypatch.setattr('db.models.Ingredient.select', mock.Mock())
+    monkeypatch.setattr('utils.helpers.paginate', mock_paginate)
+
+    page = app.get('/utensils/')
+    etag = page.headers['ETag']
+    page_304 = app.get('/utensils/', headers={'If-None-Match': etag})
+
+    assert page.headers['Vary'] == 'Accept'
+    assert page_304.status_code == 304
+    assert page_304.headers['Vary'] == 'Accept'
+    assert 'Vary' not in app.get('/ingredients/').headers
+
+
+def test_conditional_skipped(app):
+    """The errors and the other methods get no ETag"""
+    page = app.get('/admin/pool/')
+    page_post = app.post('/ingredients/', data={})
+
+    assert 'ETag' not in page.headers
+    assert 'ETag' not in page_post.headers
+
+
+@pytest.mark.parametrize('header,version', [
+    (None, None), ('*', None), ('"3"', 3), ('"a", "3"', 3)
+])
+def test_if_match(app, header, version):
+    """The version required by the If-Match header"""
+    headers = {'If-Match': header} if header is not None else {}
+    with app.application.test_request_context(headers=headers):
+        assert helpers.if_match() == version
+
+
+@pytest.mark.parametrize('header,status_code', [
+    ('W/"3"', 412), ('"a"', 412), ('"3", "4"', 400)
+])
+def test_if_match_error(app, header, status_code):
+    """The ETags which can not match are a 412, several versions a 400"""
+    with app.application.test_request_context(headers={'If-Match': header}):
+        with pytest.raises(helpers.APIException) as excinfo:
+            helpers.if_match()
+
+    assert excinfo.value.args[1] == status_code
+
+
+@pytest.mark.parametrize('headers,status_code', [
+    ({}, 404), ({'If-Match': '"3"'}, 412), ({'If-Match': '*'}, 412)
+])
+def test_not_found(app, headers, status_code):
+    """A missing row can not match an If-Match"""
+    with app.application.test_request_context(headers=headers):
+        error = helpers.not_found('Row not found')
+
+    assert error.args[1] == status_code
+
+
+def test_versioned(app):
+    """The version is the ETag of the JSON responses only"""
+    with app.application.test_request_context():
+        assert helpers.versioned({}, 3) == ({}, 200, {'ETag': '"3"'})
+        flask.request.tpl = 'recipe.html'
+        assert helpers.versioned({}, 3, 201) == ({}, 201)
+
+
+def test_check_versions_not_given(model):
+    """Only the rows not updated which were given a version are looked up"""
+    model.select = mock.Mock()
+
+    helpers.check_versions(model, [{'id': 1}, {'id': 2, 'version': 1}], [1])
+
+    assert model.select.call_count == 0
@@ -0,0 +1,156 @@
+"""Test the invalidation of the caches between the processes"""
+import json
+import os
+import unittest.mock as mock
+
+import psycopg2
+import pytest
+
+import utils.cache
+import utils.invalidation as invalidation
+
+
+class FakeConnection(object):
+    """Listening connection, the notifications given as (payload, ...)
+
+    A notification of None breaks the connection, the listener is stopped
+    once they are all received.
+    """
+
+    def __init__(self, listener, notifications):
+        self.listener = listener
+        self.notifications = list(notifications)
+        self.notifies = []
+        self.cursor_mock = mock.MagicMock()
+        self.cursor_mock.__enter__.return_value = self.cursor_mock
+        self.closed = False
+
+    def set_isolation_level(self, level):
+        """Autocommit is needed to LISTEN"""
+        assert level == psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT
+
+    def cursor(self):
+        """Cursor used for LISTEN and the pings"""
+        return self.cursor_mock
+
+    def poll(self):
+        """Receive the next notification"""
+        payload = self.notifications.pop(0)
+        if payload is None:
+            raise psycopg2.OperationalError('server closed the connection')
+        self.notifies.append(mock.Mock(payload=payload))
+        if not self.notifications:
+            self.listener.stop()
+
+    def close(self):
+        """Close the connection"""
+        self.closed = True
+
+
+def message(cache, keys, pid=None):
+    """Payload of a notification"""
+    return json.dumps({'pid': pid or os.getpid() + 1, 'cache': cache,
+                       'keys': keys})
+
+
+@pytest.fixture
+def select(monkeypatch):
+    """The connections always have something to read"""
+    mock_select = mock.Mock(side_effect=lambda read, *_: (read, [], []))
+    monkeypatch.setattr('utils.invalidation.select.select', mock_select)
+    return mock_select
+
+
+def test_publish(monkeypatch):
+    """The keys are notified in chunks, in the transaction of the write"""
+    mock_execute_sql = mock.Mock()
+    monkeypatch.setattr('db.connector.database.execute_sql',
+                        mock_execute_sql)
+    monkeypatch.setattr(invalidation, 'CHUNK_SIZE', 2)
+
+    invalidation.publish(utils.cache.utensils, [3, 1, 2])
+
+    sql = 'SELECT pg_notify(%s, %s)'
+    assert mock_execute_sql.call_args_list == [
+        mock.call(sql, ('rulzurapi_cache', message('utensils', [1, 2],
+                                                   os.getpid()))),
+        mock.call(sql, ('rulzurapi_cache', message('utensils', [3],
+                                                   os.getpid()))),
+    ]
+
+
+def test_invalidate():
+    """The entries notified by the other processes are dropped"""
+    for key in (1, 2):
+        utils.cache.utensils.put(key, key)
+
+    invalidation.invalidate(message('utensils', [1]))
+    invalidation.invalidate(message('utensils', [2], os.getpid()))
+    invalidation.invalidate(message('unknown', [2]))
+    invalidation.invalidate('not json')
+    invalidation.invalidate('{"keys": [2]}')
+
+    assert utils.cache.utensils.get(1, lambda key: 'reloaded') == 'reloaded'
+    assert utils.cache.utensils.get(2, lambda key: 'reloaded') == 2
+
+
+# pylint: disable=redefined-outer-name, unused-argument
+def test_listener(select):
+    """The notifications are applied as they arrive"""
+    utils.cache.ingredients.put(1, 'salt')
+    utils.cache.ingredients.put(2, 'pepper')
+
+    listener = invalidation.Listener(connect=lambda: conn)
+    conn = FakeConnection(listener, [message('ingredients', [2])])
+    listener.run()
+
+    assert conn.cursor_mock.execute.call_args_list == [
+        mock.call('LISTEN "rulzurapi_cache"')
+    ]
+    assert conn.closed
+    assert not listener.connected
+    assert listener.stats == {'notifications': 1, 'connections': 1}
+    assert utils.cache.ingredients.stats()['entries'] == 0
+
+
+def test_listener_ping(select):
+    """The connection is pinged when nothing arrives"""
+    select.side_effect = [([], [], []), ([], [], [])]
+    listener = invalidation.Listener(connect=lambda: conn)
+    conn = FakeConnection(listener, [])
+    conn.cursor_mock.execute.side_effect = lambda sql: (
+        listener.stop() if sql == 'SELECT 1' else None
+    )
+
+    listener.run()
+
+    assert conn.cursor_mock.execute.call_args_list == [
+        mock.call('LISTEN "rulzurapi_cache"'), mock.call('SELECT 1')
+    ]
+
+
+def test_listener_reconnect(select, monkeypatch):
+    """The caches are emptied each time the listener connects"""
+    mock_clear = mock.Mock()
+    monkeypatch.setattr('utils.cache.clear', mock_clear)
+    monkeypatch.setattr(invalidation, 'RECONNECT_DELAY', 0)
+
+    listener = invalidation.Listener(connect=lambda: connect())
+    conns = [FakeConnection(listener, [None]),
+             FakeConnection(listener, [message('recipes', [1])])]
+    connect = mock.Mock(side_effect=[
+        conns[0], psycopg2.OperationalError('connection refused'), conns[1]
+    ])
+
+    listener.run()
+
+    assert connect.call_count == 3
+    assert all(conn.closed for conn in conns)
+    assert mock_clear.call_args_list == [mock.call(), mock.call()]
+    assert listener.stats == {'notifications': 1, 'connections': 2}
+
+
+def test_stats():
+    """The state of the listener is reported"""
+    assert invalidation.stats() == {'connected': False, 'notifications': 0,
+                                    'connections': 0}
@@ -0,0 +1,141 @@
+"""Test the Prometheus metrics"""
+import json
+import os
+import threading
+
+import pytest
+
+import utils.metrics as metrics
+
+
+@pytest.fixture
+def registry(tmpdir, monkeypatch):
+    """Registry writing its snapshots in a temporary directory"""
+    registry = metrics.Registry(path=str(tmpdir), flush_interval=60)
+    monkeypatch.setattr(metrics, 'registry', registry)
+    return registry
+
+
+def test_observe(registry):
+    """The values are counted in the first bucket they fit in"""
+    registry.observe('request_duration_seconds', {'endpoint': 'index'}, 0.004)
+    registry.observe('request_duration_seconds', {'endpoint': 'index'}, 0.3)
+    registry.observe('request_duration_seconds', {'endpoint': 'index'}, 60)
+
+    histogram = registry.histograms[
+        'request_duration_seconds', (('endpoint', 'index'),)
+    ]
+    assert histogram['buckets'][0] == 1
+    assert histogram['buckets'][metrics.BUCKETS.index(0.5)] == 1
+    assert histogram['buckets'][-1] == 1
+    assert histogram['sum'] == pytest.approx(60.304)
+
+
+def test_flush_interval(registry):
+    """The snapshot is not written more than once per interval"""
+    registry.inc('db_queries_total')
+    registry.flush()
+    registry.inc('db_queries_total')
+    registry.flush()
+
+    filename = os.path.join(registry.path, '%d.json' % os.getpid())
+    with open(filename) as snapshot_file:
+        snapshot = json.load(snapshot_file)
+
+    assert ['db_queries_total', [], 1] in snapshot['counters']
+
+
+def test_flush_threads(registry):
+    """The threads flushing at the same time do not fail each other"""
+    errors = []
+
+    def flush():
+        """Flush many times, as the teardowns and /metrics do"""
+        try:
+            for _ in range(50):
+                registry.flush(force=True)
+        except OSError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=flush) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert os.listdir(registry.path) == ['%d.json' % os.getpid()]
+
+
+def test_aggregate(registry):
+    """The snapshots of the processes are summed, the gauges of the dead
+    processes are dropped
+    """
+    registry.inc('db_queries_total', value=2)
+    registry.observe('request_duration_seconds', {'endpoint': 'index'}, 0.2)
+
+    dead = {
+        'pid': 2 ** 22 + 1,
+        'counters': [['db_queries_total', [], 3]],
+        'histograms': [['request_duration_seconds', [['endpoint', 'index']],
+                        {'buckets': [1] + [0] * len(metrics.BUCKETS),
+                         'sum': 0.001}]],
+        'gauges': [['db_pool_connections', [['state', 'idle']], 5]]
+    }
+    with open(os.path.join(registry.path, '1.json'), 'w') as snapshot_file:
+        json.dump(dead, snapshot_file)
+
+    counters, histograms, gauges = registry.collect()
+    histogram = histograms['request_duration_seconds',
+                           (('endpoint', 'index'),)]
+
+    assert counters['db_queries_total', ()] == 5
+    assert sum(histogram['buckets']) == 2
+    assert histogram['sum'] == pytest.approx(0.201)
+    assert gauges['db_pool_connections', (('state', 'idle'),)] == 0
+
+
+def test_exposition(registry):
+    """The metrics are formatted in the text exposition format"""
+    registry.inc('requests_total', {'endpoint': 'index', 'method': 'GET',
+                                    'status': 200})
+    registry.observe('request_duration_seconds', {'endpoint': 'index'}, 0.02)
+
+    lines = registry.exposition().splitlines()
+
+    assert '# TYPE rulzurapi_requests_total counter' in lines
+    assert ('rulzurapi_requests_total{endpoint="index",method="GET",'
+            'status="200"} 1') in lines
+    assert ('rulzurapi_request_duration_seconds_bucket{endpoint="index",'
+            'le="0.01"} 0') in lines
+    assert ('rulzurapi_request_duration_seconds_bucket{endpoint="index",'
+            'le="0.025"} 1') in lines
+    assert ('rulzurapi_request_duration_seconds_bucket{endpoint="index",'
+            'le="+Inf"} 1') in lines
+    assert ('rulzurapi_request_duration_seconds_count{endpoint="index"} 1'
+            in lines)
+    assert 'rulzurapi_db_pool_connections{state="in_use"} 0' in lines
+
+
+def test_labels():
+    """The label values are escaped"""
+    # pylint: disable=protected-access
+    assert metrics._labels((('path', 'a"b\\c'),)) == r'{path="a\"b\\c"}'
+
+
+def test_request(app, registry):
+    """The requests are counted by endpoint and status"""
+    app.get('/')
+    app.get('/admin/pool/')
+    page = app.get('/metrics')
+    lines = page.data.decode().splitlines()
+
+    assert page.mimetype == 'text/plain'
+    assert ('rulzurapi_requests_total{endpoint="index",method="GET",'
+            'status="200"} 1') in lines
+    assert ('rulzurapi_request_errors_total{endpoint="admin.pool_get",'
+            'status="403"} 1') in lines
+    assert ('rulzurapi_request_duration_seconds_count{endpoint="index",'
+            'status="200"} 1') in lines
+    assert ('rulzurapi_request_duration_seconds_count{'
+            'endpoint="admin.pool_get",status="403"} 1') in lines
@@ -0,0 +1,156 @@
+"""Test the custom queries and database hooks of db.orm"""
+import unittest.mock as mock
+
+import pytest
+
+import db.models as models
+import db.orm
+
+
+def test_upsert_sql():
+    """An upsert updating the conflicting rows returns all of them"""
+    query = models.Ingredient.insert_many(
+        [{'name': 'b'}, {'name': 'a'}],
+        conflict=[models.Ingredient.name], update=[models.Ingredient.name]
+    )
+
+    assert query.sql() == (
+        'INSERT INTO "rulzurkitchen"."ingredient" ("name", "version") '
+        'VALUES (%s, %s), (%s, %s) ON CONFLICT ("name") '
+        'DO UPDATE SET "name" = "excluded"."name" '
+        'RETURNING "ingredient"."id", "ingredient"."name", '
+        '"ingredient"."version"', ['b', 1, 'a', 1]
+    )
+
+
+def test_upsert_do_nothing_sql():
+    """An upsert without update skips the conflicting rows"""
+    query = models.Utensil.insert_many(
+        [{'name': 'a'}], conflict=[models.Utensil.name]
+    )
+
+    assert query.sql() == (
+        'INSERT INTO "rulzurkitchen"."utensil" ("name", "version") '
+        'VALUES (%s, %s) ON CONFLICT ("name") DO NOTHING '
+        'RETURNING "utensil"."id", "utensil"."name", "utensil"."version"',
+        ['a', 1]
+    )
+
+
+def test_update_many_sql():
+    """The rows are joined on their id, the last duplicate wins"""
+    query = models.Utensil.update_many([
+        {'id': 2, 'name': 'b'}, {'id': 1, 'name': 'a'}, {'id': 2, 'name': 'c'}
+    ])
+
+    assert query.sql() == (
+        'UPDATE "rulzurkitchen"."utensil" '
+        'SET "name" = "var"."name", "version" = "utensil"."version" + 1 '
+        'FROM (VALUES ((NULL::"rulzurkitchen"."utensil")."id", '
+        '(NULL::"rulzurkitchen"."utensil")."name"), (%s, %s), (%s, %s)) '
+        'AS var ("id", "name") WHERE "utensil"."id" = "var"."id" '
+        'RETURNING "utensil"."id", "utensil"."name", "utensil"."version"',
+        [2, 'c', 1, 'a']
+    )
+
+
+def test_update_many_version_sql():
+    """The rows given with a version are only updated if it matches"""
+    query = models.Utensil.update_many([
+        {'id': 2, 'name': 'b'}, {'id': 1, 'version': 3}
+    ])
+
+    assert query.sql() == (
+        'UPDATE "rulzurkitchen"."utensil" '
+        'SET "name" = CASE WHEN "var"."name__present" THEN "var"."name" '
+        'ELSE "utensil"."name" END, "version" = "utensil"."version" + 1 '
+        'FROM (VALUES ((NULL::"rulzurkitchen"."utensil")."id", '
+        '(NULL::"rulzurkitchen"."utensil")."name", '
+        '(NULL::"rulzurkitchen"."utensil")."version", NULL::boolean), '
+        '(%s, %s, NULL, TRUE), (%s, NULL, %s, FALSE)) '
+        'AS var ("id", "name", "version", "name__present") '
+        'WHERE "utensil"."id" = "var"."id" AND "utensil"."version" = '
+        'COALESCE("var"."version", "utensil"."version") '
+        'RETURNING "utensil"."id", "utensil"."name", "utensil"."version"',
+        [2, 'b', 1, 3]
+    )
+
+
+def test_update_many_only_version_sql():
+    """The rows without fields to update get a new version"""
+    sql, params = models.Recipe.update_many([{'id': 1}]).sql()
+
+    assert sql.startswith(
+        'UPDATE "rulzurkitchen"."recipe" '
+        'SET "version" = "recipe"."version" + 1 FROM (VALUES'
+    )
+    assert params == [1]
+
+
+def test_update_many_missing_field_sql():
+    """A field missing from a row is sent as NULL, the value is kept"""
+    query = models.Recipe.update_many([
+        {'id': 1, 'directions': {'step 1': 'cook'}}, {'id': 2, 'people': 4}
+    ])
+    sql, params = query.sql()
+
+    assert '(%s, %s, NULL, TRUE, FALSE), (%s, NULL, %s, FALSE, TRUE)' in sql
+    assert [params[0], params[1].adapted, params[2], params[3]] == [
+        1, {'step 1': 'cook'}, 2, 4
+    ]
+
+
+def test_update_many_null_sql():
+    """A None sets the column to NULL, unlike a missing field"""
+    sql, params = models.Recipe.update_many([
+        {'id': 1, 'people': None, 'category': 'dessert'},
+        {'id': 2, 'people': 4}
+    ]).sql()
+
+    assert '"people" = "var"."people"' in sql
+    assert ('"category" = CASE WHEN "var"."category__present" '
+            'THEN "var"."category" ELSE "recipe"."category" END') in sql
+    assert '(%s, %s, %s, TRUE), (%s, %s, NULL, FALSE)' in sql
+    assert params == [1, None, 'dessert', 2, 4]
+
+
+def test_update_many_empty():
+    """Nothing is sent to the database without rows"""
+    assert models.Utensil.update_many([]).execute() == []
+
+
+def test_query_hooks():
+    """The hooks get the query, its duration and its error, if any"""
+
+    # pylint: disable=too-few-public-methods
+    class Database(object):
+        """Fake database failing on the second query"""
+        def __init__(self, *_):
+            self.calls = 0
+
+        def execute_sql(self, sql, params=None, require_commit=True):
+            """Fake query execution"""
+            self.calls += 1
+            if self.calls > 1:
+                raise ValueError(sql, params, require_commit)
+            return mock.sentinel.cursor
+
+    # pylint: disable=too-few-public-methods
+    class HookedDatabase(db.orm.QueryHooksDatabase, Database):
+        """Database with query hooks"""
+        pass
+
+    hook = mock.Mock()
+    database = HookedDatabase('db')
+    database.query_hooks.append(hook)
+
+    with mock.patch('time.perf_counter', side_effect=[1.0, 1.5, 2.0, 4.0]):
+        cursor = database.execute_sql('SELECT 1', [1], require_commit=False)
+        with pytest.raises(ValueError):
+            database.execute_sql('SELECT 2')
+
+    assert cursor is mock.sentinel.cursor
+    (_, _, _, error), _ = hook.call_args_list[1]
+    assert hook.call_args_list == [mock.call('SELECT 1', [1], 0.5, None),
+                                   mock.call('SELECT 2', None, 2.0, error)]
+    assert isinstance(error, ValueError)
@@ -0,0 +1,195 @@
+"""Test the connection pool"""
+# pylint: disable=no-self-use, protected-access
+import unittest.mock as mock
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+import db.pool
+
+IDLE = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+INERROR = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+
+
+class FakeDatabase(object):
+    """Mimic the peewee database hooks used by the pool"""
+
+    def __init__(self, database, **connect_kwargs):
+        self.database = database
+        self.deferred = database is None
+        self.connect_kwargs = connect_kwargs
+        self._conn_lock = mock.MagicMock()
+        self.connections = []
+
+    def _connect(self, *_, **__):
+        """Create a fake psycopg2 connection"""
+        conn = mock.Mock(closed=0)
+        conn.get_transaction_status.return_value = IDLE
+        conn.close.side_effect = lambda: setattr(conn, 'closed', 1)
+        self.connections.append(conn)
+        return conn
+
+    def _close(self, conn):
+        """Close the fake connection"""
+        conn.close()
+
+
+class Pool(db.pool.PooledDatabase, FakeDatabase):
+    """Pool over the fake database"""
+    pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Control the time seen by the pool"""
+    mock_time = mock.Mock(return_value=1000.0)
+    monkeypatch.setattr('time.time', mock_time)
+    return mock_time
+
+
+class TestPool(object):
+    """Test suite for the pooled database"""
+
+    def test_reuse(self):
+        """A connection given back is checked out again"""
+        pool = Pool('db')
+        conn = pool._connect('db')
+        pool._close(conn)
+        assert pool._connect('db') is conn
+
+        stats = pool.stats()
+        assert stats['created'] == 1
+        assert stats['checkouts'] == 2
+        assert stats['in_use'] == 1
+        assert stats['idle'] == 0
+
+
+    def test_exhausted(self):
+        """The pool refuses to open more than max_connections"""
+        pool = Pool('db', max_connections=2)
+        pool._connect('db')
+        pool._connect('db')
+
+        with pytest.raises(db.pool.PoolExhausted):
+            pool._connect('db')
+        assert pool.stats()['exhausted'] == 1
+
+
+    def test_no_pooling(self):
+        """max_connections set to 0 closes the connections"""
+        pool = Pool('db', max_connections=0)
+        conn = pool._connect('db')
+        pool._close(conn)
+
+        assert conn.closed
+        assert pool._connect('db') is not conn
+
+
+    def test_max_age(self, clock):
+        """Connections older than max_age are recycled"""
+        pool = Pool('db', max_age=10)
+        conn = pool._connect('db')
+        pool._close(conn)
+
+        clock.return_value += 11
+        new_conn = pool._connect('db')
+
+        assert new_conn is not conn
+        assert conn.closed
+        assert pool.stats()['recycled'] == 1
+
+
+    def test_idle_timeout(self, clock):
+        """Connections unused for idle_timeout are closed but min is kept"""
+        pool = Pool('db', min_connections=1, idle_timeout=10)
+        conns = [pool._connect('db') for _ in range(3)]
+        for conn in conns:
+            pool._close(conn)
+
+        clock.return_value += 11
+        pool._prune()
+
+        assert [conn.closed for conn in conns] == [1, 1, 0]
+        assert pool.stats()['expired'] == 2
+        assert pool.stats()['idle'] == 1
+
+
+    def test_rollback_on_return(self):
+        """A connection in an aborted transaction is rolled back"""
+        pool = Pool('db')
+        conn = pool._connect('db')
+        conn.get_transaction_status.return_value = INERROR
+        conn.rollback.side_effect = lambda: (
+            conn.get_transaction_status.configure_mock(return_value=IDLE)
+        )
+        pool._close(conn)
+
+        assert conn.rollback.call_args_list == [mock.call()]
+        assert pool._connect('db') is conn
+        assert pool.stats()['rollbacks'] == 1
+
+
+    def test_health_check(self, clock):
+        """A connection failing the ping is replaced"""
+        pool = Pool('db', check_interval=5)
+        conn = pool._connect('db')
+        pool._close(conn)
+
+        conn.cursor.return_value.execute.side_effect = psycopg2.Error
+        clock.return_value += 6
+        new_conn = pool._connect('db')
+
+        assert new_conn is not conn
+        assert conn.closed
+        assert pool.stats()['health_check_failures'] == 1
+
+
+    def test_health_check_skipped(self, clock):
+        """A connection recently used is not pinged"""
+        pool = Pool('db', check_interval=5)
+        conn = pool._connect('db')
+        pool._close(conn)
+
+        clock.return_value += 1
+        assert pool._connect('db') is conn
+        assert conn.cursor.call_args_list == []
+
+
+    def test_fill(self):
+        """fill opens min_connections connections"""
+        pool = Pool('db', min_connections=2)
+        pool.fill()
+        pool.fill()
+
+        assert len(pool.connections) == 2
+        assert pool.stats()['idle'] == 2
+
+        pool.close_all()
+        assert [conn.closed for conn in pool.connections] == [1, 1]
+        assert pool.stats()['idle'] == 0
+
+
+    def test_fill_deferred(self):
+        """fill waits for the settings of a deferred database"""
+        pool = Pool(None, min_connections=2)
+        pool.fill()
+
+        assert pool.connections == []
+
+
+    def test_reset(self):
+        """reset drops the inherited connections without closing them"""
+        pool = Pool('db', min_connections=1)
+        pool.fill()
+        conn = pool._connect('db')
+        pool._connect('db')
+        pool._close(conn)
+
+        pool.reset()
+
+        assert [conn.closed for conn in pool.connections] == [0, 0]
+        assert pool.stats()['idle'] == 0
+        assert pool.stats()['in_use'] == 0
+        assert pool.stats()['created'] == 0
+        assert pool._connect('db') not in pool.connections[:2]
@@ -0,0 +1,74 @@
+"""Test the on demand profiling of the requests"""
+import os
+
+import pytest
+
+import utils.profiling as profiling
+
+
+@pytest.fixture(autouse=True)
+def profile_dir(tmpdir, monkeypatch):
+    """Store the profiles in a temporary directory"""
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmpdir))
+    monkeypatch.setattr(profiling, 'SAMPLE_RATE', 0)
+    return str(tmpdir)
+
+
+@pytest.fixture
+def admin_token(app):
+    """Configure an admin token for the application"""
+    app.application.config['ADMIN_TOKEN'] = 'secret'
+    return 'secret'
+
+
+def test_not_profiled(app, admin_token, profile_dir):
+    """The requests are not profiled without the header"""
+    page = app.get('/')
+    page_wrong = app.get('/', headers={'X-Profile': 'wrong'})
+
+    assert 'X-Profile-Id' not in page.headers
+    assert 'X-Profile-Id' not in page_wrong.headers
+    assert os.listdir(profile_dir) == []
+
+
+def test_no_token(app, profile_dir):
+    """The header is ignored when no admin token is configured"""
+    app.application.config['ADMIN_TOKEN'] = None
+    page = app.get('/', headers={'X-Profile': ''})
+
+    assert 'X-Profile-Id' not in page.headers
+    assert os.listdir(profile_dir) == []
+
+
+def test_profiled(app, admin_token):
+    """The authorised requests are profiled and stored"""
+    page = app.get('/', headers={'X-Profile': admin_token})
+    profile_id = page.headers['X-Profile-Id']
+
+    assert page.status_code == 200
+    assert [stored['id'] for stored in profiling.profiles()] == [profile_id]
+    assert 'index' in profiling.report(profile_id)
+
+
+def test_sample_rate(app, monkeypatch):
+    """The sampled requests are profiled"""
+    monkeypatch.setattr(profiling, 'SAMPLE_RATE', 1)
+    page = app.get('/')
+
+    assert 'X-Profile-Id' in page.headers
+
+
+def test_keep(app, admin_token, monkeypatch, profile_dir):
+    """Only the last profiles are kept"""
+    monkeypatch.setattr(profiling, 'KEEP', 2)
+    for _ in range(3):
+        app.get('/', headers={'X-Profile': admin_token})
+
+    assert len(os.listdir(profile_dir)) == 2
+
+
+def test_path():
+    """The ids which are not uuid are rejected"""
+    assert profiling.path('../../etc/passwd') is None
+    assert profiling.report('../../etc/passwd') is None
+    assert profiling.report('0' * 32) is None
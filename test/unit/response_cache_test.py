@@ -0,0 +1,145 @@
+"""Test the response cache and its backends"""
+import unittest.mock as mock
+
+import pytest
+
+import utils.cache
+import utils.helpers
+import utils.response_cache as response_cache
+
+
+class Clock(object):
+    """Clock moved forward by the tests"""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def entry(body):
+    """Cached JSON response"""
+    return response_cache.Entry(200, 'application/json', body, 'etag', 1)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmpdir):
+    """Backend of 2 responses kept 10 seconds, its clock in .clock"""
+    clock = Clock()
+    if request.param == 'memory':
+        backend = response_cache.MemoryBackend(size=2, ttl=10, clock=clock)
+    else:
+        backend = response_cache.SqliteBackend(
+            str(tmpdir.join('responses.db')), size=2, ttl=10, clock=clock
+        )
+    backend.clock = clock
+    return backend
+
+
+# pylint: disable=redefined-outer-name
+def test_backend_get(store):
+    """The entries are kept until they expire"""
+    key = ('recipes.recipe_get', (('recipe_id', 1),), None)
+    store.set(key, entry(b'{}'), [('recipes', 1)])
+
+    assert store.get(key) == entry(b'{}')
+    assert store.get(('recipes.recipe_get', (('recipe_id', 2),), None)) is None
+
+    store.clock.now = 10
+    assert store.get(key) is None
+
+
+def test_backend_lru(store):
+    """The least recently used entry is evicted past the size"""
+    for key in ('a', 'b'):
+        store.clock.now += 1
+        store.set(key, entry(key.encode()), [])
+    store.clock.now += 1
+    store.get('a')
+    store.clock.now += 1
+    store.set('c', entry(b'c'), [])
+
+    assert [store.get(key) is not None for key in 'abc'] == [True, False,
+                                                            True]
+    assert len(store) == 2
+
+
+def test_backend_invalidate(store):
+    """The entries tagged are dropped"""
+    store.set('a', entry(b'a'), [('recipes', 1), ('ingredients', 3)])
+    store.set('b', entry(b'b'), [('recipes', 2), ('ingredients', 4)])
+
+    assert store.invalidate([('ingredients', 3), ('utensils', 3)]) == 1
+    assert store.get('a') is None
+    assert store.get('b') == entry(b'b')
+
+    store.clear()
+    assert len(store) == 0
+
+
+def test_backend_unknown():
+    """The backends are chosen by name"""
+    assert isinstance(response_cache.backend('memory'),
+                      response_cache.MemoryBackend)
+    assert response_cache.backend('none') is None
+    with pytest.raises(ValueError):
+        response_cache.backend('redis://localhost')
+
+
+def test_cached(request_context):
+    """Only the 200 responses are kept, the errors are raised"""
+    responses = response_cache.ResponseCache(response_cache.MemoryBackend())
+    request_context.request.view_args = {'elt_id': 1}
+    view = mock.Mock(side_effect=[
+        utils.helpers.APIException('Not found', 404), ({'elt': 1}, 201),
+        {'elt': 1}, {'elt': 2}
+    ])
+    cached_view = responses.cached(
+        lambda data, elt_id: [('utensils', elt_id)]
+    )(view)
+
+    with pytest.raises(utils.helpers.APIException):
+        cached_view(elt_id=1)
+    assert cached_view(elt_id=1).status_code == 201
+    assert cached_view(elt_id=1).data == cached_view(elt_id=1).data
+    assert view.call_count == 3
+
+    responses.invalidate(utils.cache.utensils, [1])
+    assert cached_view(elt_id=1).data == b'{"elt":2}'
+    assert responses.stats()['invalidations'] == 1
+
+
+def test_cached_invalidated(request_context):
+    """A response invalidated while it is built is not kept"""
+    responses = response_cache.ResponseCache(response_cache.MemoryBackend())
+    request_context.request.view_args = {'elt_id': 1}
+
+    def view(elt_id):
+        """Row changed by another request while it is serialised"""
+        responses.invalidate(utils.cache.utensils, [elt_id])
+        return {'elt': elt_id}
+
+    cached_view = responses.cached(
+        lambda data, elt_id: [('utensils', elt_id)]
+    )(view)
+
+    assert cached_view(elt_id=1).data == b'{"elt":1}'
+    assert len(responses.store) == 0
+    assert responses.stats()['misses'] == 1
+
+
+def test_cached_disabled(request_context):
+    """Without backend the views are always called"""
+    # pylint: disable=unused-argument
+    responses = response_cache.ResponseCache(None)
+    view = mock.Mock(return_value={})
+    cached_view = responses.cached(lambda data, **_: [])(view)
+
+    cached_view()
+    cached_view()
+    responses.invalidate(utils.cache.utensils, None)
+
+    assert view.call_count == 2
+    assert responses.stats()['backend'] == 'none'
@@ -6,7 +6,6 @@ import imp
 import unittest.mock as mock
 
 import marshmallow
-import peewee
 import pytest
 
 import db.models as models
@@ -117,6 +116,22 @@ class TestUtensilSchemas(object):
         assert data == utensils_copy
 
 
+    def test_utensil_version(self, utensil_no_id):
+        """The version is only loaded by the bulk update"""
+        utensil_no_id['version'] = 3
+        data, errors = schemas.utensil_schema_list.load(
+            {'utensils': [dict(utensil_no_id, id=1)]}
+        )
+        assert errors == {}
+        assert data == {'utensils': [dict(utensil_no_id, id=1)]}
+
+        for schema in (schemas.utensil_schema_put,
+                       schemas.utensil_schema_post):
+            data, errors = schema.load(utensil_no_id)
+            assert errors == {}
+            assert data == {'name': 'utensil_1'}
+
+
 class TestIngredientSchemas(object):
     """Test schemas related to ingredients"""
 
@@ -324,96 +339,37 @@ class TestValidateFunctions(object):
         schemas.validate_nested(None, None, None, data)
 
 
-    def test_validate_unique(self, monkeypatch, model):
-        """Test the validation for unique db constraint (mostly name attr)"""
-        mock_model_select = mock.Mock()
-        model_where = mock_model_select.return_value.where
-        model_dicts = model_where.return_value.dicts
-
-        model_dicts.return_value = [{'name': 'elt_1'}]
-
-        elts = [{'id': 1}, {'name': 'elt_2'}]
-        field = mock.sentinel.field
-
-        monkeypatch.setattr(model, 'select', mock_model_select)
-        schemas.validate_unique(model, field, elts)
-
-        model_select_calls = [mock.call(model.name)]
-        model_where_exp = peewee.Expression(model.id, peewee.OP.IN, [1])
-
-        assert mock_model_select.call_args_list == model_select_calls
-        assert model_where.call_args_list == [mock.call(model_where_exp)]
-        assert model_dicts.call_args_list == [mock.call()]
-
-
-    def test_validate_unique_no_entry(self, monkeypatch, model):
-        """Test the unique validation if the element does not exist in db"""
-        mock_model_select = mock.Mock()
-        (mock_model_select.return_value
-         .where.return_value
-         .dicts.return_value) = []
-
-        elts = [{'id': 1}]
-        monkeypatch.setattr(model, 'select', mock_model_select)
-        with pytest.raises(marshmallow.ValidationError) as excinfo:
-            schemas.validate_unique(model, None, elts)
+    def test_validate_unique(self):
+        """Test the validation of the elements given once, without query"""
+        elts = [{'id': 1}, {'id': 2, 'name': 'elt_1'}, {'name': 'elt_1'}]
 
-        assert excinfo.value.args == ('There is some entries to update which '
-                                      'does not exist.',)
+        schemas.validate_unique(mock.sentinel.field, elts)
 
 
-    def test_validate_unique_multiple_entries(self, monkeypatch, model):
+    def test_validate_unique_multiple_entries(self):
         """Test the unique validation for the same object multiple reference"""
-        mock_model_select = mock.Mock()
-        (mock_model_select.return_value
-         .where.return_value
-         .dicts.return_value) = [{'name': 'elt_1'}]
+        for elts in ([{'id': 1}, {'id': 1, 'name': 'elt_1'}],
+                     [{'name': 'elt_1'}, {'name': 'elt_1'}]):
+            with pytest.raises(marshmallow.ValidationError) as excinfo:
+                schemas.validate_unique(mock.sentinel.field, elts)
 
-        elts = [{'id': 1}, {'name': 'elt_1'}]
+            assert excinfo.value.args == ('There is multiple entries for the '
+                                          'same entity.',)
+            assert excinfo.value.field == mock.sentinel.field
 
-        monkeypatch.setattr(model, 'select', mock_model_select)
-        with pytest.raises(marshmallow.ValidationError) as excinfo:
-            schemas.validate_unique(model, mock.sentinel.field, elts)
 
-        assert excinfo.value.args == ('There is multiple entries for the same '
-                                      'entity.',)
-        assert excinfo.value.field == mock.sentinel.field
-
-
-    def test_validate_recipes(self, monkeypatch):
+    def test_validate_recipes(self):
         """Test the validation function on put method for recipes"""
-        mock_recipe_select = mock.Mock()
-        recipe_where = mock_recipe_select.return_value.where
-        recipe_count = recipe_where.return_value.count
-        recipe_count.return_value = 1
-
-        recipes = [{'id': 1}]
+        schemas.validate_recipes([{'id': 1}, {'id': 2}])
 
-        monkeypatch.setattr('db.models.Recipe.select', mock_recipe_select)
-        schemas.validate_recipes(recipes)
-
-        where_exp = peewee.Expression(models.Recipe.id, peewee.OP.IN, [1])
-
-        assert mock_recipe_select.call_args_list == [mock.call()]
-        assert recipe_where.call_args_list == [mock.call(where_exp)]
-        assert recipe_count.call_args_list == [mock.call()]
-
-
-    def test_validate_recipes_no_entry(self, monkeypatch):
-        """Test recipes validation with errors"""
-        mock_recipe_select = mock.Mock()
-        (mock_recipe_select.return_value
-         .where.return_value.count
-         .return_value) = 0
-
-        recipes = [{'id': 1}]
-        monkeypatch.setattr('db.models.Recipe.select', mock_recipe_select)
 
+    def test_validate_recipes_multiple_entries(self):
+        """Test recipes validation with the same recipe twice"""
         with pytest.raises(marshmallow.ValidationError) as excinfo:
-            schemas.validate_recipes(recipes)
+            schemas.validate_recipes([{'id': 1}, {'id': 1}])
 
-        assert excinfo.value.args == ('One recipe or more do not match the '
-                                      'database entries',)
+        assert excinfo.value.args == ('There is multiple entries for the same '
+                                      'entity.',)
 
 
 class TestRecipeSchema(object):
@@ -443,10 +399,8 @@ class TestRecipeSchema(object):
         monkeypatch.setattr('functools.partial', mock_partial)
         imp.reload(schemas)
 
-        partial_calls = [mock.call(schemas.validate_unique,
-                                   models.Ingredient, 'ingredients'),
-                         mock.call(schemas.validate_unique, models.Utensil,
-                                   'utensils')]
+        partial_calls = [mock.call(schemas.validate_unique, 'ingredients'),
+                         mock.call(schemas.validate_unique, 'utensils')]
         assert mock_partial.call_args_list == partial_calls
 
 
@@ -0,0 +1,129 @@
+"""Test the compiled serializers against the marshmallow dumps"""
+# pylint: disable=too-few-public-methods
+import json
+
+import marshmallow
+import pytest
+
+import db.models as models
+import utils.schemas as schemas
+import utils.serializers as serializers
+
+
+def recipe(**attributes):
+    """Recipe with an ingredient and an utensil, overridden by attributes"""
+    data = {'id': 1, 'name': 'recipe_1', 'directions': {'steps': ['mix']},
+            'difficulty': 2, 'duration': '0/5', 'people': 4,
+            'category': 'main'}
+    data.update(attributes)
+    recipe_model = models.Recipe(**{
+        key: value for key, value in data.items()
+        if key not in ('ingredients', 'utensils')
+    })
+
+    link = models.RecipeIngredients(quantity=2, measurement='g')
+    link.ingredient = models.Ingredient(id=3, name='salt')
+    recipe_model.ingredients = data.get('ingredients', [link])
+
+    utensil_link = models.RecipeUtensils()
+    utensil_link.utensil = models.Utensil(id=5, name='pan')
+    recipe_model.utensils = data.get('utensils', [utensil_link])
+    return recipe_model
+
+
+def dumps(data):
+    """JSON of the data, as sent in a response"""
+    return json.dumps(data, sort_keys=True)
+
+
+@pytest.mark.parametrize('attributes', [
+    {},
+    {'people': None, 'difficulty': None, 'directions': None},
+    {'name': '', 'duration': 'never', 'category': None},
+    {'difficulty': 'hard', 'people': 2.0},
+    {'ingredients': [], 'utensils': None},
+])
+def test_recipe(attributes):
+    """The recipes are dumped as RecipeSchema dumps them"""
+    expected = schemas.recipe_schema.dump(recipe(**attributes)).data
+
+    assert dumps(serializers.recipe_serializer.dump(
+        recipe(**attributes)
+    )) == dumps(expected)
+
+
+def test_recipe_list():
+    """The lists of recipes are dumped as RecipeListSchema dumps them"""
+    recipes = lambda: {'recipes': [recipe(), recipe(id=2, people=None)]}
+    expected = schemas.recipe_schema_list.dump(recipes()).data
+
+    assert dumps(serializers.recipe_list_serializer.dump(recipes())) == (
+        dumps(expected)
+    )
+    assert serializers.recipe_list_serializer.dump({'recipes': []}) == {
+        'recipes': []
+    }
+
+
+def test_recipe_dict():
+    """The dicts are dumped as well, their ingredients merged"""
+    data = lambda: {
+        'id': 1, 'name': 'recipe_1', 'directions': {},
+        'ingredients': [{'ingredient': {'id': 3, 'name': 'salt'},
+                         'quantity': 1, 'measurement': 'L'}],
+        'utensils': [{'id': 5, 'name': 'pan'}],
+    }
+    expected = schemas.recipe_schema.dump(data()).data
+
+    assert serializers.recipe_serializer.dump(data()) == expected
+
+
+@pytest.mark.parametrize('element', [
+    models.Ingredient(id=1, name='salt'),
+    models.Ingredient(name='salt'),
+    models.Ingredient(id=1, name=''),
+    {'id': '2', 'name': b'pepper'},
+])
+def test_element(element):
+    """The ingredients and the utensils are dumped as their schemas do"""
+    assert serializers.ingredient_serializer.dump(element) == (
+        schemas.ingredient_schema.dump(element).data
+    )
+    assert serializers.utensil_serializer.dump(element) == (
+        schemas.utensil_schema.dump(element).data
+    )
+
+
+def test_links_untouched():
+    """The ingredient links are not modified by the dump"""
+    link = models.RecipeIngredients(quantity=2, measurement='g')
+    link.ingredient = models.Ingredient(id=3, name='salt')
+
+    serializers.recipe_serializer.dump(recipe(ingredients=[link]))
+
+    assert not hasattr(link, 'name')
+
+
+def test_custom_dump():
+    """A schema with its own dump can not be compiled without PREPARE"""
+
+    class CustomSchema(schemas.Schema):
+        """Schema with a custom dump"""
+        name = marshmallow.fields.String()
+
+        def dump(self, obj, *args, **kwargs):
+            return super(CustomSchema, self).dump(obj, *args, **kwargs)
+
+    with pytest.raises(TypeError):
+        serializers.Serializer(CustomSchema())
+
+
+def test_unknown_field():
+    """The fields without a compiled version are refused"""
+
+    class DateSchema(schemas.Schema):
+        """Schema with a date"""
+        date = marshmallow.fields.Date()
+
+    with pytest.raises(TypeError):
+        serializers.Serializer(DateSchema())
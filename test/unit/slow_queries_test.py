@@ -0,0 +1,112 @@
+"""Test the slow query log"""
+import collections
+import json
+import logging
+import unittest.mock as mock
+
+import peewee
+import pytest
+
+import utils.slow_queries as slow_queries
+
+
+@pytest.fixture(autouse=True)
+def recent(monkeypatch):
+    """Empty buffer of slow queries"""
+    recent = collections.deque(maxlen=2)
+    monkeypatch.setattr(slow_queries, 'recent', recent)
+    monkeypatch.setattr(slow_queries, 'THRESHOLD', 0.1)
+    monkeypatch.setattr(slow_queries, 'EXPLAIN', False)
+    return recent
+
+
+def test_redact():
+    """Only the numbers, booleans and NULL are kept"""
+    params = [1, 2.5, True, None, 'secret', b'secret', {'a': 1}, [3, 'b']]
+
+    assert slow_queries.redact(params) == [
+        1, 2.5, True, None, '<str>', '<bytes>', '<dict>', [3, '<str>']
+    ]
+
+
+def test_record_query(recent, caplog):
+    """The queries above the threshold are logged and kept"""
+    caplog.set_level(logging.WARNING, logger='rulzurapi.slow_queries')
+    slow_queries.record_query('SELECT 1', [], 0.05)
+    slow_queries.record_query('SELECT %s', ['name'], 0.5)
+
+    entry = json.loads(caplog.records[-1].getMessage())
+
+    assert len(caplog.records) == 1
+    assert list(recent) == [entry]
+    assert entry['sql'] == 'SELECT %s'
+    assert entry['params'] == ['<str>']
+    assert entry['duration_ms'] == 500
+    assert entry['endpoint'] is None
+    assert 'plan' not in entry
+
+
+def test_ring_buffer(recent):
+    """Only the last slow queries are kept"""
+    for index in range(3):
+        slow_queries.record_query('SELECT %d' % index, [], 1)
+
+    assert [entry['sql'] for entry in recent] == ['SELECT 1', 'SELECT 2']
+
+
+@pytest.mark.usefixtures('request_context')
+def test_record_query_endpoint(recent):
+    """The endpoint sending the query is recorded"""
+    slow_queries.record_query('SELECT 1', [], 1)
+
+    assert recent[0]['endpoint'] == 'index'
+
+
+def test_explain(recent, monkeypatch):
+    """The SELECT queries are explained, not the other statements"""
+    cursor = mock.Mock(fetchall=mock.Mock(return_value=[('Seq Scan',),
+                                                        ('Buffers',)]))
+    mock_execute_sql = mock.Mock(return_value=cursor)
+
+    monkeypatch.setattr(slow_queries, 'EXPLAIN', True)
+    monkeypatch.setattr('db.connector.database.atomic', mock.MagicMock())
+    monkeypatch.setattr('db.connector.database.execute_sql', mock_execute_sql)
+    slow_queries.record_query(' select * from t where id = %s', [1], 1)
+    slow_queries.record_query('DELETE FROM t', [], 1)
+
+    assert recent[0]['plan'] == 'Seq Scan\nBuffers'
+    assert recent[1]['plan'] is None
+    assert mock_execute_sql.call_args_list == [mock.call(
+        'EXPLAIN (ANALYZE, BUFFERS)  select * from t where id = %s', [1]
+    )]
+
+
+def test_explain_error(recent, monkeypatch):
+    """A failed EXPLAIN does not break the request"""
+    mock_execute_sql = mock.Mock(side_effect=peewee.ProgrammingError)
+
+    monkeypatch.setattr(slow_queries, 'EXPLAIN', True)
+    monkeypatch.setattr('db.connector.database.atomic', mock.MagicMock())
+    monkeypatch.setattr('db.connector.database.execute_sql', mock_execute_sql)
+    slow_queries.record_query('SELECT 1', [], 1)
+
+    assert recent[0]['plan'] is None
+
+
+def test_explain_side_effects(recent, monkeypatch):
+    """The selects calling functions are not run again, nor the failed ones"""
+    cursor = mock.Mock(fetchall=mock.Mock(return_value=[('Result',)]))
+    mock_execute_sql = mock.Mock(return_value=cursor)
+
+    monkeypatch.setattr(slow_queries, 'EXPLAIN', True)
+    monkeypatch.setattr('db.connector.database.atomic', mock.MagicMock())
+    monkeypatch.setattr('db.connector.database.execute_sql', mock_execute_sql)
+    slow_queries.record_query('SELECT pg_notify(%s, %s)', ['c', 'p'], 1)
+    slow_queries.record_query('SELECT * FROM t', [], 1,
+                              peewee.ProgrammingError())
+
+    assert recent[0]['plan'] == 'Result'
+    assert recent[1]['plan'] is None
+    assert mock_execute_sql.call_args_list == [
+        mock.call('EXPLAIN SELECT pg_notify(%s, %s)', ['c', 'p'])
+    ]
@@ -0,0 +1,68 @@
+"""Test the per request instrumentation"""
+import json
+import logging
+import unittest.mock as mock
+
+import flask
+import pytest
+
+import utils.timing as timing
+
+
+def test_server_timing():
+    """Test the Server-Timing header format"""
+    measures = {'db': 0.012, 'queries': 3, 'dump': 0.001, 'render': 0.0005}
+
+    assert timing.server_timing(measures, 0.02) == (
+        'db;dur=12.00;desc="3 queries", dump;dur=1.00, render;dur=0.50, '
+        'total;dur=20.00'
+    )
+
+
+@pytest.mark.usefixtures('request_context')
+def test_measure():
+    """The nested measures of a metric are counted once"""
+    timing.start()
+    with mock.patch('time.perf_counter', side_effect=[1.0, 2.0, 3.0, 5.0]):
+        with timing.measure('dump'):
+            with timing.measure('dump'):
+                pass
+        with timing.measure('render'):
+            pass
+
+    assert flask.g.timing['dump'] == 1.0
+    assert flask.g.timing['render'] == 2.0
+
+
+@pytest.mark.usefixtures('request_context')
+def test_record_query():
+    """The queries are counted with their duration"""
+    timing.start()
+    timing.record_query('SELECT 1', None, 0.5)
+    timing.record_query('SELECT 1', None, 0.25)
+
+    assert flask.g.timing['db'] == 0.75
+    assert flask.g.timing['queries'] == 2
+
+
+def test_outside_request():
+    """Nothing is measured outside of a request"""
+    timing.record_query('SELECT 1', None, 0.5)
+    with timing.measure('dump'):
+        pass
+
+
+def test_request(app, caplog):
+    """The measures are sent in a header and logged"""
+    caplog.set_level(logging.INFO, logger='rulzurapi.requests')
+    page = app.get('/')
+
+    metrics = [metric.split(';')[0]
+               for metric in page.headers['Server-Timing'].split(', ')]
+    log = json.loads(caplog.records[-1].getMessage())
+
+    assert metrics == ['db', 'dump', 'render', 'total']
+    assert log['path'] == '/'
+    assert log['endpoint'] == 'index'
+    assert log['status'] == 200
+    assert log['queries'] == 0
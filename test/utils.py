@@ -1,6 +1,7 @@
 """Utilities for testing"""
 
 import json
+import re
 import unittest.mock as mock
 
 import peewee
@@ -97,3 +98,171 @@ class MockEncoder(json.JSONEncoder):
         # Let the base class default method raise the TypeError
         return json.JSONEncoder.default(self, obj)
 
+
+# Values of the columns of the fake rows, the ids are numbered
+FAKE_VALUES = {
+    'directions': {}, 'difficulty': 1, 'people': 2,
+    'duration': '0/5', 'category': 'starter', 'quantity': 1,
+    'measurement': 'g',
+}
+
+SELECT_LIST = re.compile(r'^\s*SELECT (.*?) FROM ', re.DOTALL)
+RETURNING_LIST = re.compile(r' RETURNING (.*)$', re.DOTALL)
+TABLE = re.compile(r'(?:FROM|INTO|UPDATE) "\w+"\."(\w+)"')
+PRIMARY_KEY = re.compile(r'"id" (?:IN \(((?:%s, )*%s)\)|= (%s))')
+NAME = re.compile(r'"name" (?:IN \(|= %s)')
+VALUES_ROW = re.compile(r'\((?:%s|NULL)(?:, (?:%s|NULL|TRUE|FALSE))*\)')
+INSERT = re.compile(r'^\s*INSERT INTO "\w+"\."\w+" \(([^)]*)\) VALUES ')
+COLUMN = re.compile(r'(?:"(\w+)"|AS (\w+))$')
+QUOTED = re.compile(r'"(\w+)"')
+
+
+def split_columns(columns):
+    """Split a SQL select list on the commas out of the parentheses"""
+    items, depth, current = [], 0, ''
+    for char in columns:
+        depth += {'(': 1, ')': -1}.get(char, 0)
+        if char == ',' and not depth:
+            items.append(current.strip())
+            current = ''
+        else:
+            current += char
+    return items + [current.strip()]
+
+
+def fake_value(column, row_id):
+    """Value of a column of the fake row row_id"""
+    if column.startswith('fk_'):
+        return 1
+    if column == 'name':
+        return 'name_%d' % row_id
+    return FAKE_VALUES.get(column, 1)
+
+
+class FakeCursor(object):
+    """Cursor answering every statement with generated rows
+
+    The rows of a statement are:
+    * the rows given to an INSERT, their ids following sizes[table]
+    * the rows given to an update_many (UPDATE ... FROM (VALUES ...))
+    * one row per id looked up by primary key (id = %s or id IN (...))
+    * no row for a lookup by name, the names given are new ones
+    * sizes[table] rows otherwise, table being the first one the statement
+    reads or writes
+
+    The SELECT and RETURNING lists get those rows, a COUNT gets their number.
+    """
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.rows = []
+        self.description = None
+        self.rowcount = 0
+        self.name = None
+
+    def select(self, sql, params):
+        """Rows of a statement as dicts, the missing columns are generated"""
+        table = TABLE.search(sql)
+        size = self.sizes.get(table.group(1), 0) if table else 1
+
+        insert = INSERT.search(sql)
+        if insert:
+            columns = QUOTED.findall(insert.group(1))
+            values = [params[index:index + len(columns)]
+                      for index in range(0, len(params), len(columns))]
+            return [dict(zip(columns, row), id=size + index + 1)
+                    for index, row in enumerate(values)]
+
+        if ' AS var ' in sql:
+            return [{'id': params[sql[:row.start()].count('%s')]}
+                    for row in VALUES_ROW.finditer(sql)]
+
+        primary_key = PRIMARY_KEY.search(sql)
+        if primary_key:
+            offset = sql[:primary_key.start()].count('%s')
+            ids = (primary_key.group(1) or primary_key.group(2)).count('%s')
+            return [{'id': row_id} for row_id in params[offset:offset + ids]]
+
+        if NAME.search(sql):
+            return []
+
+        return [{'id': index + 1} for index in range(size)]
+
+    def execute(self, sql, params=None):
+        """Generate the rows of the statement"""
+        rows = self.select(sql, list(params or ()))
+        self.rowcount = len(rows)
+        columns = SELECT_LIST.search(sql) or RETURNING_LIST.search(sql)
+        if columns is None:
+            self.rows, self.description = [], None
+            return
+
+        names = []
+        for item in split_columns(columns.group(1)):
+            column = COLUMN.search(item)
+            names.append(column.group(1) or column.group(2) if column
+                         else item.split('(')[0].lower())
+        self.description = [(name,) for name in names]
+
+        if names == ['count']:
+            self.rows = [(len(rows),)]
+        else:
+            self.rows = [
+                tuple(row[name] if name in row else fake_value(name, row['id'])
+                      for name in names)
+                for row in rows
+            ]
+
+    def fetchone(self):
+        """Next row, None at the end"""
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchmany(self, size):
+        """Next rows"""
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def fetchall(self):
+        """Remaining rows"""
+        return self.fetchmany(len(self.rows))
+
+    def close(self):
+        """Nothing to release"""
+
+
+class QueryCounter(object):
+    """Count the statements sent to a database, without a database
+
+    The connection is replaced by a fake one answering with generated rows
+    (see FakeCursor), the statements go through the query hooks of the
+    database which count them. Use it as a context manager:
+
+        with QueryCounter(db.connector.database, {'recipe': 10}) as queries:
+            app.get('/recipes/')
+        assert len(queries) <= 1
+    """
+
+    def __init__(self, database, sizes=None):
+        self.database = database
+        self.sizes = sizes or {}
+        self.statements = []
+        connection = mock.Mock()
+        connection.cursor.side_effect = lambda **_: FakeCursor(self.sizes)
+        self.get_conn = mock.patch.object(database, 'get_conn',
+                                          return_value=connection)
+
+    def hook(self, sql, params, *_):
+        """Query hook recording the statements"""
+        self.statements.append((sql, params))
+
+    def __len__(self):
+        return len(self.statements)
+
+    def __enter__(self):
+        self.get_conn.start()
+        self.database.query_hooks.append(self.hook)
+        return self
+
+    def __exit__(self, *_):
+        self.database.query_hooks.remove(self.hook)
+        self.get_conn.stop()